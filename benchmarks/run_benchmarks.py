@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# Benchmarks of every pipeline stage on synthetic study areas
+# Usage: python run_benchmarks.py [<sizes> <stages> <historyFile> <distance>]
+#   sizes: comma separated center point counts, default 1000,10000,100000 (up to 1000000)
+#   stages: comma separated subset of segmentation,rays,water_arcs,quadrant,small_segments,reclassification
+#   historyFile: JSON lines history, default benchmarks/history.jsonl
+#   distance: ray length in meters, default 10000
+#
+# For each size a fractal coastline with marsh islands and its land/water polygons
+# are generated (see synthetic.py) and each stage is timed and its peak memory
+# measured: segmentation (shoreline.split_shoreline), ray generation
+# (rays.iter_rays), water arc selection (fetch.point_water_arcs), quadrant
+# analysis (fetch.fetch_matrix + quadrant.fetch_analysis), the small-segment
+# check (topology.check_small_segments) and raster reclassification
+# (marsh.classify_marsh on 16 pixels per center point). Every result is
+# appended to the history with the commit and machine, and compared with the
+# previous runs of the same stage, size, distance and machine: a stage more than 30%
+# slower or larger than their median is reported as a regression.
+
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import tempfile
+import subprocess
+
+import numpy as np
+
+bench_path = os.path.dirname(os.path.abspath(__file__))
+root_path = os.path.abspath(os.path.join(bench_path, '..'))
+sys.path.append(root_path)
+sys.path.append(bench_path)
+import synthetic
+from utils import fetch
+from utils import marsh
+from utils import quadrant
+from utils import rays
+from utils import shoreline
+from utils import telemetry
+from utils import topology
+
+
+STAGES = ['segmentation', 'rays', 'water_arcs', 'quadrant', 'small_segments', 'reclassification']
+
+# Slowdown (or growth of peak memory) over the median of the history reported as a regression
+REGRESSION = 1.3
+
+# Below these (seconds, MB) differences are timer and allocator noise
+NOISE = {'seconds': 0.1, 'peak_mb': 5.0}
+
+# Runs are only compared with earlier runs that agree on all of these: the stage, its
+# parameters and the machine
+MATCH_FIELDS = ('stage', 'size', 'distance', 'host', 'python', 'machine', 'cpus')
+
+
+def measure(func, *args):
+
+    """
+    Run func(*args) as a telemetry stage. Returns (result, seconds, peak MB above the start).
+    """
+
+    with telemetry.Stage(getattr(func, '__name__', 'stage'), always=True) as stage:
+        result = func(*args)
+    return result, stage.record['wall_s'], stage.record['rss_growth_mb']
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root_path, capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def count_rays(centers, distance):
+    return sum(len(batch[0]) for batch in rays.iter_rays(centers['ID'].values, centers.geometry.x.values,
+                                                         centers.geometry.y.values, distance, crs=centers.crs))
+
+
+def run_size(size, stages, distance, scratch):
+
+    """
+    All the requested stages on one synthetic study area. Returns {stage: (seconds, peak MB, items)}.
+    """
+
+    shore, landwater = synthetic.study_area(size)
+    results = {}
+
+    (ids, segments, midpoints, bearings), seconds, peak = measure(shoreline.split_shoreline, shore.geometry.values, 25.0)
+    if 'segmentation' in stages:
+        results['segmentation'] = (seconds, peak, len(ids))
+    centers = synthetic.gpd.GeoDataFrame({'ID': ids}, geometry=midpoints, crs=shore.crs)
+
+    if 'rays' in stages:
+        n, seconds, peak = measure(count_rays, centers, distance)
+        results['rays'] = (seconds, peak, n)
+
+    if {'water_arcs', 'quadrant', 'small_segments'} & set(stages):
+        water_arcs, seconds, peak = measure(fetch.point_water_arcs, centers, landwater, distance)
+        if 'water_arcs' in stages:
+            results['water_arcs'] = (seconds, peak, len(ids) * len(rays.BEARINGS))
+
+        def analysis():
+            matrix_ids, matrix = fetch.fetch_matrix(water_arcs, ids)
+            return quadrant.fetch_analysis(matrix_ids, matrix)
+
+        table, seconds, peak = measure(analysis)
+        if 'quadrant' in stages:
+            results['quadrant'] = (seconds, peak, len(table))
+
+        if 'small_segments' in stages:
+            arcs = synthetic.gpd.GeoDataFrame({'ID': ids}, geometry=segments, crs=shore.crs).merge(table, on='ID')
+            checked, seconds, peak = measure(topology.check_small_segments, arcs)
+            results['small_segments'] = (seconds, peak, len(arcs))
+
+    if 'reclassification' in stages:
+        dem_path = os.path.join(scratch, 'dem_' + str(size) + '.tif')
+        prediction_path = os.path.join(scratch, 'prediction_' + str(size) + '.tif')
+        pixels = synthetic.marsh_rasters(dem_path, prediction_path, 16 * size)
+        _, seconds, peak = measure(marsh.classify_marsh, dem_path, prediction_path,
+                                   os.path.join(scratch, 'marsh_' + str(size) + '.tif'))
+        results['reclassification'] = (seconds, peak, pixels)
+
+    return results
+
+
+def regressions(history, record):
+
+    """
+    Compare a record with the earlier runs of the same stage, parameters (size, ray distance)
+    and machine (MATCH_FIELDS). Returns a message per metric above REGRESSION times their median.
+    """
+
+    key = tuple(record.get(field) for field in MATCH_FIELDS)
+    earlier = [r for r in history if tuple(r.get(field) for field in MATCH_FIELDS) == key]
+    messages = []
+    for metric in ('seconds', 'peak_mb'):
+        values = [r[metric] for r in earlier[-5:]]
+        if values and record[metric] > max(REGRESSION * np.median(values), np.median(values) + NOISE[metric]):
+            messages.append("%s %d: %s %.2f vs median %.2f" % (record['stage'], record['size'], metric,
+                                                               record[metric], np.median(values)))
+    return messages
+
+
+if __name__ == "__main__":
+
+    sizes = [int(s) for s in sys.argv[1].split(',')] if len(sys.argv) > 1 else [1000, 10000, 100000]
+    stages = sys.argv[2].split(',') if len(sys.argv) > 2 and sys.argv[2] != 'all' else STAGES
+    history_path = sys.argv[3] if len(sys.argv) > 3 else os.path.join(bench_path, 'history.jsonl')
+    distance = float(sys.argv[4]) if len(sys.argv) > 4 else 10000.0
+
+    history = []
+    if os.path.exists(history_path):
+        with open(history_path) as f:
+            history = [json.loads(line) for line in f if line.strip()]
+
+    run = {'commit': git_commit(), 'time': time.strftime("%Y-%m-%dT%H:%M:%S"), 'host': socket.gethostname(),
+           'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count(),
+           'distance': distance}
+
+    found = []
+    with tempfile.TemporaryDirectory() as scratch, open(history_path, 'a') as out:
+        for size in sizes:
+            for stage, (seconds, peak, items) in run_size(size, stages, distance, scratch).items():
+                record = dict(run, stage=stage, size=size, items=items, seconds=round(seconds, 4),
+                              peak_mb=round(peak, 1), items_per_s=round(items / max(seconds, 1e-9), 1))
+                out.write(json.dumps(record) + "\n")
+                print("%-17s %8d  %9.3f s  %8.1f MB  %12.0f items/s" % (stage, size, seconds, peak,
+                                                                        record['items_per_s']))
+                found.extend(regressions(history, record))
+
+    for message in found:
+        print("REGRESSION " + message)
+    sys.exit(1 if found else 0)
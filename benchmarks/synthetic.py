@@ -0,0 +1,133 @@
+# Synthetic study areas for the benchmarks.
+#
+# The coastline is a fractal (random midpoint displacement) curve running
+# west to east, built in tiles so its amplitude stays bounded however long it
+# gets; land lies south of it, water north, and small irregular marsh islands
+# are scattered in the water near the shore. Every tile has its own land and
+# water polygon, as a Step2 layer clipped to a grid would. The length of the
+# coastline is chosen so that splitting the shoreline every `spacing` meters
+# gives about the requested number of center points.
+
+import numpy as np
+import shapely
+import geopandas as gpd
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+
+CRS = "EPSG:26918"
+
+# Origin of the synthetic study areas (UTM 18N, lower Chesapeake Bay)
+X0 = 380000.0
+Y0 = 4100000.0
+
+
+def midpoint_displacement(levels, amplitude, roughness, rng):
+
+    """
+    Fractal profile of 2**levels + 1 values, zero at both ends.
+    """
+
+    y = np.zeros(2 ** levels + 1)
+    step = 2 ** levels
+    scale = amplitude
+    while step > 1:
+        half = step // 2
+        mid = np.arange(half, len(y), step)
+        y[mid] = (y[mid - half] + y[mid + half]) / 2 + rng.normal(0.0, scale, len(mid))
+        step = half
+        scale *= roughness
+    return y
+
+
+def fractal_coastline(n_points, spacing=25.0, tile_length=20000.0, levels=11, amplitude=500.0,
+                      roughness=0.55, seed=0):
+
+    """
+    Coastline tiles long enough for about n_points center points at `spacing`.
+    Returns a list of (x, y) vertex arrays, one per tile, joined end to end.
+    """
+
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0.0, tile_length, 2 ** levels + 1)
+    tiles, length = [], 0.0
+    while length < n_points * spacing:
+        y = midpoint_displacement(levels, amplitude, roughness, rng)
+        x0 = X0 + len(tiles) * tile_length
+        tiles.append(np.c_[x0 + x, Y0 + y])
+        length += np.hypot(np.diff(x), np.diff(y)).sum()
+    return tiles
+
+
+def marsh_islands(tile, count, rng, min_offset=100.0, max_offset=2000.0, vertices=12):
+
+    """
+    Irregular islands a few tens of meters across in the water north of one coastline tile.
+    """
+
+    x = rng.uniform(tile[0, 0] + 100, tile[-1, 0] - 100, count)
+    y = np.interp(x, tile[:, 0], tile[:, 1]) + rng.uniform(min_offset, max_offset, count)
+    theta = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    radius = rng.uniform(5.0, 30.0, count)[:, None] * rng.uniform(0.6, 1.4, (count, vertices))
+    ring = np.stack([x[:, None] + radius * np.sin(theta), y[:, None] + radius * np.cos(theta)], axis=-1)
+    islands = shapely.polygons(np.concatenate([ring, ring[:, :1]], axis=1))
+    return shapely.make_valid(islands)
+
+
+def study_area(n_points, spacing=25.0, islands_per_km=2.0, land_depth=5000.0, water_width=15000.0, seed=0):
+
+    """
+    Synthetic shoreline and Step2 land/water layer.
+    Returns (shoreline, landwater): GeoDataFrames of shoreline LineStrings (coast and island
+    rings) and of land/water polygons with the surface field.
+    """
+
+    rng = np.random.default_rng(seed)
+    tiles = fractal_coastline(n_points, spacing, seed=seed)
+    lines, polygons, surface = [], [], []
+    for tile in tiles:
+        x0, x1 = tile[0, 0], tile[-1, 0]
+        land = shapely.Polygon(np.vstack([tile, [[x1, Y0 - land_depth], [x0, Y0 - land_depth]]]))
+        water = shapely.Polygon(np.vstack([tile, [[x1, Y0 + water_width], [x0, Y0 + water_width]]]))
+        count = int(islands_per_km * (x1 - x0) / 1000.0)
+        islands = marsh_islands(tile, count, rng)
+        islands = islands[~shapely.intersects(islands, land)]
+        islands = shapely.get_parts(shapely.union_all(islands))
+
+        lines.append(shapely.LineString(tile))
+        lines.extend(shapely.get_exterior_ring(islands))
+        polygons.extend([land, shapely.difference(water, shapely.union_all(islands))])
+        surface.extend(['land', 'water'])
+        polygons.extend(islands)
+        surface.extend(['land'] * len(islands))
+
+    shoreline = gpd.GeoDataFrame({'shoreline': ['shl'] * len(lines)}, geometry=lines, crs=CRS)
+    landwater = gpd.GeoDataFrame({'surface': surface}, geometry=polygons, crs=CRS)
+    return shoreline, landwater
+
+
+def marsh_rasters(dem_path, prediction_path, n_pixels, resolution=1.0, seed=0):
+
+    """
+    A smooth synthetic DEM (m, about -1 to 2) and a marsh prediction (0 = not marsh, 1/2 = marsh)
+    of about n_pixels on the same grid, written as tiled GeoTIFFs.
+    """
+
+    rng = np.random.default_rng(seed)
+    side = int(np.sqrt(n_pixels))
+    transform = from_origin(X0, Y0 + side * resolution, resolution, resolution)
+    meta = {"driver": "GTiff", "width": side, "height": side, "count": 1, "crs": CRS, "transform": transform,
+            "tiled": True, "blockxsize": 256, "blockysize": 256}
+
+    u = np.linspace(0, 6 * np.pi, side)
+    with rasterio.open(dem_path, "w", dtype="float32", **meta) as dem, \
+            rasterio.open(prediction_path, "w", dtype="uint8", **meta) as prediction:
+        for row in range(0, side, 1024):
+            rows = slice(row, min(row + 1024, side))
+            block = 0.5 + 1.2 * np.sin(u[rows, None]) * np.cos(u[None, :] * 0.7)
+            block += rng.normal(0, 0.05, block.shape)
+            window = Window(0, row, side, block.shape[0])
+            dem.write(block.astype(np.float32), 1, window=window)
+            prediction.write(rng.integers(0, 3, block.shape, dtype=np.uint8), 1, window=window)
+    return side * side
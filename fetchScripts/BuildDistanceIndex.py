@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Distance index: build or update the tiled distance-to-land field used by the "distance" fetch mode
+# Usage: python BuildDistanceIndex.py <workspace> <landwaterPolygon> <indexFolder> [<resolution>]
+#
+# Build it once from the regional land/water layer (the labelled polygons of
+# chesbay_arcs_clip) and point the county runs of Step3 (mode "distance") or
+# RunFetchPipeline.py at <indexFolder>. Rerunning after a shoreline edit only
+# recomputes the tiles around the edited stretch (see utils/distance_field.py).
+# Output: <indexFolder>/index.json and one tile_<i>_<j>.npy per tile near the shore
+
+import os
+import sys
+root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(root_path)
+from utils import distance_field
+from utils import store
+from utils import telemetry
+
+
+if __name__ == "__main__":
+
+    # Script arguments
+    workspace = sys.argv[1]
+    landwaterPolygon = sys.argv[2]
+    indexFolder = sys.argv[3]
+    resolution = float(sys.argv[4]) if len(sys.argv) > 4 else distance_field.RESOLUTION
+
+    with telemetry.Stage("distance_index.read") as stage:
+        landwater = store.read_layer(workspace, landwaterPolygon, columns=["surface"])
+        stage.items = len(landwater)
+    with telemetry.Stage("distance_index.build", items=len(landwater), resolution=resolution):
+        rebuilt = distance_field.build_index(landwater, indexFolder, resolution)
+
+    print("Script complete: " + str(rebuilt) + " tiles rebuilt in " + indexFolder)
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# Incremental fetch: Steps 3 and 4 after a shoreline edit
+# Usage: python IncrementalFetch.py <workspaceGDB> <landwaterPolygon> <SplitShoreline> <CenterPoints> <name> <cacheFolder> [<distance>]
+#
+# Rerun Step1 and Step2 on the edited shoreline first. This script then compares
+# the new land/water layer with the one cached from the last run, recomputes the
+# water arcs and quadrant analysis only for center points that are new or whose
+# water arcs touch the edited shoreline (see utils/fetch_cache.py), reuses the
+# cached results for all others, and writes the same outputs as Step3 and Step4.
+# Set TMI_TELEMETRY to record the time and memory of each stage (see utils/telemetry.py).
+# Output: {name}_water_arcs_all_{date}, {name}_fetch_withQuadAnalysis_points_{date}_Final,
+#         {name}_fetch_withQuadAnalysis_arcs_{date}_Final
+
+import os
+import sys
+from time import strftime
+root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(root_path)
+from utils import fetch_cache
+from utils import store
+from utils import telemetry
+
+# Script arguments
+workspaceGDB = sys.argv[1]
+landwaterPolygon = sys.argv[2]
+SplitShoreline = sys.argv[3]
+CenterPoints = sys.argv[4]
+name = sys.argv[5]
+cacheFolder = sys.argv[6]
+distance = float(sys.argv[7]) if len(sys.argv) > 7 else 10000.0
+
+# Local variables:
+date = strftime("%m_%d_%Y")
+
+with telemetry.Stage("incremental.read") as stage:
+    landwater = store.read_layer(workspaceGDB, landwaterPolygon)
+    split_shoreline = store.read_layer(workspaceGDB, SplitShoreline)
+    center_points = store.read_layer(workspaceGDB, CenterPoints)
+    stage.items = len(landwater) + len(split_shoreline) + len(center_points)
+
+with telemetry.Stage("incremental.fetch", distance=distance) as stage:
+    water_arcs, analysis, recomputed = fetch_cache.incremental_fetch(center_points, landwater, cacheFolder, distance)
+    stage.items = len(recomputed)
+print(str(len(recomputed)) + " of " + str(len(center_points)) + " center points recomputed")
+
+with telemetry.Stage("incremental.write", items=len(water_arcs) + len(center_points) + len(split_shoreline)):
+    store.write_layer(water_arcs, workspaceGDB, name + "_water_arcs_all_" + strftime("%m%d%Y"))
+
+    attributes = [field for field in analysis.columns if field != "ID"]
+    finalPtName = name + "_fetch_withQuadAnalysis_points_" + date + "_Final"
+    store.write_layer(center_points.drop(columns=attributes, errors="ignore").merge(analysis, on="ID", how="left"),
+                      workspaceGDB, finalPtName)
+
+    finalArcName = name + "_fetch_withQuadAnalysis_arcs_" + date + "_Final"
+    store.write_layer(split_shoreline.drop(columns=attributes, errors="ignore").merge(analysis, on="ID", how="left"),
+                      workspaceGDB, finalArcName)
+
+print("Script complete")
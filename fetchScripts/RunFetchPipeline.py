@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Fetch pipeline: Steps 1-5 in one run, skipping what has not changed
+# Usage: python RunFetchPipeline.py <workspace> <Shoreline> <landwaterPolygon> <name> <cacheFolder> [<outputWorkspace> <Distance> <Distance_Expression> <mode> <workers> <smoothLength> <angleStep> <indexFolder>]
+#
+# Replaces launching the five tools in order and passing the dated output names
+# between them by hand. The steps are cached by the content of the shoreline and
+# land/water layers and by their parameters (see utils/pipeline.py): rerunning
+# after changing only, say, the smoothing length redoes only Step5, and a run
+# that stopped partway through Step3 picks up with the center points not yet
+# done. The land/water polygons must already be labelled (Step2).
+# angleStep sets the degrees between the fetch rays (22.5, the 16 Step1 directions, by default).
+# mode "distance" uses the shared distance index in indexFolder (BuildDistanceIndex.py),
+# or builds one in the cache folder when none is given.
+# Output: the Step1, Step3, Step4 and Step5 layers in <outputWorkspace> (the input workspace by default)
+
+import os
+import sys
+root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(root_path)
+from utils import pipeline
+from utils import shoreline
+
+
+if __name__ == "__main__":
+
+    # Script arguments
+    workspace = sys.argv[1]
+    Shoreline = sys.argv[2]
+    landwaterPolygon = sys.argv[3]
+    name = sys.argv[4]
+    cacheFolder = sys.argv[5]
+    outputWorkspace = sys.argv[6] if len(sys.argv) > 6 else workspace
+    Distance = shoreline.parse_distance(sys.argv[7]) if len(sys.argv) > 7 else 25.0
+    Distance_Expression = float(sys.argv[8]) if len(sys.argv) > 8 else 10000.0
+    mode = sys.argv[9] if len(sys.argv) > 9 else "vector"
+    workers = int(sys.argv[10]) if len(sys.argv) > 10 else None
+    smoothLength = float(sys.argv[11]) if len(sys.argv) > 11 and sys.argv[11] != "-" else None
+    angleStep = float(sys.argv[12]) if len(sys.argv) > 12 else 22.5
+    indexFolder = sys.argv[13] if len(sys.argv) > 13 else None
+
+    pipeline.run_fetch_pipeline(workspace, Shoreline, landwaterPolygon, name, cacheFolder, outputWorkspace,
+                                workers=workers, spacing=Distance, distance=Distance_Expression, mode=mode,
+                                smooth_length=smoothLength, angle_step=angleStep,
+                                index_dir=indexFolder)
+
+    print("Script complete")
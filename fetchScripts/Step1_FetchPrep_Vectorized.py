@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# Step 1 (vectorized): Fetch Prep without ArcPro
+# Usage: python Step1_FetchPrep_Vectorized.py <workspaceGDB> <Shoreline> <Distance> <name> [<Distance_Expression> <angleStep>]
+#
+# Same outputs as Step1_FetchPrep.py: the shoreline is dissolved and split every
+# Distance (e.g. "25 Meters") in one vectorized pass (see utils/shoreline.py),
+# with splitID/ID numbered from 1 like OBJECTID, and a center point is made for
+# every piece. shoreline_Dissolved and GeneratePoint are not written.
+# Passing "-" as Distance_Expression skips the BearingDistance arcs; Step3
+# (Step3_SelectWaterArcs_Batched.py with "-") then generates the rays itself.
+# angleStep (degrees, 22.5 by default) sets the bearings of the arcs: any step
+# that divides 360, with directions named d000, d010, ... when it is not 22.5.
+# A workspace ending in ".store" is written as GeoParquet (see utils/store.py).
+# Set TMI_TELEMETRY to record the time and memory of each stage (see utils/telemetry.py).
+# Output: SplitLineAtPoint_{name}, SplitLine_center_point_{name}_{date}, [BearingDistance_arcs_{name}_{date}]
+
+import os
+import sys
+from time import strftime
+root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(root_path)
+import geopandas as gpd
+from utils import rays
+from utils import shoreline
+from utils import store
+from utils import telemetry
+
+# Script arguments
+workspaceGDB = sys.argv[1]
+Shoreline = sys.argv[2]                 # Shoreline="Worcester_lubc"
+Distance = sys.argv[3]                  # Distance="25 Meters"
+name = sys.argv[4]                      # name="Worcester"
+Distance_Expression = sys.argv[5] if len(sys.argv) > 5 else "10000"
+angleStep = float(sys.argv[6]) if len(sys.argv) > 6 else 22.5
+
+# Local variables:
+thedate = strftime("%m_%d_%Y")
+
+SplitLineAtPoint = "SplitLineAtPoint_" + name
+LineCtrPnt = "SplitLine_center_point_" + name + "_" + thedate
+BearingDist = "BearingDistance_arcs_" + name + "_" + thedate
+
+with telemetry.Stage("step1.read") as stage:
+    shore = store.read_layer(workspaceGDB, Shoreline, columns=[])
+    stage.items = len(shore)
+
+with telemetry.Stage("step1.split", distance=Distance) as stage:
+    ids, segments, midpoints, bearings = shoreline.split_shoreline(shore.geometry.values,
+                                                                  shoreline.parse_distance(Distance))
+    stage.items = len(ids)
+
+with telemetry.Stage("step1.write", items=len(ids)):
+    split = gpd.GeoDataFrame({"splitID": ids, "ID": ids, "bearing": bearings}, geometry=segments, crs=shore.crs)
+    store.write_layer(split, workspaceGDB, SplitLineAtPoint)
+
+    centers = gpd.GeoDataFrame({"splitID": ids, "ID": ids}, geometry=midpoints, crs=shore.crs)
+    centers["POINT_X"] = centers.geometry.x
+    centers["POINT_Y"] = centers.geometry.y
+    store.write_layer(centers, workspaceGDB, LineCtrPnt)
+
+if Distance_Expression != "-":
+    directions, bearings = rays.angular_directions(angleStep)
+    with telemetry.Stage("step1.bearing_arcs", items=len(bearings) * len(ids)):
+        store.write_layer(rays.bearing_frame(centers, float(Distance_Expression), bearings=bearings,
+                                             directions=directions), workspaceGDB, BearingDist)
+
+print("process completed: " + str(len(ids)) + " segments")
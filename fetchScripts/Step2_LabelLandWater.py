@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# Step2 labelling: fill in the surface field of the land/water polygons without editing them by hand
+# Usage: python Step2_LabelLandWater.py <workspace> <landwaterPolygon> <referenceWorkspace> <referenceLayer> [<waterPoints>]
+#
+# Run after Step2 has written {name}_LandWaterPoly_{date}. The polygons are
+# labelled by a flood fill over the polygons sharing shoreline (see
+# utils/landwater.py), seeded by a reference water mask:
+#   <referenceWorkspace> <referenceLayer>: a labelled land/water layer (the
+#       regional one or a previous run), or a layer of water polygons only;
+#   <referenceWorkspace> alone: a distance index folder (BuildDistanceIndex.py),
+#       with "-" as <referenceLayer>;
+#   "-" "-": no reference, only the water points.
+# <waterPoints> "x,y;x,y" are points known to be in open water, in the CRS of
+# the layer; they win over the reference.
+# Output: the surface field of <landwaterPolygon> is filled in and a surface_qc
+# field says which polygons to review (shoreline not alternating, reference
+# disagreeing, or nothing to seed their part).
+
+import os
+import sys
+import shapely
+root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(root_path)
+from utils import distance_field
+from utils import landwater
+from utils import store
+from utils import telemetry
+
+
+if __name__ == "__main__":
+
+    # Script arguments
+    workspace = sys.argv[1]
+    landwaterPolygon = sys.argv[2]
+    # "Lancaster_LandWaterPoly_01_26_2016"
+    referenceWorkspace = sys.argv[3]
+    referenceLayer = sys.argv[4]
+    # "chesbay_landwater_poly"
+    waterPoints = sys.argv[5] if len(sys.argv) > 5 else None
+
+    with telemetry.Stage("step2.read") as stage:
+        polygons = store.read_layer(workspace, landwaterPolygon)
+        if referenceLayer != "-":
+            reference = store.read_layer(referenceWorkspace, referenceLayer).to_crs(polygons.crs)
+        elif os.path.exists(os.path.join(referenceWorkspace, distance_field.INDEX_FILE)):
+            reference = distance_field.DistanceIndex(referenceWorkspace)
+        else:
+            reference = None
+        stage.items = len(polygons)
+
+    points = None
+    if waterPoints:
+        points = shapely.points([[float(c) for c in xy.split(",")] for xy in waterPoints.split(";")])
+
+    with telemetry.Stage("step2.label", items=len(polygons)):
+        labelled = landwater.label_surfaces(polygons, reference=reference, water_points=points)
+
+    with telemetry.Stage("step2.write", items=len(labelled)):
+        store.write_layer(labelled, workspace, landwaterPolygon)
+
+    print(labelled["surface"].value_counts(dropna=False).to_string())
+    print("Script complete: " + str(labelled["surface_qc"].notna().sum()) + " polygons flagged in surface_qc")
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Step3_SelectWaterArcs_Batched.py
+# Usage: python Step3_SelectWaterArcs_Batched.py <workspace> <landwaterPolygon> <BearingDistance> <SplitLine_center_point> <name> [<mode> <resolution> <distance> <angleStep> <indexFolder>]
+# Description:
+# Open-source version of Step3 that does not need ArcPro.
+# Instead of looping over FromValue..ToValue one ID at a time, every bearing
+# arc is intersected with the water polygons in one batched pass
+# (see utils/fetch.py) and the arcs leaving each center point are written to
+# {name}_water_arcs_all_{date} with the same fields as ResultingWaterArcs
+# (ID, direction, Shape_Length). The output is the WaterArcs input of Step4.
+# mode "raster" rasterizes the land/water polygons at <resolution> meters into
+# a memory-mapped grid and marches the 16 bearings up to <distance> meters
+# instead (see utils/fetch_raster.py); used for statewide runs.
+# mode "firsthit" only looks for the nearest shoreline crossing along each
+# bearing using a segment index over the water boundaries (see utils/first_hit.py).
+# Passing "-" as <BearingDistance> generates the 16 geodesic rays of <distance>
+# meters from the center points on the fly (see utils/rays.py), so Step1 does
+# not need to write the BearingDistance_arcs layer.
+# mode "distance" sphere-traces the rays over the tiled distance-to-land index
+# in <indexFolder> (see utils/distance_field.py), which is shared between
+# study areas: build it once from the regional layer with BuildDistanceIndex.py.
+# The shared index is only read; a missing index, one at another <resolution>,
+# and center points in another CRS or outside its tiles stop the script.
+# Without <indexFolder> a private index of <landwaterPolygon> is built (and kept
+# up to date) in {landwaterPolygon}_distance_index next to the workspace.
+# <angleStep> (degrees, 22.5 by default) sets the rays generated here (raster,
+# distance, firsthit and "-"); a BearingDistance layer brings its own directions.
+# A workspace ending in ".store" is read and written as GeoParquet (see utils/store.py).
+# Set TMI_TELEMETRY to record the time and memory of each stage (see utils/telemetry.py).
+# ---------------------------------------------------------------------------
+
+import os
+import sys
+import datetime
+root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(root_path)
+from utils import fetch
+from utils import fetch_raster
+from utils import first_hit
+from utils import distance_field
+from utils import rays
+from utils import store
+from utils import telemetry
+
+# Script arguments
+workspace = sys.argv[1]
+# "C:\\myworkspace\\Exposure_by_County\\Lancaster_2015\\working\\working_Lancaster_FileGDB_v10_1.gdb"
+
+landwaterPolygon = sys.argv[2]
+# "Lancaster_LandWaterPoly_01_26_2016"
+
+BearingDistance = sys.argv[3]
+# "BearingDistance_arcs_Lancaster_01_26_2016"
+
+SplitLine_center_point = sys.argv[4]
+# "SplitLine_center_point_Lancaster_01_26_2016"
+
+name = sys.argv[5]
+# "Calvert"
+
+mode = sys.argv[6] if len(sys.argv) > 6 else "vector"
+resolution = float(sys.argv[7]) if len(sys.argv) > 7 else 5.0
+distance = float(sys.argv[8]) if len(sys.argv) > 8 else 10000.0
+angleStep = float(sys.argv[9]) if len(sys.argv) > 9 else 22.5
+indexFolder = sys.argv[10] if len(sys.argv) > 10 else None
+
+# Local variables:
+date = datetime.date.today().strftime("%m%d%Y")
+ResultingWaterArcs = name + "_water_arcs_all_" + date
+directions, bearings = rays.angular_directions(angleStep)
+
+# Read the Step1 and Step2 outputs
+with telemetry.Stage("step3.read") as stage:
+    center_points = store.read_layer(workspace, SplitLine_center_point, columns=["ID"])
+    landwater = store.read_layer(workspace, landwaterPolygon, columns=["surface"])
+    stage.items = len(center_points) + len(landwater)
+
+if mode == "raster":
+    # Rasterize the land/water polygons next to the workspace, then march the rays
+    grid_path = os.path.join(os.path.dirname(os.path.abspath(workspace)),
+                             fetch_raster.grid_name(landwaterPolygon, resolution))
+    with telemetry.Stage("step3.rasterize", items=len(landwater), resolution=resolution):
+        fetch_raster.rasterize_landwater(landwater, grid_path, resolution)
+elif mode == "distance":
+    with telemetry.Stage("step3.distance_index", items=len(landwater), resolution=resolution):
+        if indexFolder is None:
+            # Private index of this study area, only its changed tiles are rebuilt
+            indexFolder = os.path.join(os.path.dirname(os.path.abspath(workspace)),
+                                       landwaterPolygon + "_distance_index")
+            distance_field.build_index(landwater, indexFolder, resolution)
+        # The shared regional index is never written by a county run
+        index = distance_field.open_index(indexFolder, resolution)
+        index.check(center_points.crs, center_points.geometry.x.values, center_points.geometry.y.values)
+with telemetry.Stage("step3.water_arcs", items=len(center_points), mode=mode, distance=distance):
+    if mode == "raster":
+        water_arcs = fetch_raster.raster_fetch(center_points, grid_path, distance, bearings=bearings,
+                                               directions=directions)
+    elif mode == "distance":
+        # Jump across open water with the distance index
+        water_arcs = distance_field.distance_water_arcs(center_points, index, distance, bearings=bearings,
+                                                        directions=directions)
+    elif mode == "firsthit":
+        # Nearest shoreline crossing along each bearing
+        water_arcs = first_hit.first_hit_water_arcs(center_points, landwater, distance, bearings=bearings,
+                                                    directions=directions)
+    elif BearingDistance == "-":
+        # Generate the rays batch by batch and select their water arcs
+        water_arcs = fetch.point_water_arcs(center_points, landwater, distance, bearings=bearings,
+                                            directions=directions)
+    else:
+        # Select the water arcs for all IDs at once
+        bearing_arcs = store.read_layer(workspace, BearingDistance, columns=["ID", "direction"])
+        water_arcs = fetch.select_water_arcs(bearing_arcs, center_points, landwater)
+
+with telemetry.Stage("step3.write", items=len(water_arcs)):
+    store.write_layer(water_arcs, workspace, ResultingWaterArcs)
+
+print("process completed: " + str(len(water_arcs)) + " water arcs written to " + ResultingWaterArcs)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Step3_SelectWaterArcs_Sharded.py
+# Usage: python Step3_SelectWaterArcs_Sharded.py <workspace> <landwaterPolygon> <BearingDistance> <SplitLine_center_point> <name> <scratchFolder> [<workers> <mode> <angleStep> <indexFolder> <resolution>]
+# Description:
+# Runs Step3 on all cores instead of several ArcPro sessions with hand-picked
+# FromValue/ToValue. The ID range is split into shards weighted by the amount
+# of shoreline around each center point, each shard writes
+# {name}_water_arcs_<from>_<to>_<date>.parquet in the scratch folder, and the
+# shards are merged into {name}_water_arcs_all_{date} in the workspace.
+# angleStep (degrees, 22.5 by default) sets the rays of the raster, distance and firsthit modes.
+# resolution (m, 5 by default) is the cell size of the raster mode's land grid and of the distance index.
+# mode "distance" traces the rays over the distance index in <indexFolder>
+# (see utils/distance_field.py), shared with Step3_SelectWaterArcs_Batched.py and
+# only read (build it with BuildDistanceIndex.py); without it a private index of
+# <landwaterPolygon> is built in the scratch folder ("-" as <indexFolder> to give
+# a <resolution> without an index folder).
+# ---------------------------------------------------------------------------
+
+import os
+import sys
+import datetime
+root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(root_path)
+from utils import sharding
+from utils import store
+from utils import telemetry
+
+
+if __name__ == "__main__":
+
+    # Script arguments
+    workspace = sys.argv[1]
+    landwaterPolygon = sys.argv[2]
+    BearingDistance = sys.argv[3]
+    SplitLine_center_point = sys.argv[4]
+    name = sys.argv[5]
+    scratchFolder = sys.argv[6]
+    workers = int(sys.argv[7]) if len(sys.argv) > 7 else None
+    mode = sys.argv[8] if len(sys.argv) > 8 else "vector"
+    angleStep = float(sys.argv[9]) if len(sys.argv) > 9 else 22.5
+    indexFolder = sys.argv[10] if len(sys.argv) > 10 and sys.argv[10] != "-" else None
+    resolution = float(sys.argv[11]) if len(sys.argv) > 11 else 5.0
+
+    # Local variables:
+    date = datetime.date.today().strftime("%m%d%Y")
+    ResultingWaterArcs = name + "_water_arcs_all_" + date
+
+    with telemetry.Stage("step3.sharded", mode=mode, workers=workers) as stage:
+        water_arcs = sharding.sharded_water_arcs(workspace, landwaterPolygon, BearingDistance, SplitLine_center_point,
+                                                 name, scratchFolder, workers=workers, mode=mode,
+                                                 resolution=resolution, angle_step=angleStep, index_dir=indexFolder)
+        stage.items = len(water_arcs)
+    with telemetry.Stage("step3.write", items=len(water_arcs)):
+        store.write_layer(water_arcs, workspace, ResultingWaterArcs)
+
+    print("process completed: " + str(len(water_arcs)) + " water arcs written to " + ResultingWaterArcs)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# Step4 (columnar): Fetch Analysis without ArcPro
+# Usage: python Step4_FetchAnalysis_Columnar.py <workspaceGDB> <WaterArcs> <SplitShoreline> <CenterPoints> <name> [<angleStep>]
+#
+# Same outputs as Step4_FetchAnalysis_ArcPro_June2022.py, but instead of the
+# Statistics/PivotTable/JoinField chain and the ~60 select and calculate passes
+# of the quadrant analysis, the water arcs are pivoted once into an (N, 16)
+# fetch matrix and every field (direction lengths, MAX_Shape_Length, maxDir,
+# exposure, quadrant counts/means, MaxQFetch, MaxQuadDir, MxQExpCode, ...) is
+# computed from it in one vectorized pass (see utils/quadrant.py).
+# With water arcs cast at another angleStep than 22.5 degrees the matrix has one
+# column per direction (d000, d010, ...) and each quadrant takes every direction
+# of its 90 degree sector. <angleStep> must be the one Step3 cast the arcs at:
+# arcs in directions the analysis does not have stop the script with an error.
+# The SPM/CERC effective fetch along each of the 16 compass directions is added
+# as EF_n ... EF_nnw, with its maximum and direction in MaxEffFetch/MaxEffDir.
+# A workspace ending in ".store" is read and written as GeoParquet and also
+# receives the fetch matrix as {name}_fetch_matrix_{date} (see utils/store.py).
+# Set TMI_TELEMETRY to record the time and memory of each stage (see utils/telemetry.py).
+# Output: {name}_fetch_withQuadAnalysis_points_{date}_Final, {name}_fetch_withQuadAnalysis_arcs_{date}_Final
+
+import os
+import sys
+from time import strftime
+root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(root_path)
+import numpy as np
+from utils import fetch
+from utils import quadrant
+from utils import rays
+from utils import store
+from utils import telemetry
+
+# Script arguments
+workspaceGDB = sys.argv[1]
+WaterArcs = sys.argv[2]
+SplitShoreline = sys.argv[3]
+CenterPoints = sys.argv[4]
+name = sys.argv[5]
+angleStep = float(sys.argv[6]) if len(sys.argv) > 6 else 22.5
+
+# Local variables:
+date = strftime("%m_%d_%Y")
+directions, bearings = rays.angular_directions(angleStep)
+
+with telemetry.Stage("step4.read") as stage:
+    water_arcs = store.read_layer(workspaceGDB, WaterArcs, columns=["ID", "direction", "Shape_Length"], ignore_geometry=True)
+    split_shoreline = store.read_layer(workspaceGDB, SplitShoreline)
+    center_points = store.read_layer(workspaceGDB, CenterPoints)
+    stage.items = len(water_arcs) + len(split_shoreline) + len(center_points)
+
+# Pivot the water arcs into the fetch matrix, one row per center point ID
+with telemetry.Stage("step4.fetch_matrix", items=len(water_arcs)):
+    ids = np.unique(center_points["ID"].values)
+    ids, matrix = fetch.fetch_matrix(water_arcs, ids, directions)
+    # MAX_Shape_Length and maxDir are the statistics of the individual arcs, as in Step4
+    _, longest = fetch.fetch_matrix(water_arcs, ids, directions, reduce='max')
+    if store.is_store(workspaceGDB):
+        store.write_matrix(workspaceGDB, name + "_fetch_matrix_" + date, ids, matrix, directions)
+
+# Direction fields, maximum arc, exposure and quadrant analysis in one pass
+with telemetry.Stage("step4.quadrant", items=len(ids)):
+    analysis = quadrant.fetch_analysis(ids, matrix, directions, longest=longest)
+attributes = [field for field in analysis.columns if field != "ID"]
+
+# Join the results to the center points and to the split shoreline arcs
+with telemetry.Stage("step4.write", items=len(center_points) + len(split_shoreline)):
+    finalPtName = name + "_fetch_withQuadAnalysis_points_" + date + "_Final"
+    finalPoints = center_points.drop(columns=attributes, errors="ignore").merge(analysis, on="ID", how="left")
+    store.write_layer(finalPoints, workspaceGDB, finalPtName)
+
+    finalArcName = name + "_fetch_withQuadAnalysis_arcs_" + date + "_Final"
+    finalArcs = split_shoreline.drop(columns=attributes, errors="ignore").merge(analysis, on="ID", how="left")
+    store.write_layer(finalArcs, workspaceGDB, finalArcName)
+
+# script completed message
+print("Script complete: " + finalPtName + ", " + finalArcName)
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# Step5 (graph): Check fetch results for small segments with a code different from the surrounding ones, without ArcPro
+# Usage: python Step5_CheckFetchResults_Graph.py <workspaceGDB> <inputFeaturelayer> <StudyAreaName> [<smoothLength>]
+#
+# Same output as Step5_CheckFetchResultsForSmallSegmentsWithCodeDifferentFromSurrounding_Mar2024.py:
+# the final fetch arcs dissolved on MxQExpCode, with the parts of 25.1 m or less
+# flagged in the comment and doThis fields (and their low/moderate/high neighbour
+# counts) for manual checking. The neighbours come from an end point adjacency
+# graph (see utils/topology.py) instead of buffers, intersections and pivot tables.
+#
+# With smoothLength (m) the corrections are also applied: runs of a code up to
+# that length along the shoreline with the same other code on both sides take
+# that code, the old code is kept in originalMaxQuadFetch, and the corrected
+# arcs are written to a second layer.
+# Set TMI_TELEMETRY to record the time and memory of each stage (see utils/telemetry.py).
+# Output: {StudyAreaName}_fetch_smallArcsToCheck{date}, [{StudyAreaName}_fetch_smoothed{date}]
+
+import os
+import sys
+from time import strftime
+root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(root_path)
+from utils import topology
+from utils import store
+from utils import telemetry
+
+# Script arguments
+workspaceGDB = sys.argv[1]
+# for example: "Hampton_2024_WorkingFetch.gdb"
+inputFeaturelayer = sys.argv[2]
+# for example: "Hampton_fetch_withQuadAnalysis_arcs_03_25_2024_Final"
+StudyAreaName = sys.argv[3]
+smoothLength = float(sys.argv[4]) if len(sys.argv) > 4 else None
+
+# Local variables:
+date = strftime("%m_%d_%Y")
+
+fetchChecked_output = StudyAreaName + "_fetch_smallArcsToCheck" + date
+
+with telemetry.Stage("step5.read") as stage:
+    arcs = store.read_layer(workspaceGDB, inputFeaturelayer)
+    stage.items = len(arcs)
+with telemetry.Stage("step5.small_segments", items=len(arcs)):
+    checked = topology.check_small_segments(arcs)
+with telemetry.Stage("step5.write", items=len(checked)):
+    store.write_layer(checked, workspaceGDB, fetchChecked_output)
+
+flagged = checked["originalMaxQuadFetch"].notna()
+print(str(flagged.sum()) + " of " + str(len(checked)) + " dissolved arcs are 25.1 m or less, "
+      + str(checked["doThis"].notna().sum()) + " to qc")
+
+if smoothLength is not None:
+    fetchSmoothed_output = StudyAreaName + "_fetch_smoothed" + date
+    with telemetry.Stage("step5.smooth", items=len(arcs), smooth_length=smoothLength):
+        smoothed = topology.smooth_codes(arcs, min_length=smoothLength)
+        store.write_layer(smoothed, workspaceGDB, fetchSmoothed_output)
+    print(str(smoothed["originalMaxQuadFetch"].notna().sum()) + " arcs recoded: " + fetchSmoothed_output)
+
+print("Script complete: " + fetchChecked_output)
@@ -0,0 +1,35 @@
+import os
+import sys
+root_path = os.path.abspath('..')
+sys.path.append(root_path)
+import pandas as pd
+from utils import marsh
+from utils import telemetry
+
+
+# Marsh classification for many study areas at once, replacing one edited copy of
+# data_generation.py per area. The area list is a csv with the columns
+# name, boundary, prediction (boundary vector file and NAIP/Sentinel prediction raster).
+# Set TMI_TELEMETRY to record the time and memory of every area (see utils/telemetry.py).
+
+if __name__ == "__main__":
+
+    area_list = sys.argv[1] if len(sys.argv) > 1 else os.path.join(root_path, 'data/marsh_areas.csv')
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    dem_file = "L://CBTBDEM_v2//Chesapeake_Bay_Topobathy_DEM_1m_v2.tif"
+    out_dir = os.path.join(root_path, 'outputs/marsh_batch')
+    resample_cache = os.path.join(root_path, 'outputs/resample_cache')
+
+    mlw = -0.432
+    mhw = 0.259
+    # Set to True to classify every area against MLW/MHW interpolated from the tide stations
+    # (data/stations.csv) instead of the constants above, as in data_generation.py
+    local_datums = False
+    stations = os.path.join(root_path, 'data/stations.csv') if local_datums else None
+
+    areas = pd.read_csv(area_list).to_dict('records')
+    with telemetry.Stage("marsh.batch", unit='pixels') as stage:
+        results = marsh.classify_areas(areas, dem_file, out_dir, workers, mlw, mhw, cache_dir=resample_cache,
+                                       stations=stations)
+        stage.items = sum(r.get('pixels', 0) for r in results if 'error' not in r)
@@ -3,63 +3,59 @@
 # Utilizing the CO-OPS API to retrive information about all stations tide info in Chesapeake Bay
 
 import os
+import sys
 import json
 import math
 from datetime import datetime, timedelta
 from typing import Optional, Union
 
 import pandas as pd
-import requests
 import geopandas as gpd
-from shapely.geometry import Point
+
+root_path = os.path.abspath('..')
+sys.path.append(root_path)
+from utils import coops
 
 
-def get_stations_from_bbox(geofile):
+def get_stations_from_bbox(geofile, name_field=None, catalog_path=None, ttl=None):
     
-    """Return a list of stations IDs found within a bounding box.
+    """Return the stations found within the boundaries of a vector file.
+    geofile: boundary file, one polygon per study area
+    name_field: column naming the study areas, the row number when not given
+    catalog_path: Parquet copy of the station catalog, refreshed after ttl seconds
     Returns:
-        GeoDataFrame[str]: A geodataframe with all stations' coordinates, id, and name
+        GeoDataFrame[str]: A geodataframe with all stations' coordinates, id, name and boundary
     """
     
-    data_url = "https://api.tidesandcurrents.noaa.gov/mdapi/prod/webapi/stations.json"
-    response = requests.get(data_url)
-    json_dict = response.json()
-    
-    stations = []
-    for station in json_dict["stations"]:
-        station_info = []
-        station_info.append(station['name'])
-        station_info.append(station['id'])
-        station_info.append(station['lat'])
-        station_info.append(station['lng'])
-        
-        stations.append(station_info)
-    
-    df = pd.DataFrame(stations, columns=['name', 'id', 'lat', 'lng'])
-    geometry = [Point(xy) for xy in zip(df.lng, df.lat)]
-    points_gdf = gpd.GeoDataFrame(df, crs="EPSG:4326", geometry=geometry)
+    catalog_path = catalog_path or os.path.join(os.path.abspath('..'), 'outputs/coops_cache/stations.parquet')
+    catalog = coops.station_catalog(catalog_path, ttl if ttl is not None else coops.CATALOG_TTL)
     
-    bound_gdf = gpd.read_file(geofile, driver='GeoJSON')
-    sub_gdf = points_gdf[points_gdf.within(bound_gdf.loc[0, 'geometry'])]
+    bound_gdf = gpd.read_file(geofile)
+    df = coops.assign_stations(catalog, bound_gdf, name_field)
+    sub_gdf = gpd.GeoDataFrame(df, crs="EPSG:4326", geometry=gpd.points_from_xy(df.lng, df.lat))
     
     return sub_gdf
 
 
 
 
-begin_date = ''
-end_date = ''
-product_name = ''
+begin_date = '20230101'
+end_date = '20231231'
+product_name = 'water_level'
 datum = 'NAVD'
-time_zone = ''
+time_zone = 'gmt'
 units = 'metric'
 
 
-root_path = os.path.abspath('..')
 bounding_file = os.path.join(root_path, 'data/boundary.geojson')
 
 stations_df = get_stations_from_bbox(bounding_file)
 
+# Datums and water levels of all the stations, downloaded concurrently; responses are kept in
+# coops_cache so reruns only request what is missing. For offline runs start the stand-in server
+# (python ../utils/coops_server.py 8080) and set base_url = "http://127.0.0.1:8080".
+base_url = coops.BASE_URL
+cache_dir = os.path.join(root_path, 'outputs/coops_cache')
 
-
-
+datums_df, levels_df = coops.download(stations_df['id'], product_name, begin_date, end_date, datum, units,
+                                      time_zone, base_url=base_url, cache_dir=cache_dir)
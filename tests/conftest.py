@@ -0,0 +1,6 @@
+import os
+import sys
+
+root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(root_path)
+sys.path.append(os.path.join(root_path, 'benchmarks'))
@@ -0,0 +1,18 @@
+# Regression detection of the benchmark history.
+
+import run_benchmarks
+
+
+def record(**fields):
+    base = {'stage': 'water_arcs', 'size': 1000, 'distance': 10000.0, 'host': 'h', 'python': '3.11',
+            'machine': 'x86_64', 'cpus': 8, 'seconds': 1.0, 'peak_mb': 100.0}
+    return dict(base, **fields)
+
+
+def test_regressions_compare_runs_with_the_same_parameters():
+    history = [record(), record(seconds=1.1), record(distance=2000.0, seconds=0.2, peak_mb=20.0)]
+    assert run_benchmarks.regressions(history, record(seconds=1.05)) == []
+    assert len(run_benchmarks.regressions(history, record(seconds=2.0))) == 1
+    # a longer ray than the short-ray run is not a regression of it
+    assert run_benchmarks.regressions(history[2:], record()) == []
+    assert len(run_benchmarks.regressions(history[2:], record(distance=2000.0, seconds=1.0, peak_mb=20.0))) == 1
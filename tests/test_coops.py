@@ -0,0 +1,86 @@
+# utils/coops.py against the offline stand-in server (utils/coops_server.py).
+
+import os
+import asyncio
+
+import pandas as pd
+import pytest
+
+from utils import coops
+from utils import coops_server
+
+
+NAVD_STATIONS = ['8570283', '8571421', '8571892']
+STND_STATION = '8638901'
+
+
+def serve(body, **server_args):
+
+    """
+    Run body(client_args, app) against a fresh stand-in server and return its result.
+    """
+
+    async def main():
+        runner, url = await coops_server.start(port=0, **server_args)
+        try:
+            return await body({'base_url': url, 'backoff': 0.001}, runner.app)
+        finally:
+            await runner.cleanup()
+
+    return asyncio.run(main())
+
+
+def test_retries_on_503():
+    async def body(client_args, app):
+        async with coops.CoopsClient(retries=20, **client_args) as client:
+            tables = await asyncio.gather(*[client.datums(s) for s in NAVD_STATIONS])
+        return pd.concat(tables, ignore_index=True), app['requests']
+
+    flaky, requests = serve(body, fail_rate=0.5, seed=1)
+    reliable, reliable_requests = serve(body)
+    pd.testing.assert_frame_equal(flaky, reliable)
+    assert reliable_requests == len(NAVD_STATIONS) < requests
+
+
+def test_windows_of_max_days():
+    async def body(client_args, app):
+        async with coops.CoopsClient(**client_args) as client:
+            table = await client.product(NAVD_STATIONS[0], 'water_level', '20230101', '20230311 23:54')
+        return table, app['requests']
+
+    table, requests = serve(body)
+    # 31 + 31 + 8 days, each 6 minutes without gaps or repeats
+    assert requests == 3
+    assert table['t'].iloc[0] == pd.Timestamp('2023-01-01') and table['t'].iloc[-1] == pd.Timestamp('2023-03-11 23:54')
+    assert (table['t'].diff().iloc[1:] == pd.Timedelta(minutes=6)).all()
+
+
+def test_errors_are_not_cached_or_data(tmp_path):
+    async def body(client_args, app):
+        async with coops.CoopsClient(cache_dir=str(tmp_path), **client_args) as client:
+            # a station without NAVD88: "No data" for every window, so no rows
+            empty = await client.product(STND_STATION, 'water_level', '20230101', '20230110')
+            first = app['requests']
+            await client.product(STND_STATION, 'water_level', '20230101', '20230110')
+            with pytest.raises(ValueError, match="Wrong Product"):
+                await client.product(NAVD_STATIONS[0], 'high_low', '20230101', '20230110')
+        return empty, first, app['requests']
+
+    empty, first, requests = serve(body)
+    assert len(empty) == 0 and list(empty.columns) == ['id']
+    assert requests == 2 * first + 1
+    assert os.listdir(tmp_path) == []
+
+
+def test_second_run_from_cache(tmp_path):
+    async def body(client_args, app):
+        runs = []
+        for _ in range(2):
+            async with coops.CoopsClient(cache_dir=str(tmp_path), **client_args) as client:
+                table = await client.product(NAVD_STATIONS[1], 'water_level', '20230101', '20230215')
+            runs.append((table, app['requests']))
+        return runs
+
+    (first, first_requests), (second, second_requests) = serve(body)
+    pd.testing.assert_frame_equal(first, second)
+    assert first_requests == 2 and second_requests == first_requests
@@ -0,0 +1,65 @@
+# Tide-station datum surfaces: the IDW grid at the station nodes and the
+# bilinear sampling of the grid for a classification block.
+
+import numpy as np
+import pandas as pd
+import rasterio
+from pyproj import Transformer
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+import synthetic
+from utils import datums
+
+
+CELL = 500.0
+
+
+def test_idw_grid_at_stations(tmp_path):
+    grid_path = str(tmp_path / "prediction.tif")
+    left, top = synthetic.X0, synthetic.Y0 + 5000
+    with rasterio.open(grid_path, "w", driver="GTiff", width=500, height=500, count=1, dtype="uint8",
+                       crs=synthetic.CRS, transform=from_origin(left, top, 10.0, 10.0)) as dst:
+        dst.write(np.zeros((1, 500, 500), dtype=np.uint8))
+
+    # stations on grid nodes (the grid starts one cell outside the raster), and one STND station
+    nodes = np.array([[2, 3], [6, 1], [9, 8], [4, 6]])
+    x, y = left - CELL + CELL * nodes[:, 0], top - 5000 - CELL + CELL * nodes[:, 1]
+    lng, lat = Transformer.from_crs(synthetic.CRS, "EPSG:4326", always_xy=True).transform(x, y)
+    stations = pd.DataFrame({'name': list('abcd'), 'id': [1, 2, 3, 4], 'lat': lat, 'lng': lng,
+                             'datum': ['NAVD88'] * 3 + ['STND'],
+                             'MLW': [-0.5, -0.3, -0.4, 5.0], 'MHW': [0.2, 0.4, 0.3, 7.0]})
+    stations_csv = str(tmp_path / "stations.csv")
+    stations.to_csv(stations_csv, index=False)
+
+    mlw, mhw = datums.datum_surfaces(stations_csv, grid_path, cell=CELL)
+    for (i, j), low, high in zip(nodes[:3], stations['MLW'], stations['MHW']):
+        assert abs(mlw.values[j, i] - low) < 1e-6
+        assert abs(mhw.values[j, i] - high) < 1e-6
+    # the STND station is left out, everything lies between the NAVD88 stations
+    assert -0.5 <= mlw.values.min() and mlw.values.max() <= -0.3
+
+    # the cached grids are the same
+    cached = datums.datum_surfaces(stations_csv, grid_path, cell=CELL, cache_dir=str(tmp_path / "cache"))
+    again = datums.datum_surfaces(stations_csv, grid_path, cell=CELL, cache_dir=str(tmp_path / "cache"))
+    np.testing.assert_array_equal(cached[0].values, mlw.values)
+    np.testing.assert_array_equal(again[1].values, mhw.values)
+
+
+def test_block_sampling_is_bilinear():
+    # a bilinear function of x and y is reproduced exactly between the nodes
+    x0, y0 = 1000.0, 2000.0
+    gx, gy = np.meshgrid(x0 + CELL * np.arange(6), y0 + CELL * np.arange(5))
+
+    def f(x, y):
+        return 0.1 + 1e-4 * (x - x0) - 2e-4 * (y - y0) + 3e-8 * (x - x0) * (y - y0)
+
+    surface = datums.DatumSurface(x0, y0, CELL, f(gx, gy))
+    transform = from_origin(x0 + 100.0, y0 + 2000.0, 7.0, 7.0)
+    window = Window(40, 30, 64, 48)
+    block = surface(window, rasterio.windows.transform(window, transform))
+
+    xs = x0 + 100.0 + (40 + np.arange(64) + 0.5) * 7.0
+    ys = y0 + 2000.0 - (30 + np.arange(48) + 0.5) * 7.0
+    assert block.shape == (48, 64)
+    np.testing.assert_allclose(block, f(xs[None, :], ys[:, None]), atol=1e-6)
@@ -0,0 +1,142 @@
+# The distance index against the raster mode: sphere tracing must give the same
+# fetch as marching the same grid, a partial rebuild the same tiles as a fresh
+# build, and county runs sharing the regional index must leave it untouched.
+
+import shutil
+
+import numpy as np
+import shapely
+import pandas as pd
+import geopandas as gpd
+import pytest
+
+import synthetic
+from utils import distance_field
+from utils import fetch_raster
+from utils import sharding
+from utils import store
+
+
+RESOLUTION = 5.0
+TILE_SIZE = 64
+HALO = 32
+
+
+def island_layer(seed=1):
+    rng = np.random.default_rng(seed)
+    x0, y0 = synthetic.X0, synthetic.Y0
+    coast = np.c_[np.linspace(x0, x0 + 4000, 40), np.full(40, y0)]
+    islands = shapely.get_parts(shapely.union_all(synthetic.marsh_islands(coast, 20, rng, 50, 2000)))
+    # the layer bounds fall on the 5 m cells, so the raster grid and the index grid coincide
+    land = shapely.box(x0, y0 - 500, x0 + 4000, y0)
+    water = shapely.difference(shapely.box(x0, y0, x0 + 4000, y0 + 3000), shapely.union_all(islands))
+    return gpd.GeoDataFrame({'surface': ['land', 'water'] + ['land'] * len(islands)},
+                            geometry=[land, water] + list(islands), crs=synthetic.CRS)
+
+
+def build(landwater, index_dir):
+    return distance_field.build_index(landwater, str(index_dir), RESOLUTION, TILE_SIZE, HALO, log=lambda s: None)
+
+
+@pytest.fixture(scope="module")
+def layer():
+    return island_layer()
+
+
+@pytest.fixture(scope="module")
+def index(layer, tmp_path_factory):
+    index_dir = tmp_path_factory.mktemp("index")
+    build(layer, index_dir)
+    return distance_field.DistanceIndex(str(index_dir))
+
+
+def test_trace_matches_march(layer, index, tmp_path):
+    grid_path = fetch_raster.rasterize_landwater(layer, str(tmp_path / "grid.npy"), RESOLUTION)
+    grid, transform, _ = fetch_raster.open_grid(grid_path)
+
+    rng = np.random.default_rng(2)
+    x = synthetic.X0 + rng.uniform(0, 4000, 300)
+    y = synthetic.Y0 + rng.uniform(-100, 2500, 300)
+    expected = fetch_raster.march_fetch(grid, transform, x, y, max_distance=3000.0)
+    traced = distance_field.trace_fetch(index, x, y, max_distance=3000.0)
+
+    assert 0 < (expected == 3000.0).sum() < expected.size
+    np.testing.assert_array_equal(traced, expected)
+
+
+def test_check(layer, index):
+    x = np.array([synthetic.X0 + 100.0, synthetic.X0 + 1e6])
+    y = np.array([synthetic.Y0 + 100.0, synthetic.Y0])
+    index.check(layer.crs, x[:1], y[:1])
+    with pytest.raises(ValueError, match="outside"):
+        index.check(layer.crs, x, y)
+    with pytest.raises(ValueError, match="CRS"):
+        index.check("EPSG:4326", x[:1], y[:1])
+
+
+def test_incremental_rebuild(layer, index, tmp_path):
+    # move one island: only the tiles around it are recomputed, and they match a fresh build
+    edited = layer.copy()
+    edited.loc[2, 'geometry'] = shapely.affinity.translate(edited.geometry[2], 40.0, 40.0)
+    edited.loc[1, 'geometry'] = shapely.difference(shapely.box(synthetic.X0, synthetic.Y0, synthetic.X0 + 4000,
+                                                               synthetic.Y0 + 3000),
+                                                   shapely.union_all(edited.geometry[2:].values))
+
+    updated = tmp_path / "updated"
+    build(layer, updated)
+    rebuilt = build(edited, updated)
+    fresh = tmp_path / "fresh"
+    total = build(edited, fresh)
+    assert 0 < rebuilt < total
+
+    a, b = distance_field.DistanceIndex(str(updated)), distance_field.DistanceIndex(str(fresh))
+    assert a.key() == b.key()
+    for key in b.meta['tiles']:
+        np.testing.assert_array_equal(np.asarray(a.tile(key)), np.asarray(b.tile(key)))
+
+
+def county(layer, x_lo, x_hi, tmp_path, name, seed):
+    clip = shapely.box(synthetic.X0 + x_lo, synthetic.Y0 - 500, synthetic.X0 + x_hi, synthetic.Y0 + 3000)
+    landwater = layer.copy()
+    landwater['geometry'] = shapely.intersection(layer.geometry.values, clip)
+    landwater = landwater[~landwater.is_empty].reset_index(drop=True)
+
+    rng = np.random.default_rng(seed)
+    points = shapely.points(synthetic.X0 + rng.uniform(x_lo, x_hi, 200), synthetic.Y0 + rng.uniform(0, 2500, 200))
+    centers = gpd.GeoDataFrame({'ID': np.arange(1, 201)}, geometry=points, crs=layer.crs)
+
+    workspace = str(tmp_path / (name + ".store"))
+    store.write_layer(landwater, workspace, "landwater")
+    store.write_layer(centers, workspace, "centers")
+    return workspace
+
+
+def test_county_runs_do_not_depend_on_order(layer, tmp_path):
+    # two overlapping study areas traced through one regional index, in both orders
+    a = county(layer, 0, 2500, tmp_path, "a", 3)
+    b = county(layer, 1500, 4000, tmp_path, "b", 4)
+    regional = tmp_path / "regional"
+    build(layer, regional)
+    key = distance_field.DistanceIndex(str(regional)).key()
+
+    def run(workspace, index_dir, scratch):
+        return sharding.sharded_water_arcs(workspace, "landwater", None, "centers", "county", str(tmp_path / scratch),
+                                           workers=2, mode='distance', resolution=RESOLUTION, distance=3000.0,
+                                           index_dir=str(index_dir))
+
+    first = shutil.copytree(regional, tmp_path / "first")
+    second = shutil.copytree(regional, tmp_path / "second")
+    a_first, b_second = run(a, first, "s1"), run(b, first, "s2")
+    b_first, a_second = run(b, second, "s3"), run(a, second, "s4")
+
+    pd.testing.assert_frame_equal(a_first, a_second)
+    pd.testing.assert_frame_equal(b_first, b_second)
+    assert distance_field.DistanceIndex(str(first)).key() == distance_field.DistanceIndex(str(second)).key() == key
+
+
+def test_open_index(tmp_path, index):
+    with pytest.raises(ValueError, match="BuildDistanceIndex"):
+        distance_field.open_index(str(tmp_path / "missing"))
+    with pytest.raises(ValueError, match="10.0 m"):
+        distance_field.open_index(index.index_dir, 10.0)
+    assert distance_field.open_index(index.index_dir, RESOLUTION).key() == index.key()
@@ -0,0 +1,103 @@
+# Incremental fetch after a shoreline edit against a full recompute, with the
+# center points renumbered as Step1 does, and with other ray parameters.
+
+import numpy as np
+import pandas as pd
+import shapely
+import geopandas as gpd
+import pytest
+
+import synthetic
+from utils import fetch
+from utils import fetch_cache
+from utils import quadrant
+
+
+DISTANCE = 600.0
+
+
+def island_layer(move=0.0):
+    rng = np.random.default_rng(5)
+    x0, y0 = synthetic.X0, synthetic.Y0
+    coast = np.c_[np.linspace(x0, x0 + 5000, 50), np.full(50, y0)]
+    islands = shapely.get_parts(shapely.union_all(synthetic.marsh_islands(coast, 25, rng, 100, 1500)))
+    islands = list(islands[np.argsort(-shapely.area(islands))])
+    # the edit: the largest island moves
+    islands[0] = shapely.affinity.translate(islands[0], move, move)
+    water = shapely.difference(shapely.box(x0, y0, x0 + 5000, y0 + 2000), shapely.union_all(islands))
+    return gpd.GeoDataFrame({'surface': ['land', 'water'] + ['land'] * len(islands)},
+                            geometry=[shapely.box(x0, y0 - 500, x0 + 5000, y0), water] + islands, crs=synthetic.CRS)
+
+
+def center_points(landwater, ids=None):
+    # four points on every island shore that did not move, as Step1 would split them
+    rings = shapely.get_exterior_ring(landwater.geometry.values[3:])
+    points = shapely.line_interpolate_point(np.repeat(rings, 4), np.tile([0.1, 0.35, 0.6, 0.85], len(rings)),
+                                            normalized=True)
+    split = np.arange(1, len(points) + 1)
+    ids = split if ids is None else ids
+    return gpd.GeoDataFrame({'ID': ids, 'splitID': split}, geometry=points, crs=landwater.crs)
+
+
+def full(points, landwater, distance=DISTANCE):
+    arcs = fetch.point_water_arcs(points, landwater, distance, 'PLANAR')
+    ids, matrix = fetch.fetch_matrix(arcs, np.unique(points['ID'].values))
+    _, longest = fetch.fetch_matrix(arcs, ids, reduce='max')
+    return arcs, quadrant.fetch_analysis(ids, matrix, longest=longest)
+
+
+def assert_same(result, expected):
+    arcs, analysis, _ = result
+    columns = ['ID', 'direction', 'Shape_Length']
+    pd.testing.assert_frame_equal(arcs[columns].sort_values(columns).reset_index(drop=True),
+                                  expected[0][columns].sort_values(columns).reset_index(drop=True), check_dtype=False)
+    pd.testing.assert_frame_equal(analysis, expected[1])
+
+
+@pytest.fixture
+def cached(tmp_path):
+    landwater = island_layer()
+    points = center_points(landwater)
+    first = fetch_cache.incremental_fetch(points, landwater, str(tmp_path), DISTANCE, 'PLANAR')
+    assert len(first[2]) == len(points)
+    return landwater, points, str(tmp_path)
+
+
+def test_edit_recomputes_only_near_points(cached):
+    _, points, cache_dir = cached
+    edited = island_layer(move=30.0)
+    points = center_points(edited)
+    result = fetch_cache.incremental_fetch(points, edited, cache_dir, DISTANCE, 'PLANAR')
+    assert_same(result, full(points, edited))
+
+    # only points whose rays (or shore) reach the moved island are recomputed
+    recomputed = np.isin(points['ID'].values, result[2])
+    moved = shapely.union(island_layer().geometry[2], edited.geometry[2])
+    assert 0 < recomputed.sum() < len(points) / 2
+    assert (shapely.distance(points.geometry.values[recomputed], moved) <= DISTANCE).all()
+
+
+def test_renumbered_ids(cached):
+    landwater, points, cache_dir = cached
+    # Step1 numbered the points the other way round this time
+    renumbered = center_points(landwater, ids=np.arange(len(points), 0, -1) + 1000)
+    result = fetch_cache.incremental_fetch(renumbered, landwater, cache_dir, DISTANCE, 'PLANAR')
+    assert len(result[2]) == 0
+    assert_same(result, full(renumbered, landwater))
+
+    # an edit after the renumbering still finds the points next to it
+    edited = island_layer(move=30.0)
+    moved = center_points(edited, ids=renumbered['ID'].values)
+    result = fetch_cache.incremental_fetch(moved, edited, cache_dir, DISTANCE, 'PLANAR')
+    assert 0 < len(result[2]) < len(moved) / 2
+    assert_same(result, full(moved, edited))
+
+
+def test_other_ray_parameters_miss(cached):
+    landwater, points, cache_dir = cached
+    result = fetch_cache.incremental_fetch(points, landwater, cache_dir, 2 * DISTANCE, 'PLANAR')
+    assert len(result[2]) == len(points)
+    assert_same(result, full(points, landwater, 2 * DISTANCE))
+
+    result = fetch_cache.incremental_fetch(points, landwater, cache_dir, 2 * DISTANCE, 'GEODESIC')
+    assert len(result[2]) == len(points)
@@ -0,0 +1,42 @@
+# Raster fetch grids: one file per exact resolution, and the sharded driver
+# marching the grid at the resolution it is given.
+
+import numpy as np
+import shapely
+import geopandas as gpd
+
+import synthetic
+from utils import fetch_raster
+from utils import sharding
+from utils import store
+
+
+def test_grid_names_keep_the_resolution():
+    names = [fetch_raster.grid_name("Lancaster_LandWaterPoly", r) for r in (2, 2.5, 5, 5.0, 0.75)]
+    assert names[0] != names[1] and names[2] == names[3]
+    assert names[1] == "Lancaster_LandWaterPoly_2_5m_grid.npy"
+    assert len(set(names)) == 4
+
+
+def test_sharded_raster_mode_uses_the_resolution(tmp_path):
+    x0, y0 = synthetic.X0, synthetic.Y0
+    island = shapely.Point(x0 + 500, y0 + 500).buffer(120.0)
+    water = shapely.box(x0, y0, x0 + 1000, y0 + 1000).difference(island)
+    landwater = gpd.GeoDataFrame({'surface': ['water', 'land']}, geometry=[water, island], crs=synthetic.CRS)
+    rng = np.random.default_rng(0)
+    centers = gpd.GeoDataFrame({'ID': np.arange(1, 41)},
+                               geometry=shapely.points(x0 + rng.uniform(100, 900, 40), y0 + rng.uniform(100, 900, 40)),
+                               crs=synthetic.CRS)
+    workspace = str(tmp_path / "county.store")
+    store.write_layer(landwater, workspace, "landwater")
+    store.write_layer(centers, workspace, "centers")
+
+    arcs = sharding.sharded_water_arcs(workspace, "landwater", None, "centers", "county", str(tmp_path / "scratch"),
+                                       workers=2, mode='raster', resolution=2.5, distance=800.0)
+    assert (tmp_path / "scratch" / fetch_raster.grid_name("landwater", 2.5)).exists()
+
+    grid_path = fetch_raster.rasterize_landwater(landwater, str(tmp_path / "grid.npy"), 2.5)
+    expected = fetch_raster.raster_fetch(centers, grid_path, 800.0)
+    columns = ['ID', 'direction', 'Shape_Length']
+    np.testing.assert_array_equal(arcs[columns].sort_values(['ID', 'direction']).values,
+                                  expected[columns].sort_values(['ID', 'direction']).values)
@@ -0,0 +1,50 @@
+# The first-hit fetch mode against the batched vector engine on a field of marsh
+# islands, with the center points on the island shores.
+
+import numpy as np
+import shapely
+import geopandas as gpd
+import pytest
+
+import synthetic
+from utils import fetch
+from utils import first_hit
+
+
+@pytest.fixture(scope="module")
+def island_field():
+    rng = np.random.default_rng(1)
+    x0, y0 = synthetic.X0, synthetic.Y0
+    coast = np.c_[np.linspace(x0, x0 + 6000, 50), np.full(50, y0)]
+    islands = shapely.get_parts(shapely.union_all(synthetic.marsh_islands(coast, 30, rng, 50, 3000)))
+    land = shapely.box(x0, y0 - 1000, x0 + 6000, y0)
+    water = shapely.difference(shapely.box(x0, y0, x0 + 6000, y0 + 4000), shapely.union_all(islands))
+    landwater = gpd.GeoDataFrame({'surface': ['land', 'water'] + ['land'] * len(islands)},
+                                 geometry=[land, water] + list(islands), crs=synthetic.CRS)
+
+    points = shapely.line_interpolate_point(shapely.get_exterior_ring(islands[:20]), 0.3, normalized=True)
+    center_points = gpd.GeoDataFrame({'ID': np.arange(1, len(points) + 1)}, geometry=points, crs=synthetic.CRS)
+    return center_points, landwater
+
+
+def test_first_hit_matches_vector_engine(island_field):
+    center_points, landwater = island_field
+    ids = center_points['ID'].values
+
+    vector = fetch.point_water_arcs(center_points, landwater, 3000.0, method='PLANAR')
+    vector = vector[vector['Shape_Length'] > fetch.ORIGIN_TOLERANCE]
+    _, expected = fetch.fetch_matrix(vector, ids, reduce='max')
+    _, matrix = fetch.fetch_matrix(first_hit.first_hit_water_arcs(center_points, landwater, 3000.0), ids)
+
+    assert (matrix > 0).sum() > 100
+    np.testing.assert_array_equal(matrix > 0, expected > 0)
+    # a vector arc may start up to the origin tolerance away from its center point
+    np.testing.assert_allclose(matrix, expected, atol=fetch.ORIGIN_TOLERANCE)
+
+
+def test_integer_ray_length(island_field):
+    center_points, landwater = island_field
+    index = first_hit.SegmentIndex(landwater)
+    x, y = center_points.geometry.x.values, center_points.geometry.y.values
+    np.testing.assert_array_equal(first_hit.first_hit_fetch(index, x, y, max_distance=3000),
+                                  first_hit.first_hit_fetch(index, x, y, max_distance=3000.0))
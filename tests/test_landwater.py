@@ -0,0 +1,111 @@
+# Land/water labelling: the pointer-jumping two-colouring against a plain
+# breadth-first search, and the labels of a synthetic shore with marsh islands
+# and a pond seeded by a rough water mask.
+
+from collections import deque
+
+import numpy as np
+import shapely
+import geopandas as gpd
+
+import synthetic
+from utils import landwater
+
+
+def bfs_colouring(n, u, v):
+    neighbours = [[] for _ in range(n)]
+    for a, b in zip(u, v):
+        neighbours[a].append(b)
+        neighbours[b].append(a)
+    colour = np.full(n, -1)
+    conflict = np.zeros(n, dtype=bool)
+    for root in range(n):
+        if colour[root] >= 0:
+            continue
+        colour[root] = 0
+        queue = deque([root])
+        while queue:
+            a = queue.popleft()
+            for b in neighbours[a]:
+                if colour[b] < 0:
+                    colour[b] = 1 - colour[a]
+                    queue.append(b)
+    for a, b in zip(u, v):
+        if colour[a] == colour[b]:
+            conflict[a] = conflict[b] = True
+    return colour, conflict
+
+
+def test_two_colouring_matches_bfs():
+    # random forests with extra edges between the two sides: bipartite, several parts
+    rng = np.random.default_rng(0)
+    n = 500
+    parent = np.array([rng.integers(max(i // 100 * 100, i - 50), i) if i % 100 else -1 for i in range(n)])
+    child = np.flatnonzero(parent >= 0)
+    u, v = parent[child], child
+    depth = np.zeros(n, dtype=np.int64)
+    for i in child:
+        depth[i] = depth[parent[i]] + 1
+    a, b = rng.integers(0, n, 400), rng.integers(0, n, 400)
+    keep = (a // 100 == b // 100) & (depth[a] % 2 != depth[b] % 2)
+    u, v = np.r_[u, a[keep]], np.r_[v, b[keep]]
+
+    part, colour, conflict = landwater.two_colouring(n, u, v)
+    expected, expected_conflict = bfs_colouring(n, u, v)
+    np.testing.assert_array_equal(colour, expected)
+    assert not conflict.any() and not expected_conflict.any()
+    assert len(np.unique(part)) == 5
+
+
+def test_two_colouring_flags_odd_cycles():
+    # a triangle next to a square: the triangle's edge between the two children of its root clashes
+    u = np.array([0, 1, 0, 3, 4, 5, 3])
+    v = np.array([1, 2, 2, 4, 5, 6, 6])
+    part, colour, conflict = landwater.two_colouring(7, u, v)
+    _, expected_conflict = bfs_colouring(7, u, v)
+    np.testing.assert_array_equal(conflict, expected_conflict)
+    assert list(conflict) == [False, True, True] + [False] * 4
+    assert (colour[u[3:]] != colour[v[3:]]).all()
+
+
+def shore():
+    rng = np.random.default_rng(3)
+    x0, y0 = synthetic.X0, synthetic.Y0
+    coast = np.c_[np.linspace(x0, x0 + 4000, 40), np.full(40, y0)]
+    islands = list(shapely.get_parts(shapely.union_all(synthetic.marsh_islands(coast, 15, rng, 100, 1500))))
+    water = shapely.difference(shapely.box(x0, y0, x0 + 4000, y0 + 2000), shapely.union_all(islands))
+    # a pond inside the largest island
+    big = int(np.argmax(shapely.area(islands)))
+    pond = shapely.buffer(shapely.point_on_surface(islands[big]), 2.0, quad_segs=4)
+    islands[big] = shapely.difference(islands[big], pond)
+    lone = shapely.box(x0 + 10000, y0, x0 + 10100, y0 + 100)
+
+    geoms = [shapely.box(x0, y0 - 500, x0 + 4000, y0), water, pond] + islands + [lone]
+    truth = ['land', 'water', 'water'] + ['land'] * len(islands) + [None]
+    return gpd.GeoDataFrame({'surface': [None] * len(geoms)}, geometry=geoms, crs=synthetic.CRS), truth
+
+
+def test_label_surfaces():
+    layer, truth = shore()
+    # a rough labelled reference, wrong about the islands and a strip of the shore, not reaching the lone polygon
+    x0, y0 = synthetic.X0, synthetic.Y0
+    reference = gpd.GeoDataFrame({'surface': ['water', 'land']},
+                                 geometry=[shapely.box(x0 - 100, y0 - 50, x0 + 4100, y0 + 2100),
+                                           shapely.box(x0 - 100, y0 - 600, x0 + 4100, y0 - 50)], crs=synthetic.CRS)
+    labelled = landwater.label_surfaces(layer, reference=reference)
+
+    assert list(labelled['surface'][:-1]) == truth[:-1]
+    assert labelled['surface'].isna().iloc[-1]
+    assert labelled['surface_qc'].iloc[-1] == landwater.NO_SEED
+    assert (labelled['surface_qc'].iloc[:-1] != landwater.PARITY_CONFLICT).all()
+
+
+def test_water_points_outweigh_the_reference():
+    layer, truth = shore()
+    # the reference has land and water swapped, the one water point is right
+    mask = gpd.GeoDataFrame(geometry=[layer.geometry[0]], crs=synthetic.CRS)
+    point = shapely.Point(synthetic.X0 + 2000, synthetic.Y0 + 1990)
+    labelled = landwater.label_surfaces(layer, reference=mask, water_points=[point])
+
+    assert list(labelled['surface'][:-1]) == truth[:-1]
+    assert labelled['surface_qc'][0] == landwater.DISAGREES
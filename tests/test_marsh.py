@@ -0,0 +1,121 @@
+# The fused marsh classification kernel against the np.where chain of the
+# original data_generation.py, on blocks with DEM values exactly at MLW and MHW,
+# nodata and NaN, and the parallel study-area runner against serial runs.
+
+import os
+
+import numpy as np
+import rasterio
+import shapely
+import geopandas as gpd
+from rasterio.transform import from_origin
+
+import synthetic
+from utils import marsh
+from utils import utils
+
+
+NODATA = -9999.0
+
+
+def baseline(dem, prediction, mlw=marsh.MLW, mhw=marsh.MHW):
+
+    """
+    Steps 2 and 3 of the original scripts/data_generation.py on arrays.
+    Returns (reclassed DEM, masked output).
+    """
+
+    resampled_dem = np.where(dem > mhw, 1, dem)
+    resampled_dem = np.where((resampled_dem >= mlw) & (resampled_dem <= mhw), 2, resampled_dem)
+    resampled_dem = np.where((resampled_dem == 1) | (resampled_dem == 2), resampled_dem, -1).astype(int)
+    ml_predict_array = np.where((prediction == 1) | (prediction == 2), 1, 0)
+    return resampled_dem, np.multiply(ml_predict_array, resampled_dem)
+
+
+def blocks(shape=(97, 131), seed=0):
+    rng = np.random.default_rng(seed)
+    dem = rng.uniform(-1.5, 1.5, shape).astype(np.float32)
+    special = rng.integers(0, 6, shape)
+    dem[special == 1] = np.float32(marsh.MLW)
+    dem[special == 2] = np.float32(marsh.MHW)
+    dem[special == 3] = NODATA
+    dem[special == 4] = np.nan
+    prediction = rng.choice(np.array([0, 1, 2, 3, 255], dtype=np.uint8), shape)
+    return dem, prediction
+
+
+def test_classify_block_matches_where_chain():
+    dem, prediction = blocks()
+    out = np.empty(dem.shape, dtype=np.int8)
+    reclass = np.empty(dem.shape, dtype=np.int8)
+    marsh.classify_block(dem, prediction, marsh.MLW, marsh.MHW, out, reclass)
+
+    expected_reclass, expected = baseline(dem, prediction)
+    np.testing.assert_array_equal(reclass, expected_reclass)
+    np.testing.assert_array_equal(out, expected)
+    assert set(np.unique(out)) == {-1, 0, 1, 2}
+
+
+def test_classify_block_with_datum_arrays():
+    dem, prediction = blocks(seed=1)
+    mlw = np.linspace(-0.6, -0.3, dem.size, dtype=np.float32).reshape(dem.shape)
+    mhw = mlw + np.float32(0.7)
+    dem[::7] = mlw[::7]
+    dem[3::7] = mhw[3::7]
+    out = np.empty(dem.shape, dtype=np.int8)
+    marsh.classify_block(dem, prediction, mlw, mhw, out)
+    np.testing.assert_array_equal(out, baseline(dem, prediction, mlw, mhw)[1])
+
+
+def test_classify_marsh_file(tmp_path):
+    dem, prediction = blocks(shape=(300, 200), seed=2)
+    transform = from_origin(synthetic.X0, synthetic.Y0, 1.0, 1.0)
+    for path, data, nodata in (("dem.tif", dem, NODATA), ("prediction.tif", prediction, 255)):
+        with rasterio.open(str(tmp_path / path), "w", driver="GTiff", width=200, height=300, count=1,
+                           dtype=data.dtype, crs=synthetic.CRS, transform=transform, nodata=nodata) as dst:
+            dst.write(data, 1)
+
+    out_path = str(tmp_path / "combined.tif")
+    marsh.classify_marsh(str(tmp_path / "dem.tif"), str(tmp_path / "prediction.tif"), out_path, blocksize=64)
+    with rasterio.open(out_path) as src:
+        assert src.dtypes[0] == 'int8' and src.nodata is None
+        np.testing.assert_array_equal(src.read(1), baseline(dem, prediction)[1])
+
+
+def test_classify_areas_matches_serial(tmp_path):
+    dem_path = str(tmp_path / "dem.tif")
+    synthetic.marsh_rasters(dem_path, str(tmp_path / "regional_prediction.tif"), 700 * 700)
+    rng = np.random.default_rng(3)
+
+    areas = []
+    for k, (x, y, size, res) in enumerate([(50, 60, 300, 1.5), (300, 250, 350, 2.0), (120, 400, 200, 1.0)]):
+        name = "area" + str(k)
+        x0, y0 = synthetic.X0 + x, synthetic.Y0 + y
+        boundary = gpd.GeoDataFrame(geometry=[shapely.Polygon([(x0 + 10, y0 + 5), (x0 + size - 5, y0 + 20),
+                                                               (x0 + size / 2, y0 + size - 10)])],
+                                    crs=synthetic.CRS)
+        boundary.to_file(str(tmp_path / (name + ".geojson")))
+        side = int(size / res)
+        with rasterio.open(str(tmp_path / (name + "_prediction.tif")), "w", driver="GTiff", width=side, height=side,
+                           count=1, dtype="uint8", crs=synthetic.CRS, transform=from_origin(x0, y0 + size, res, res)) as dst:
+            dst.write(rng.integers(0, 3, (1, side, side), dtype=np.uint8))
+        areas.append({'name': name, 'boundary': str(tmp_path / (name + ".geojson")),
+                      'prediction': str(tmp_path / (name + "_prediction.tif"))})
+
+    out_dir, cache_dir = tmp_path / "batch", tmp_path / "cache"
+    results = marsh.classify_areas(areas, dem_path, str(out_dir), workers=2, cache_dir=str(cache_dir))
+    assert all('error' not in r for r in results)
+
+    for area in areas:
+        # the same area on its own, in this process and without the resample cache
+        serial_dem = str(tmp_path / (area['name'] + "_serial_dem.tif"))
+        utils.crop_boundary_to_file(dem_path, list(gpd.read_file(area['boundary']).geometry), serial_dem)
+        serial_out = str(tmp_path / (area['name'] + "_serial.tif"))
+        marsh.classify_marsh(serial_dem, area['prediction'], serial_out)
+        with rasterio.open(serial_out) as expected, \
+                rasterio.open(str(out_dir / (area['name'] + "_combined.tif"))) as got:
+            assert got.transform == expected.transform
+            np.testing.assert_array_equal(got.read(), expected.read())
+
+    leftovers = [f for d in (out_dir, cache_dir) for _, _, files in os.walk(d) for f in files if '.part' in f]
+    assert leftovers == []
@@ -0,0 +1,79 @@
+# Caching of the fetch pipeline task graph: what a second run reuses and what it reruns.
+
+import os
+
+import pytest
+
+from utils import pipeline
+from utils import store
+
+import synthetic
+
+
+ALL = {'shoreline', 'landwater', 'step1', 'grid', 'step3_0', 'step3_1', 'step3', 'matrix', 'step4', 'step5'}
+OPTIONS = {'spacing': 50.0, 'distance': 1000.0, 'mode': 'raster', 'resolution': 10.0, 'chunks': 2}
+
+
+@pytest.fixture
+def workspace(tmp_path):
+    shore, landwater = synthetic.study_area(40, spacing=25.0, islands_per_km=3.0, seed=4)
+    ws = str(tmp_path / "inputs.store")
+    store.write_layer(shore, ws, "shoreline")
+    store.write_layer(landwater, ws, "landwater")
+    return ws
+
+
+def run(tasks, cache):
+    lines = []
+    pipeline.run_graph(tasks, cache, workers=2, log=lines.append)
+    ran = {line.split(":")[0] for line in lines if ": done" in line}
+    cached = {line.split(":")[0] for line in lines if line.endswith(": cached")}
+    assert ran | cached == {task.name for task in tasks} and not ran & cached
+    return ran
+
+
+def tasks(ws, **kwargs):
+    return pipeline.fetch_tasks(ws, "shoreline", "landwater", **dict(OPTIONS, **kwargs))
+
+
+def test_second_run_is_cached(workspace, tmp_path):
+    cache = str(tmp_path / "cache.store")
+    assert run(tasks(workspace), cache) == ALL
+    assert run(tasks(workspace), cache) == set()
+
+
+def test_unfinished_task_reruns(workspace, tmp_path):
+    cache = str(tmp_path / "cache.store")
+    prefixes = pipeline.run_graph(tasks(workspace), cache, workers=2, log=lambda m: None)
+    # outputs without a marker (a run killed before the task finished) are not trusted
+    os.remove(pipeline.marker_path(cache, prefixes['step3_1']))
+    assert run(tasks(workspace), cache) == {'step3_1'}
+
+
+def test_changed_source_reruns_downstream_only(workspace, tmp_path):
+    cache = str(tmp_path / "cache.store")
+    run(tasks(workspace), cache)
+
+    landwater = store.read_layer(workspace, "landwater")
+    store.write_layer(landwater.iloc[:-1], workspace, "landwater")
+    assert run(tasks(workspace), cache) == ALL - {'shoreline', 'step1'}
+
+
+def test_changed_version_reruns_downstream_only(workspace, tmp_path):
+    cache = str(tmp_path / "cache.store")
+    run(tasks(workspace), cache)
+
+    graph = tasks(workspace)
+    next(task for task in graph if task.name == 'matrix').version += 1
+    assert run(graph, cache) == {'matrix', 'step4', 'step5'}
+
+
+def test_changed_parameter_reruns_downstream_only(workspace, tmp_path):
+    cache = str(tmp_path / "cache.store")
+    run(tasks(workspace, smooth_length=100.0), cache)
+    assert run(tasks(workspace, smooth_length=100.0, small_length=5.0), cache) == {'step5'}
+
+
+def test_missing_distance_index(workspace, tmp_path):
+    with pytest.raises(ValueError, match="no distance index"):
+        tasks(workspace, mode='distance', index_dir=str(tmp_path / "missing"))
@@ -0,0 +1,100 @@
+# utils/quadrant.py against a row-by-row port of the Step4 quadrant section
+# (Step4_FetchAnalysis_ArcPro_June2022.py), on matrices built to hit its ties,
+# single-arc quadrants and threshold edges.
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import fetch
+from utils import quadrant
+from utils.rays import DIRECTIONS
+
+
+STEP4_QUADRANTS = {'NE': ['n', 'ne', 'nne', 'ene', 'e'], 'SW': ['s', 'ssw', 'sw', 'wsw', 'w'],
+                   'SE': ['e', 'ese', 'se', 'sse', 's'], 'NW': ['n', 'w', 'wnw', 'nw', 'nnw']}
+
+
+def step4_row(row):
+
+    """
+    The Step4 selections and field calculations for one exposure point, in their order.
+    """
+
+    f = dict(zip(DIRECTIONS, row))
+    count = {q: sum(1 for d in ds if f[d]) for q, ds in STEP4_QUADRANTS.items()}
+    mean = {q: sum(f[d] for d in ds) / count[q] if count[q] > 0 else 0 for q, ds in STEP4_QUADRANTS.items()}
+    out = {'MaxQFetch': max([mean['NE'], mean['SW'], mean['SE'], mean['NW']]), 'MaxQuadDir': None,
+           'QuadCnt1': None, 'OneIsMax': None}
+
+    def classify():
+        for q in ('NE', 'SW', 'SE', 'NW'):
+            if round(mean[q], 4) == round(out['MaxQFetch'], 4):
+                out['MaxQuadDir'] = q
+        m = out['MaxQFetch']
+        out['MxQExpCode'] = "moderate" if 804.67 <= m < 3218.69 else "high" if m >= 3218.69 else "low"
+
+    classify()
+    out['MxQFetchOld'], out['MxQExpCodeO'], out['MaxQDirO'] = out['MaxQFetch'], out['MxQExpCode'], out['MaxQuadDir']
+    for q in ('SE', 'SW', 'NE', 'NW'):
+        if count[q] == 1:
+            out['QuadCnt1'] = q
+            if round(mean[q], 4) == round(out['MaxQFetch'], 4):
+                out['OneIsMax'] = quadrant.SECOND_HIGHEST
+                out['MaxQFetch'] = sorted([mean['NE'], mean['SW'], mean['SE'], mean['NW']])[-2]
+    classify()
+    for q in STEP4_QUADRANTS:
+        out[q + '_Count'] = count[q]
+        out[q + '_Mean'] = mean[q]
+    return out
+
+
+def cases(n=400, seed=0):
+    rng = np.random.default_rng(seed)
+    matrix = rng.choice([0.0, 0.0, 500.0, 804.67, 1200.0, 3218.69, 5000.0], size=(n, 16))
+    matrix[::7] = 0.0
+    matrix[1::7, :] = 0.0
+    matrix[1::7, 2] = 4000.0  # one arc: the only quadrant with fetch has count 1
+    matrix[2::7] = 1000.0     # every quadrant ties
+    return matrix.astype(np.float32)
+
+
+def test_quadrant_analysis_matches_step4():
+    matrix = cases()
+    fields = quadrant.quadrant_analysis(matrix)
+    for i, row in enumerate(matrix.astype(np.float64)):
+        expected = step4_row(row)
+        for name, value in expected.items():
+            got = fields[name][i]
+            if isinstance(value, str) or value is None:
+                assert got == value, (i, name)
+            else:
+                assert got == pytest.approx(value, rel=1e-6), (i, name)
+
+
+@pytest.mark.parametrize("length, code", [(804.66, "low"), (804.67, "moderate"), (3218.68, "moderate"),
+                                          (3218.69, "high")])
+def test_quad_exposure_code_thresholds(length, code):
+    assert quadrant.quad_exposure_code(np.array([length]))[0] == code
+
+
+@pytest.mark.parametrize("length, exposure", [(np.nan, "point misplacement"), (804.67, "low"),
+                                              (804.68, "moderate"), (3218.69, "moderate"), (3218.7, "high")])
+def test_exposure_class_thresholds(length, exposure):
+    assert quadrant.exposure_class(np.array([length]))[0] == exposure
+
+
+def test_max_shape_length_is_the_longest_arc():
+    arcs = pd.DataFrame({'ID': [1, 1, 1], 'direction': ['n', 'n', 'e'], 'Shape_Length': [600.0, 700.0, 900.0]})
+    ids, matrix = fetch.fetch_matrix(arcs)
+    _, longest = fetch.fetch_matrix(arcs, ids, reduce='max')
+    table = quadrant.fetch_analysis(ids, matrix, longest=longest)
+    assert table['n'][0] == 1300.0
+    assert table['MAX_Shape_Length'][0] == 900.0
+    assert table['maxDir'][0] == 'e'
+    assert table['exposure'][0] == 'moderate'
+
+
+def test_sector_quadrants_of_the_compass_directions():
+    sectors = quadrant.sector_quadrants(DIRECTIONS)
+    assert {q: sorted(ds) for q, ds in sectors.items()} == {q: sorted(ds) for q, ds in quadrant.QUADRANTS.items()}
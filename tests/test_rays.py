@@ -0,0 +1,46 @@
+# Direction names and bearings at other angular steps than the 16 compass
+# directions, and the fetch matrix refusing arcs cast at another step.
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import fetch
+from utils import quadrant
+from utils import rays
+
+
+@pytest.mark.parametrize("step, names", [
+    (22.5, rays.DIRECTIONS[:3]),
+    (10, ['d000', 'd010', 'd020']),
+    (2.5, ['d000', 'd002_5', 'd005']),
+    (1.25, ['d000', 'd001_25', 'd002_5']),
+    (0.05, ['d000', 'd000_05', 'd000_1']),
+])
+def test_direction_names_round_trip(step, names):
+    directions, bearings = rays.angular_directions(step)
+    assert directions[:3] == names
+    assert len(set(directions)) == len(directions) == round(360 / step)
+    np.testing.assert_allclose(rays.direction_bearings(directions), bearings, atol=1e-9)
+
+
+@pytest.mark.parametrize("step", [0, -10, 7, 360 / 7])
+def test_invalid_steps(step):
+    with pytest.raises(ValueError):
+        rays.angular_directions(step)
+
+
+def test_sectors_take_every_direction_of_their_quadrant():
+    directions, bearings = rays.angular_directions(10)
+    sectors = quadrant.sector_quadrants(directions)
+    assert sorted(sectors['NE']) == [d for d, b in zip(directions, bearings) if b <= 90]
+    assert sorted(sectors['NW']) == ['d000'] + [d for d, b in zip(directions, bearings) if b >= 270]
+
+
+def test_fetch_matrix_rejects_other_directions():
+    directions, _ = rays.angular_directions(10)
+    arcs = pd.DataFrame({'ID': [1, 1, 2], 'direction': ['d000', 'nne', 'd010'], 'Shape_Length': [5.0, 6.0, 7.0]})
+    with pytest.raises(ValueError, match="nne"):
+        fetch.fetch_matrix(arcs, directions=directions)
+    ids, matrix = fetch.fetch_matrix(arcs[arcs['direction'] != 'nne'], directions=directions)
+    assert matrix.shape == (2, 36) and matrix[0, 0] == 5.0 and matrix[1, 1] == 7.0
@@ -0,0 +1,74 @@
+# Shoreline pieces of split_shoreline against shapely.ops.substring.
+
+import numpy as np
+import pytest
+import shapely
+from shapely.geometry import LineString
+from shapely.ops import substring
+
+from utils import shoreline
+
+
+# vertices at measures 0, 10 (doubled, and on a cut), 17.5, 22.5, 39.5
+LINE = LineString([(0, 0), (10, 0), (10, 0), (10, 7.5), (13, 11.5), (30, 11.5)])
+
+
+def expected(line, spacing):
+    pieces = max(int(np.ceil(line.length / spacing)), 1)
+    return [substring(line, k * spacing, min((k + 1) * spacing, line.length)) for k in range(pieces)]
+
+
+def assert_same_piece(segment, reference):
+    # substring returns a Point for a zero-length piece; split_shoreline a two-point line on it
+    coords = shapely.get_coordinates(reference)
+    if isinstance(reference, shapely.Point):
+        coords = np.vstack([coords, coords])
+    np.testing.assert_allclose(shapely.get_coordinates(segment), coords, rtol=0, atol=1e-9)
+
+
+@pytest.mark.parametrize("spacing", [10.0, 7.5, 3.0, 50.0])
+def test_pieces_match_substring(spacing):
+    ids, segments, midpoints, bearings = shoreline.split_shoreline([LINE], spacing, dissolve=False)
+    reference = expected(LINE, spacing)
+    assert len(segments) == len(reference)
+    assert list(ids) == list(range(1, len(reference) + 1))
+    for segment, piece in zip(segments, reference):
+        assert_same_piece(segment, piece)
+    np.testing.assert_allclose(shapely.length(segments).sum(), LINE.length)
+
+    lo = np.arange(len(reference)) * spacing
+    hi = np.minimum(lo + spacing, LINE.length)
+    mid = shapely.get_coordinates(shapely.line_interpolate_point(LINE, (lo + hi) / 2))
+    np.testing.assert_allclose(shapely.get_coordinates(midpoints), mid, atol=1e-9)
+    start, end = shapely.get_coordinates(segments[0])[[0, -1]]
+    assert bearings[0] == pytest.approx(np.degrees(np.arctan2(end[0] - start[0], end[1] - start[1])) % 360)
+
+
+def test_cut_on_a_vertex():
+    _, segments, _, _ = shoreline.split_shoreline([LINE], 10.0, dissolve=False)
+    # the cut at 10 m falls on the doubled vertex: it ends one piece and starts the next, once each
+    assert list(segments[0].coords) == [(0, 0), (10, 0)]
+    assert list(segments[1].coords)[:2] == [(10, 0), (10, 7.5)]
+
+
+def test_zero_length_piece():
+    point = LineString([(5, 5), (5, 5)])
+    ids, segments, midpoints, _ = shoreline.split_shoreline([LINE, point], 10.0, dissolve=False)
+    reference = expected(LINE, 10.0) + expected(point, 10.0)
+    assert len(segments) == len(reference)
+    for segment, piece in zip(segments, reference):
+        assert_same_piece(segment, piece)
+    assert shapely.length(segments[-1]) == 0
+    assert list(midpoints[-1].coords) == [(5, 5)]
+
+
+def test_dissolved_arcs_match_substring_of_the_whole_line():
+    coords = list(LINE.coords)
+    arcs = [LineString(coords[:4]), LineString(coords[3:])]
+    _, segments, _, _ = shoreline.split_shoreline(arcs, 7.5)
+    whole = shoreline.dissolve_shoreline(arcs)
+    assert len(whole) == 1
+    reference = expected(whole[0], 7.5)
+    assert len(segments) == len(reference)
+    for segment, piece in zip(segments, reference):
+        assert_same_piece(segment, piece)
@@ -0,0 +1,91 @@
+# Round trips through the columnar store: GeoParquet layers and the Arrow fetch matrix.
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pytest
+import shapely
+
+from utils import store
+from utils.rays import DIRECTIONS
+
+import synthetic
+
+
+def points(n=50):
+    rng = np.random.default_rng(3)
+    x = synthetic.X0 + rng.uniform(0, 1000, n)
+    y = synthetic.Y0 + rng.uniform(0, 1000, n)
+    # columns deliberately out of alphabetical order, geometry in the middle
+    return gpd.GeoDataFrame({'splitID': np.arange(1, n + 1, dtype=np.int64),
+                             'ID': np.arange(n, 0, -1, dtype=np.int64),
+                             'geometry': shapely.points(x, y),
+                             'bearing': rng.uniform(0, 360, n).astype(np.float32),
+                             'direction': np.array(DIRECTIONS)[np.arange(n) % len(DIRECTIONS)]},
+                            crs=synthetic.CRS)
+
+
+def test_is_store():
+    assert store.is_store("outputs/poquoson.store")
+    assert store.is_store("outputs/Poquoson.STORE/")
+    assert not store.is_store("outputs/poquoson.gdb")
+
+
+def test_layer_round_trip(tmp_path):
+    ws = str(tmp_path / "run.store")
+    frame = points()
+    store.write_layer(frame, ws, "center_points")
+    back = store.read_layer(ws, "center_points")
+
+    assert list(back.columns) == list(frame.columns)
+    assert back.crs == frame.crs
+    assert dict(back.dtypes.astype(str).drop(['geometry', 'direction'])) == \
+        dict(frame.dtypes.astype(str).drop(['geometry', 'direction']))
+    pd.testing.assert_frame_equal(back, frame, check_dtype=False)
+    assert back.geometry.geom_equals_exact(frame.geometry, tolerance=0).all()
+
+
+def test_layer_columns_and_id_range(tmp_path):
+    ws = str(tmp_path / "run.store")
+    frame = points()
+    store.write_layer(frame, ws, "center_points")
+
+    part = store.read_layer(ws, "center_points", columns=['ID', 'bearing'], id_range=(10, 19))
+    assert list(part.columns) == ['ID', 'bearing', 'geometry']
+    assert part.crs == frame.crs
+    assert sorted(part['ID']) == list(range(10, 20))
+    expected = frame.set_index('ID').loc[part['ID']]
+    np.testing.assert_array_equal(part['bearing'].values, expected['bearing'].values)
+
+    table = store.read_layer(ws, "center_points", columns=['splitID'], ignore_geometry=True)
+    assert not isinstance(table, gpd.GeoDataFrame)
+    assert list(table.columns) == ['splitID']
+
+
+def test_matrix_round_trip(tmp_path):
+    ws = str(tmp_path / "run.store")
+    ids = np.array([7, 3, 11, 5])
+    matrix = np.random.default_rng(0).uniform(0, 10000, (len(ids), len(DIRECTIONS)))
+    store.write_matrix(ws, "fetch", ids, matrix)
+
+    back_ids, back, directions = store.read_matrix(ws, "fetch")
+    assert directions == list(DIRECTIONS)
+    assert back_ids.dtype == np.int64 and back.dtype == np.float32
+    np.testing.assert_array_equal(back_ids, ids)
+    np.testing.assert_array_equal(back, matrix.astype(np.float32))
+    assert not back.flags.writeable
+
+    subset = [DIRECTIONS[3], DIRECTIONS[0]]
+    _, columns, names = store.read_matrix(ws, "fetch", directions=subset)
+    assert names == subset
+    np.testing.assert_array_equal(columns, matrix.astype(np.float32)[:, [3, 0]])
+
+
+def test_matrix_of_other_directions(tmp_path):
+    ws = str(tmp_path / "run.store")
+    store.write_matrix(ws, "fetch", [1, 2], np.array([[1.0, 2.0], [3.0, 4.0]]), directions=['N', 'S'])
+    _, matrix, directions = store.read_matrix(ws, "fetch")
+    assert directions == ['N', 'S']
+    assert matrix.tolist() == [[1.0, 2.0], [3.0, 4.0]]
+    with pytest.raises(ValueError):
+        store.read_matrix(ws, "fetch", directions=['E'])
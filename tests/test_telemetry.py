@@ -0,0 +1,54 @@
+# Stage measurement is skipped unless telemetry or profiling is on.
+
+import json
+import threading
+
+from utils import telemetry
+
+
+def test_stage_is_free_when_telemetry_is_off(monkeypatch):
+    monkeypatch.delenv('TMI_TELEMETRY', raising=False)
+    monkeypatch.delenv('TMI_PROFILE', raising=False)
+    threads = threading.active_count()
+    with telemetry.Stage("outer") as outer:
+        with telemetry.Stage("inner") as inner:
+            assert threading.active_count() == threads
+            assert telemetry.current() is inner
+            telemetry.count(5)
+        assert telemetry.current() is outer
+    assert telemetry.current() is None
+    assert inner.items == 5
+    assert outer.record is None and inner.record is None
+
+
+def test_stage_records_when_telemetry_is_on(monkeypatch, tmp_path):
+    path = tmp_path / "telemetry.jsonl"
+    monkeypatch.setenv('TMI_TELEMETRY', str(path))
+    monkeypatch.delenv('TMI_PROFILE', raising=False)
+    with telemetry.Stage("outer", area="a"):
+        with telemetry.Stage("inner", items=3):
+            pass
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [r['stage'] for r in records] == ["inner", "outer"]
+    assert records[0]['parent'] == "outer" and records[0]['items'] == 3
+    assert records[1]['area'] == "a" and records[1]['wall_s'] >= 0
+
+
+def test_always_measures_without_writing(monkeypatch):
+    monkeypatch.delenv('TMI_TELEMETRY', raising=False)
+    monkeypatch.delenv('TMI_PROFILE', raising=False)
+    with telemetry.Stage("benchmark", always=True) as stage:
+        pass
+    assert stage.record['wall_s'] >= 0 and 'rss_growth_mb' in stage.record
+
+
+def test_profiled_stage_is_measured(monkeypatch, tmp_path):
+    monkeypatch.delenv('TMI_TELEMETRY', raising=False)
+    monkeypatch.setenv('TMI_PROFILE', "step3*")
+    monkeypatch.setenv('TMI_PROFILE_DIR', str(tmp_path))
+    with telemetry.Stage("step3.arcs") as profiled:
+        pass
+    with telemetry.Stage("step1.split") as other:
+        pass
+    assert profiled.record['profile'].startswith(str(tmp_path))
+    assert other.record is None
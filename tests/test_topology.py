@@ -0,0 +1,118 @@
+# utils/topology.py against a shapely port of the Step5 buffer/intersect chain
+# (Step5_CheckFetchResultsForSmallSegmentsWithCodeDifferentFromSurrounding_Mar2024.py)
+# on a zigzag shoreline with runs of every length, and the smoothing sweep.
+
+import numpy as np
+import pandas as pd
+import shapely
+import geopandas as gpd
+
+from utils import topology
+from utils.topology import CODES
+
+
+def shoreline(lengths, codes, x0=0.0, y0=0.0):
+
+    """
+    Arcs laid end to end along a zigzag, one per length, with their codes.
+    """
+
+    angle = np.where(np.arange(len(lengths)) % 2 == 0, 0.3, -0.3)
+    x = x0 + np.r_[0.0, np.cumsum(lengths * np.cos(angle))]
+    y = y0 + np.r_[0.0, np.cumsum(lengths * np.sin(angle))]
+    lines = shapely.linestrings(np.stack([np.c_[x[:-1], y[:-1]], np.c_[x[1:], y[1:]]], axis=1))
+    return gpd.GeoDataFrame({'MxQExpCode': codes}, geometry=lines, crs="EPSG:26918")
+
+
+def random_arcs(seed=0):
+    rng = np.random.default_rng(seed)
+    parts = []
+    for k in range(5):
+        n = 60
+        lengths = rng.choice([3.0, 8.0, 12.0, 30.0, 60.0], n)
+        codes = np.array(CODES)[rng.integers(0, 3, n)]
+        parts.append(shoreline(lengths, codes, 0.0, 1000.0 * k))
+    # a lone short arc, a "marsh island?"
+    parts.append(shoreline(np.array([10.0]), np.array(['low']), 0.0, 6000.0))
+    return pd.concat(parts, ignore_index=True)
+
+
+def step5(arcs, max_length=25.1, distance=0.25):
+
+    """
+    The Step5 chain: Dissolve SINGLE_PART on the code, buffer the parts of max_length or less,
+    intersect the buffers with both end points of every part, Frequency/PivotTable the codes.
+    """
+
+    rows = []
+    for code in CODES:
+        merged = shapely.line_merge(shapely.union_all(arcs.geometry[arcs['MxQExpCode'] == code].values))
+        rows += [(code, part) for part in shapely.get_parts(merged)]
+    parts = gpd.GeoDataFrame({'MxQExpCode': [c for c, _ in rows]}, geometry=[g for _, g in rows])
+    ends = np.concatenate([shapely.get_point(parts.geometry.values, 0), shapely.get_point(parts.geometry.values, -1)])
+    end_part = np.tile(np.arange(len(parts)), 2)
+
+    out = {}
+    for i in np.flatnonzero(parts.length.values <= max_length):
+        touching = np.unique(end_part[shapely.dwithin(ends, parts.geometry[i], distance)])
+        count = {code: int((parts['MxQExpCode'].values[touching] == code).sum()) for code in CODES}
+        comment, do_this = None, None
+        for code in CODES:
+            if count[code] == 2:
+                comment = "change to " + code
+            if count[code] == 1 and parts['MxQExpCode'][i] != code:
+                do_this = "qc"
+        if comment is None and do_this is None:
+            comment = "marsh island?"
+        key = (parts['MxQExpCode'][i], round(parts.length[i], 6), tuple(np.round(shapely.get_coordinates(
+            parts.geometry[i]).min(axis=0), 6)))
+        out[key] = (count['low'], count['moderate'], count['high'], comment, do_this)
+    return out
+
+
+def test_small_segments_match_step5():
+    arcs = random_arcs()
+    checked = topology.check_small_segments(arcs)
+    small = checked[checked['originalMaxQuadFetch'].notna()]
+
+    got = {}
+    for _, part in small.iterrows():
+        key = (part['MxQExpCode'], round(part['Shape_Length'], 6),
+               tuple(np.round(shapely.get_coordinates(part.geometry).min(axis=0), 6)))
+        got[key] = tuple(None if pd.isna(part[f]) else part[f] for f in ('low', 'moderate', 'high', 'comment', 'doThis'))
+
+    expected = step5(arcs)
+    assert len(expected) > 20
+    assert {v[3] for v in expected.values()} >= {"change to low", "change to high", "marsh island?", None}
+    assert got == expected
+    assert len(small) == (checked['Shape_Length'] <= topology.SMALL_LENGTH).sum()
+
+
+def test_endpoint_snapping_is_transitive_not_gridded():
+    # 0.2499 and 0.2501 fall in different 0.25 m grid cells but are 0.0002 m apart
+    lines = shapely.linestrings([[[0.0, 0.0], [0.2499, 0.0]], [[0.2501, 0.0], [10.0, 0.0]],
+                                 [[10.3, 0.0], [20.0, 0.0]]])
+    start, end = topology.endpoint_nodes(lines)
+    assert end[0] == start[1]
+    assert end[1] != start[2]
+
+
+def test_smooth_codes():
+    # a 10 m low run inside high is recoded, a 30 m one and a change between two codes are not
+    arcs = shoreline(np.array([50.0, 4.0, 6.0, 50.0, 30.0, 50.0, 10.0, 50.0]),
+                     np.array(['high', 'low', 'low', 'high', 'low', 'high', 'moderate', 'low']))
+    smoothed = topology.smooth_codes(arcs)
+    assert list(smoothed['MxQExpCode']) == ['high', 'high', 'high', 'high', 'low', 'high', 'moderate', 'low']
+    assert list(smoothed['originalMaxQuadFetch'].notna()) == [False, True, True] + [False] * 5
+    assert smoothed['comment'][1] == "change to high"
+
+
+def test_smooth_codes_closed_shoreline():
+    # on a ring the run wrapping around the first arc is embedded too
+    ring = shapely.get_coordinates(shapely.Point(0, 0).buffer(100.0, 8).exterior)
+    lines = shapely.linestrings(np.stack([ring[:-1], ring[1:]], axis=1))
+    codes = np.full(len(lines), 'moderate', dtype=object)
+    codes[0] = 'high'
+    arcs = gpd.GeoDataFrame({'MxQExpCode': codes}, geometry=lines)
+    assert shapely.length(lines[0]) < topology.SMALL_LENGTH
+    assert (topology.smooth_codes(arcs)['MxQExpCode'] == 'moderate').all()
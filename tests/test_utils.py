@@ -0,0 +1,89 @@
+# Raster helpers of utils/utils.py on small tiled GeoTIFFs.
+
+import os
+
+import numpy as np
+import rasterio
+import shapely
+import pytest
+from rasterio.transform import from_origin
+
+import synthetic
+from utils import utils
+
+
+def write_raster(path, data, transform, nodata=None, blocksize=128):
+    with rasterio.open(path, "w", driver="GTiff", width=data.shape[2], height=data.shape[1], count=data.shape[0],
+                       dtype=data.dtype, crs=synthetic.CRS, transform=transform, nodata=nodata,
+                       tiled=True, blockxsize=blocksize, blockysize=blocksize) as dst:
+        dst.write(data)
+    return path
+
+
+@pytest.mark.parametrize("nodata", [-9999.0, None])
+def test_crop_boundary_to_file_matches_crop_boundary(tmp_path, nodata):
+    rng = np.random.default_rng(0)
+    data = rng.normal(0.0, 1.0, (1, 700, 900)).astype(np.float32)
+    transform = from_origin(synthetic.X0, synthetic.Y0 + 700.0, 1.0, 1.0)
+    dem = write_raster(str(tmp_path / "dem.tif"), data, transform, nodata)
+
+    # a triangle across the 128 px blocks: its window has corner blocks entirely outside it
+    x0, y0 = synthetic.X0, synthetic.Y0
+    boundary = [shapely.Polygon([(x0 + 50.3, y0 + 40.7), (x0 + 870.2, y0 + 95.1), (x0 + 140.6, y0 + 660.9)]),
+                shapely.box(x0 + 600.5, y0 + 500.5, x0 + 650.5, y0 + 530.5)]
+    expected_meta, expected = utils.crop_boundary(dem, boundary)
+    meta = utils.crop_boundary_to_file(dem, boundary, str(tmp_path / "crop.tif"), blocksize=128)
+
+    with rasterio.open(str(tmp_path / "crop.tif")) as src:
+        assert src.transform == expected_meta['transform']
+        assert src.nodata == (nodata if nodata is not None else 0)
+        np.testing.assert_array_equal(src.read(), expected)
+    assert (meta['width'], meta['height']) == (expected.shape[2], expected.shape[1])
+
+
+def resample_inputs(tmp_path, seed=0):
+    rng = np.random.default_rng(seed)
+    dem = write_raster(str(tmp_path / "dem.tif"), rng.normal(0.0, 1.0, (1, 300, 400)).astype(np.float32),
+                       from_origin(synthetic.X0, synthetic.Y0 + 300.0, 1.0, 1.0), -9999.0)
+    target = write_raster(str(tmp_path / "prediction.tif"), np.zeros((1, 130, 170), dtype=np.uint8),
+                          from_origin(synthetic.X0 + 3.3, synthetic.Y0 + 290.0, 2.3, 2.3))
+    return dem, target
+
+
+def test_warp_to_grid_matches_upsample(tmp_path):
+    dem, target = resample_inputs(tmp_path)
+    _, expected = utils.upsample(dem, target)
+    utils.warp_to_grid(dem, target, str(tmp_path / "warped.tif"), blocksize=64)
+    with rasterio.open(str(tmp_path / "warped.tif")) as src, rasterio.open(target) as grid:
+        assert src.transform == grid.transform and src.crs == grid.crs
+        np.testing.assert_array_equal(src.read(), expected)
+
+
+def test_cached_warp_to_grid(tmp_path, monkeypatch):
+    dem, target = resample_inputs(tmp_path)
+    cache_dir = str(tmp_path / "cache")
+    warps = []
+    warp = utils.warp_to_grid
+    monkeypatch.setattr(utils, "warp_to_grid", lambda *args, **kwargs: warps.append(args) or warp(*args, **kwargs))
+
+    first = utils.cached_warp_to_grid(dem, target, cache_dir)
+    assert utils.cached_warp_to_grid(dem, target, cache_dir) == first
+    assert len(warps) == 1
+
+    # the source written again with the same bytes (a new mtime) still hits
+    with open(dem, 'rb') as f:
+        content = f.read()
+    with open(dem, 'wb') as f:
+        f.write(content)
+    assert utils.cached_warp_to_grid(dem, target, cache_dir) == first
+    assert len(warps) == 1
+
+    # new data replaces the entry of the old data on the same grid
+    with rasterio.open(dem, "r+") as src:
+        src.write(src.read() + 1.0)
+    second = utils.cached_warp_to_grid(dem, target, cache_dir)
+    assert second != first and len(warps) == 2
+    assert os.listdir(cache_dir) == [os.path.basename(second)]
+    _, expected = utils.upsample(dem, target)
+    with rasterio.open(second) as src:
+        np.testing.assert_array_equal(src.read(), expected)
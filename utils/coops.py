@@ -0,0 +1,314 @@
+# Concurrent client for the NOAA CO-OPS APIs (tides and currents).
+#
+# All station requests share one pooled aiohttp session and run concurrently,
+# limited by a semaphore. Long date ranges are split into the largest windows
+# the data API accepts for the product, failed requests are retried with
+# exponential backoff, and the response bodies are kept in an on-disk cache
+# keyed by the request, so reruns and overlapping downloads are served locally
+# (except errors and windows that are not over yet, which are asked again).
+# utils/coops_server.py is a stand-in server for working offline.
+
+import os
+import json
+import random
+import time
+import asyncio
+import hashlib
+from datetime import datetime, timedelta, timezone
+
+import aiohttp
+import numpy as np
+import pandas as pd
+import shapely
+
+
+BASE_URL = "https://api.tidesandcurrents.noaa.gov"
+DATA_PATH = "/api/prod/datagetter"
+MDAPI_PATH = "/mdapi/prod/webapi"
+
+# Longest date range (days) the data API serves in one request, by product
+MAX_DAYS = {
+    'water_level': 31,
+    'one_minute_water_level': 4,
+    'predictions': 365,
+    'hourly_height': 365,
+    'high_low': 365,
+    'daily_mean': 3650,
+    'monthly_mean': 3650,
+}
+
+DATE_FORMAT = "%Y%m%d %H:%M"
+
+# Refresh the cached station catalog after a week (s)
+CATALOG_TTL = 7 * 24 * 3600
+
+# HTTP statuses worth retrying
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+def parse_date(date):
+    if isinstance(date, datetime):
+        return date
+    for fmt in (DATE_FORMAT, "%Y%m%d", "%Y-%m-%d", "%Y-%m-%d %H:%M"):
+        try:
+            return datetime.strptime(str(date), fmt)
+        except ValueError:
+            pass
+    raise ValueError("Unrecognized date: " + str(date))
+
+
+def date_windows(begin_date, end_date, max_days):
+
+    """
+    Split [begin_date, end_date] into consecutive windows of at most max_days.
+    Windows do not overlap: each starts one minute after the previous one ends.
+    Returns a list of (begin, end) strings in the API's date format.
+    """
+
+    begin, end = parse_date(begin_date), parse_date(end_date)
+    windows = []
+    while begin <= end:
+        stop = min(begin + timedelta(days=max_days) - timedelta(minutes=1), end)
+        windows.append((begin.strftime(DATE_FORMAT), stop.strftime(DATE_FORMAT)))
+        begin = stop + timedelta(minutes=1)
+    return windows
+
+
+class ContentCache:
+
+    """
+    On-disk cache of response bodies, one file per request named by the hash of its URL and parameters.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, url, params):
+        key = url + '?' + json.dumps(sorted((params or {}).items()), default=str)
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, url, params):
+        path = self.path(url, params)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                return f.read()
+        return None
+
+    def put(self, url, params, body):
+        path = self.path(url, params)
+        with open(path + '.part', 'wb') as f:
+            f.write(body)
+        os.replace(path + '.part', path)
+
+
+class CoopsClient:
+
+    """
+    Async CO-OPS client, used as `async with CoopsClient(...) as client:`.
+
+    base_url: API host, e.g. the URL of a local coops_server for offline runs
+    cache_dir: folder of the ContentCache, or None to always go to the network
+    concurrency: maximum number of requests in flight (also the connection pool size)
+    retries, backoff: attempts after the first failure and the base delay (s), doubled per attempt
+    """
+
+    def __init__(self, base_url=BASE_URL, cache_dir=None, concurrency=8, retries=4, backoff=1.0, timeout=60,
+                 application='TMI_ShorelineInventory'):
+        self.base_url = base_url.rstrip('/')
+        self.cache = ContentCache(cache_dir) if cache_dir else None
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.application = application
+        self.session = None
+        self.semaphore = None
+
+    async def __aenter__(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.concurrency),
+                                             timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def get_json(self, path, params=None, cache=True):
+
+        """
+        GET base_url + path, from the cache when possible; retried on connection errors and 429/5xx.
+        cache: False for requests whose answer can still change (data windows not over yet);
+            error responses ("No data ...") are never kept either
+        """
+
+        url = self.base_url + path
+        if self.cache is not None and cache:
+            body = self.cache.get(url, params)
+            if body is not None:
+                return json.loads(body)
+
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.semaphore:
+                    async with self.session.get(url, params=params) as response:
+                        response.raise_for_status()
+                        body = await response.read()
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.retries or (isinstance(e, aiohttp.ClientResponseError)
+                                               and e.status not in RETRY_STATUS):
+                    raise
+                await asyncio.sleep(self.backoff * 2 ** attempt * (0.5 + random.random()))
+
+        response = json.loads(body)
+        if self.cache is not None and cache and not (isinstance(response, dict) and 'error' in response):
+            self.cache.put(url, params, body)
+        return response
+
+    async def stations(self, station_type='waterlevels'):
+
+        """
+        The station catalog (mdapi stations.json) as a DataFrame with name, id, lat, lng.
+        """
+
+        response = await self.get_json(MDAPI_PATH + "/stations.json", {'type': station_type})
+        return pd.DataFrame([[s['name'], s['id'], s['lat'], s['lng']] for s in response['stations']],
+                            columns=['name', 'id', 'lat', 'lng'])
+
+    async def datums(self, station, units='metric'):
+
+        """
+        Tidal datums of one station, one row per datum. Values are relative to NAVD88 when the
+        station has it (datum column NAVD88), otherwise to the station datum (STND).
+        """
+
+        response = await self.get_json(MDAPI_PATH + "/stations/" + str(station) + "/datums.json",
+                                       {'units': units})
+        table = pd.DataFrame(response.get('datums') or [], columns=['name', 'description', 'value'])
+        navd = table.loc[table['name'] == 'NAVD88', 'value']
+        if len(navd) and pd.notna(navd.iloc[0]):
+            table['value'] = table['value'] - navd.iloc[0]
+            table['datum'] = 'NAVD88'
+        else:
+            table['datum'] = 'STND'
+        table.insert(0, 'id', str(station))
+        return table
+
+    async def product(self, station, product, begin_date, end_date, datum='NAVD', units='metric',
+                      time_zone='gmt', interval=None):
+
+        """
+        One data product (water_level, predictions, hourly_height, ...) of one station over a
+        date range, fetched as concurrent requests of at most MAX_DAYS[product] days each.
+        Windows the API has no data for are skipped. Returns a DataFrame with id, t, v and
+        the product's other fields.
+        """
+
+        params = {'station': str(station), 'product': product, 'datum': datum, 'units': units,
+                  'time_zone': time_zone, 'format': 'json', 'application': self.application}
+        if interval:
+            params['interval'] = interval
+
+        # windows ending less than a day ago (whatever the time zone) may still get data
+        settled = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=1)
+        windows = date_windows(begin_date, end_date, MAX_DAYS.get(product, 31))
+        responses = await asyncio.gather(*[self.get_json(DATA_PATH, dict(params, begin_date=b, end_date=e),
+                                                         cache=parse_date(e) < settled)
+                                           for b, e in windows])
+
+        rows = []
+        for response in responses:
+            if 'error' in response:
+                message = response['error'].get('message', '')
+                if not message.startswith('No data'):
+                    raise ValueError("CO-OPS " + product + " request for station " + str(station) + ": " + message)
+            rows.extend(response.get('predictions') or response.get('data') or [])
+        table = pd.DataFrame(rows)
+        if len(table):
+            table['t'] = pd.to_datetime(table['t'])
+            table['v'] = pd.to_numeric(table['v'], errors='coerce')
+        table.insert(0, 'id', str(station))
+        return table
+
+
+async def _download(stations, product, begin_date, end_date, datum, units, time_zone, interval, **client_args):
+    async with CoopsClient(**client_args) as client:
+        datum_tables = await asyncio.gather(*[client.datums(s, units) for s in stations])
+        data_tables = await asyncio.gather(*[client.product(s, product, begin_date, end_date, datum, units,
+                                                            time_zone, interval) for s in stations])
+    return pd.concat(datum_tables, ignore_index=True), pd.concat(data_tables, ignore_index=True)
+
+
+def download(stations, product, begin_date, end_date, datum='NAVD', units='metric', time_zone='gmt',
+             interval=None, **client_args):
+
+    """
+    Datums and one data product for many stations at once (blocking wrapper around CoopsClient).
+
+    stations: station IDs, e.g. the id column of tide_data_retrival.get_stations_from_bbox
+    product, begin_date, end_date, datum, units, time_zone, interval: CO-OPS data API parameters
+    client_args: passed to CoopsClient (base_url, cache_dir, concurrency, retries, backoff)
+    Returns (datums, data) DataFrames, both with the station id in the id column.
+    """
+
+    return asyncio.run(_download([str(s) for s in stations], product, begin_date, end_date, datum, units,
+                                 time_zone, interval, **client_args))
+
+
+async def _catalog(station_type, **client_args):
+    async with CoopsClient(**client_args) as client:
+        return await client.stations(station_type)
+
+
+def station_catalog(catalog_path, ttl=CATALOG_TTL, station_type='waterlevels', **client_args):
+
+    """
+    The CO-OPS station catalog, kept in a Parquet file and downloaded again only once it is older than ttl seconds.
+
+    catalog_path: the Parquet file, e.g. outputs/coops_cache/stations.parquet
+    client_args: passed to CoopsClient (base_url, retries, ...); the response cache is not used
+    Returns a DataFrame with name, id, lat, lng.
+    """
+
+    if os.path.exists(catalog_path) and time.time() - os.path.getmtime(catalog_path) < ttl:
+        return pd.read_parquet(catalog_path)
+
+    client_args['cache_dir'] = None
+    catalog = asyncio.run(_catalog(station_type, **client_args))
+    catalog['lat'] = catalog['lat'].astype(np.float64)
+    catalog['lng'] = catalog['lng'].astype(np.float64)
+    os.makedirs(os.path.dirname(os.path.abspath(catalog_path)), exist_ok=True)
+    catalog.to_parquet(catalog_path + '.part', index=False)
+    os.replace(catalog_path + '.part', catalog_path)
+    return catalog
+
+
+def assign_stations(catalog, boundaries, name_field=None):
+
+    """
+    Stations inside each of many boundaries, in one call.
+
+    catalog: DataFrame with lat and lng columns (station_catalog)
+    boundaries: GeoDataFrame of study area polygons, in any CRS
+    name_field: column naming the boundaries; the row index is used when not given
+    Returns the catalog rows inside a boundary with a boundary column added, one row per
+    (station, boundary) pair, in boundary order.
+    """
+
+    geoms = np.asarray(boundaries.to_crs("EPSG:4326").geometry.values, dtype=object)
+    names = boundaries[name_field].values if name_field else boundaries.index.values
+    shapely.prepare(geoms)
+    x = catalog['lng'].values.astype(np.float64)
+    y = catalog['lat'].values.astype(np.float64)
+
+    rows, labels = [], []
+    for geom, name, (xmin, ymin, xmax, ymax) in zip(geoms, names, shapely.bounds(geoms)):
+        candidates = np.flatnonzero((x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax))
+        inside = candidates[shapely.contains_xy(geom, x[candidates], y[candidates])]
+        rows.append(inside)
+        labels.append(np.repeat(name, len(inside)))
+
+    selected = catalog.iloc[np.concatenate(rows) if rows else []].reset_index(drop=True)
+    selected['boundary'] = np.concatenate(labels) if labels else []
+    return selected
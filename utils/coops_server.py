@@ -0,0 +1,149 @@
+# Local stand-in for the CO-OPS APIs, for running utils/coops.py offline.
+#
+# Serves the stations of data/stations.csv: the station catalog, their datums
+# (relative to a made-up station datum, with NAVD88 listed for the NAVD88
+# stations) and a synthetic semidiurnal tide between their MLW and MHW for the
+# water_level, hourly_height and predictions products. Requests longer than the
+# product's maximum window are refused the way the real API does, and a share of
+# requests can be failed with 503 to exercise the client's retries.
+# Usage: python coops_server.py [<port>] [<fail_rate>]
+
+import os
+import sys
+import random
+import socket
+import asyncio
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from aiohttp import web
+
+root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(root_path)
+from utils import coops
+
+
+STATIONS_CSV = os.path.join(root_path, 'data/stations.csv')
+
+# Offset of the made-up station datum below NAVD88 (m)
+STND_OFFSET = 1.0
+
+# M2 tidal period (hours)
+M2_PERIOD = 12.42
+
+STEP_MINUTES = {'water_level': 6, 'one_minute_water_level': 1, 'predictions': 6, 'hourly_height': 60}
+
+
+def error(message):
+    return web.json_response({'error': {'message': message}})
+
+
+def tide(station, begin, end, minutes):
+
+    """
+    Synthetic tide of a station row between begin and end every `minutes`, relative to NAVD88.
+    """
+
+    times = pd.date_range(begin, end, freq=str(minutes) + 'min')
+    hours = (times - pd.Timestamp('2000-01-01')) / pd.Timedelta(hours=1)
+    mean, amplitude = (station['MHW'] + station['MLW']) / 2, (station['MHW'] - station['MLW']) / 2
+    return times, mean + amplitude * np.cos(2 * np.pi * np.asarray(hours) / M2_PERIOD)
+
+
+def make_app(stations_csv=STATIONS_CSV, fail_rate=0.0, seed=None):
+
+    """
+    aiohttp application serving the stations of `stations_csv`.
+    fail_rate: share of requests answered with 503 Service Unavailable
+    """
+
+    stations = pd.read_csv(stations_csv, dtype={'id': str}).set_index('id', drop=False)
+    rng = random.Random(seed)
+    app = web.Application()
+    app['requests'] = 0
+
+    @web.middleware
+    async def flaky(request, handler):
+        app['requests'] += 1
+        if rng.random() < fail_rate:
+            raise web.HTTPServiceUnavailable()
+        return await handler(request)
+
+    app.middlewares.append(flaky)
+
+    async def catalog(request):
+        return web.json_response({'count': len(stations), 'stations': [
+            {'id': s['id'], 'name': s['name'], 'lat': s['lat'], 'lng': s['lng']} for _, s in stations.iterrows()]})
+
+    async def datums(request):
+        station = request.match_info['station']
+        if station not in stations.index:
+            return error("Station " + station + " not found")
+        s = stations.loc[station]
+        navd = s['datum'] == 'NAVD88'
+        offset = STND_OFFSET if navd else 0.0
+        table = [{'name': name, 'description': name, 'value': round(s[name] + offset, 3)}
+                 for name in ('MHHW', 'MHW', 'MLW', 'MLLW')]
+        if navd:
+            table.append({'name': 'NAVD88', 'description': 'North American Vertical Datum of 1988',
+                          'value': STND_OFFSET})
+        return web.json_response({'units': 'meters', 'datums': table})
+
+    async def datagetter(request):
+        q = request.query
+        product = q.get('product', '')
+        if q.get('station') not in stations.index:
+            return error("No data was found. This product may not be offered at this station at the requested time.")
+        if product not in STEP_MINUTES:
+            return error("Wrong Product")
+        try:
+            begin, end = coops.parse_date(q['begin_date']), coops.parse_date(q['end_date'])
+        except (KeyError, ValueError):
+            return error("The begin and end dates are required")
+        if end - begin >= timedelta(days=coops.MAX_DAYS[product]):
+            return error("The size limit for data retrieval for this product is "
+                         + str(coops.MAX_DAYS[product]) + " days")
+
+        s = stations.loc[q['station']]
+        if s['datum'] != 'NAVD88' and q.get('datum', 'NAVD') == 'NAVD':
+            return error("No data was found. This product may not be offered at this station at the requested time.")
+        minutes = 60 if q.get('interval') == 'h' else STEP_MINUTES[product]
+        times, values = tide(s, begin, end, minutes)
+        rows = [{'t': t.strftime("%Y-%m-%d %H:%M"), 'v': "%.3f" % v} for t, v in zip(times, values)]
+
+        key = 'predictions' if product == 'predictions' else 'data'
+        body = {key: rows}
+        if key == 'data':
+            body['metadata'] = {'id': s['id'], 'name': s['name'], 'lat': str(s['lat']), 'lon': str(s['lng'])}
+        return web.json_response(body)
+
+    app.router.add_get(coops.MDAPI_PATH + '/stations.json', catalog)
+    app.router.add_get(coops.MDAPI_PATH + '/stations/{station}/datums.json', datums)
+    app.router.add_get(coops.DATA_PATH, datagetter)
+    return app
+
+
+async def start(port=0, host='127.0.0.1', **kwargs):
+
+    """
+    Start the stand-in server inside the running event loop.
+    Returns (runner, base_url); call `await runner.cleanup()` to stop it.
+    """
+
+    # bind the socket here, so the port picked for port=0 is known
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind((host, port))
+    port = sock.getsockname()[1]
+
+    runner = web.AppRunner(make_app(**kwargs))
+    await runner.setup()
+    await web.SockSite(runner, sock).start()
+    return runner, "http://" + host + ":" + str(port)
+
+
+if __name__ == "__main__":
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+    fail_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    web.run_app(make_app(fail_rate=fail_rate), host='127.0.0.1', port=port)
@@ -0,0 +1,116 @@
+# Spatially varying tidal datums for the marsh classification.
+#
+# Instead of one MLW/MHW pair for the whole study area, the MLW and MHW of the
+# tide stations in data/stations.csv are interpolated (inverse distance
+# weighting) onto a coarse grid over the prediction raster. The grids are cached
+# on disk and bilinearly sampled for each block during reclassification, so every
+# pixel is compared with its local datums.
+
+import os
+import hashlib
+
+import numpy as np
+import pandas as pd
+import rasterio
+from pyproj import Transformer
+
+
+class DatumSurface:
+
+    """
+    A datum on a coarse grid of nodes x0 + i * cell, y0 + j * cell (values[j, i]).
+    Called with a block window and its transform (as marsh.classify_marsh does) it
+    returns the datum bilinearly interpolated at the pixel centres of the block.
+    """
+
+    def __init__(self, x0, y0, cell, values):
+        self.x0 = x0
+        self.y0 = y0
+        self.cell = cell
+        self.values = np.asarray(values, dtype=np.float32)
+
+    def __call__(self, window, transform):
+        xs = transform.c + (np.arange(window.width) + 0.5) * transform.a
+        ys = transform.f + (np.arange(window.height) + 0.5) * transform.e
+        return self.sample(xs, ys)
+
+    def sample(self, xs, ys):
+
+        """
+        Bilinear interpolation on the grid of points xs (columns) by ys (rows); returns (len(ys), len(xs)).
+        """
+
+        ny, nx = self.values.shape
+        fx = np.clip((np.asarray(xs) - self.x0) / self.cell, 0, nx - 1)
+        fy = np.clip((np.asarray(ys) - self.y0) / self.cell, 0, ny - 1)
+        i0 = np.minimum(fx.astype(np.int64), nx - 2)
+        j0 = np.minimum(fy.astype(np.int64), ny - 2)
+        wx = (fx - i0).astype(np.float32)
+        wy = (fy - j0).astype(np.float32)[:, None]
+
+        g = self.values
+        top = g[np.ix_(j0, i0)] * (1 - wx) + g[np.ix_(j0, i0 + 1)] * wx
+        bottom = g[np.ix_(j0 + 1, i0)] * (1 - wx) + g[np.ix_(j0 + 1, i0 + 1)] * wx
+        return top * (1 - wy) + bottom * wy
+
+
+def idw(x, y, values, gx, gy, power=2.0):
+
+    """
+    Inverse distance weighted interpolation of station values at the points (gx, gy).
+    """
+
+    d = np.hypot(gx.ravel()[:, None] - x[None, :], gy.ravel()[:, None] - y[None, :])
+    w = 1.0 / np.maximum(d, 1e-6) ** power
+    return ((w @ values) / w.sum(axis=1)).reshape(gx.shape)
+
+
+def datum_surfaces(stations_csv, grid_path, cell=500.0, power=2.0, cache_dir=None, datums=('MLW', 'MHW'),
+                   vertical_datum='NAVD88'):
+
+    """
+    MLW and MHW surfaces covering the grid of a raster, interpolated from the station table.
+
+    stations_csv: table of stations with lat, lng and datum columns (data/stations.csv)
+    grid_path: raster whose CRS and extent the surfaces cover, e.g. the NAIP prediction
+    cell: node spacing of the coarse grid, in the raster's CRS units
+    power: IDW power
+    cache_dir: if given, the grids are stored there keyed by the station table, grid and settings
+    vertical_datum: only stations whose datums are given relative to it (the DEM's) are used;
+        the STND rows of the table are station-local and not comparable
+    Returns one DatumSurface per requested datum column.
+    """
+
+    with rasterio.open(grid_path) as src:
+        crs = src.crs
+        left, bottom, right, top = src.bounds
+
+    stations = pd.read_csv(stations_csv)
+    stations = stations[(stations['datum'] == vertical_datum)
+                        & stations[['lat', 'lng'] + list(datums)].notna().all(axis=1)].reset_index(drop=True)
+    cache_path = None
+    if cache_dir is not None:
+        key = repr((pd.util.hash_pandas_object(stations, index=False).sum(), crs.to_wkt(),
+                    (left, bottom, right, top), cell, power, datums))
+        cache_path = os.path.join(cache_dir, 'datums_' + hashlib.sha1(key.encode('utf-8')).hexdigest()[:16] + '.npz')
+        if os.path.exists(cache_path):
+            cached = np.load(cache_path)
+            return tuple(DatumSurface(float(cached['x0']), float(cached['y0']), float(cached['cell']), cached[d])
+                         for d in datums)
+
+    # one node beyond the raster on every side
+    x0, y0 = left - cell, bottom - cell
+    nx = int(np.ceil((right - left) / cell)) + 3
+    ny = int(np.ceil((top - bottom) / cell)) + 3
+    gx, gy = np.meshgrid(x0 + cell * np.arange(nx), y0 + cell * np.arange(ny))
+
+    sx, sy = Transformer.from_crs("EPSG:4326", crs, always_xy=True).transform(stations['lng'].values,
+                                                                              stations['lat'].values)
+    grids = {d: idw(np.asarray(sx), np.asarray(sy), stations[d].values.astype(np.float64), gx, gy, power)
+             for d in datums}
+
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez(cache_path, x0=x0, y0=y0, cell=cell, **grids)
+
+    return tuple(DatumSurface(x0, y0, cell, grids[d]) for d in datums)
@@ -0,0 +1,359 @@
+# Tiled distance-to-land index for sphere-traced fetch.
+#
+# The raster mode marches every ray half a cell at a time, and the vector modes
+# intersect every ray with the shoreline, although most of a 10 km ray crosses
+# open water. This index stores, for every cell of a fixed 5 m grid, the
+# distance to the nearest land cell, in square tiles on disk. A ray can then
+# jump ahead by that distance (less a cell diagonal) without missing land, and
+# only slows down to the half-cell march of the raster mode near the shore; the
+# fetch is the same as the raster mode's on the same grid.
+#
+# The grid is anchored at the CRS origin, so the tiles of different study
+# areas line up and one index built from the regional chesbay layer serves
+# every county run. Each tile keeps a hash of the boundary segments and labels
+# around it; rebuilding the index from an edited layer recomputes only the
+# tiles whose hash changed. Distances are exact up to `halo` cells and capped
+# there, so a tile only depends on the polygons within `halo` cells of it.
+
+import os
+import json
+import hashlib
+
+import numpy as np
+import shapely
+from pyproj import CRS
+from rasterio.features import rasterize
+from rasterio.transform import from_origin
+from scipy.ndimage import distance_transform_edt
+
+from utils import fetch
+from utils.fetch_cache import boundary_keys
+from utils import rays
+from utils.rays import BEARINGS
+
+
+RESOLUTION = 5.0
+# Cells per tile side, and cells of land around a tile looked at for its distances
+TILE_SIZE = 1024
+HALO = 256
+
+INDEX_FILE = "index.json"
+
+
+def tile_bounds(i, j, size):
+
+    """
+    Bounds of tile (i, j) of side `size` map units: column i, row j counted northwards.
+    """
+
+    return i * size, j * size, (i + 1) * size, (j + 1) * size
+
+
+def tile_hashes(landwater, resolution=RESOLUTION, tile_size=TILE_SIZE, halo=HALO,
+                surface_field='surface', water_value='water'):
+
+    """
+    Content hash of every tile the land/water layer touches: the boundary segments within
+    `halo` cells of the tile, whether their polygon is water, and whether the tile center
+    is in water (for tiles without any boundary).
+    Returns {"i_j": hash}.
+    """
+
+    size = tile_size * resolution
+    margin = halo * resolution
+    keys, segments = boundary_keys(landwater, surface_field)
+    ends = np.column_stack([keys.get_level_values(k) for k in range(4)]).astype(np.int64)
+    wet = (np.asarray(keys.get_level_values(4)) == water_value).astype(np.int64)
+
+    # every segment goes to all the tiles whose halo its bounding box reaches
+    lo = np.floor((np.minimum(segments[:, :2], segments[:, 2:]) - margin) / size).astype(np.int64)
+    hi = np.floor((np.maximum(segments[:, :2], segments[:, 2:]) + margin) / size).astype(np.int64)
+    nx, ny = hi[:, 0] - lo[:, 0] + 1, hi[:, 1] - lo[:, 1] + 1
+    seg = np.repeat(np.arange(len(segments)), nx * ny)
+    k = np.arange(len(seg)) - np.repeat(np.cumsum(nx * ny) - nx * ny, nx * ny)
+    ti = lo[seg, 0] + k % nx[seg]
+    tj = lo[seg, 1] + k // nx[seg]
+
+    order = np.lexsort([wet[seg], ends[seg, 3], ends[seg, 2], ends[seg, 1], ends[seg, 0], tj, ti])
+    ti, tj, seg = ti[order], tj[order], seg[order]
+    starts = np.flatnonzero(np.r_[True, (ti[1:] != ti[:-1]) | (tj[1:] != tj[:-1])])
+    rows = np.column_stack([ends[seg], wet[seg]])
+
+    # tiles of the layer's extent without any boundary are all land or all water
+    minx, miny, maxx, maxy = landwater.total_bounds
+    ai, aj = np.meshgrid(np.arange(np.floor(minx / size), np.floor(maxx / size) + 1, dtype=np.int64),
+                         np.arange(np.floor(miny / size), np.floor(maxy / size) + 1, dtype=np.int64))
+    ai, aj = np.r_[ai.ravel(), ti[starts]], np.r_[aj.ravel(), tj[starts]]
+    unique = np.unique(np.column_stack([ai, aj]), axis=0)
+    water = fetch.water_polygons(landwater, surface_field, water_value)
+    centers = shapely.points((unique[:, 0] + 0.5) * size, (unique[:, 1] + 0.5) * size)
+    in_water = np.zeros(len(unique), dtype=bool)
+    in_water[shapely.STRtree(water).query(centers, predicate='within')[0]] = True
+
+    groups = {(a, b): (s, e) for a, b, s, e in zip(ti[starts], tj[starts], starts, np.r_[starts[1:], len(ti)])}
+    out = {}
+    for (i, j), center_wet in zip(map(tuple, unique), in_water):
+        h = hashlib.sha1(np.array([resolution, tile_size, halo, center_wet]).tobytes())
+        if (i, j) in groups:
+            s, e = groups[(i, j)]
+            h.update(np.ascontiguousarray(rows[s:e]).tobytes())
+        out[str(i) + "_" + str(j)] = h.hexdigest()
+    return out
+
+
+def tile_distances(water, tree, i, j, resolution=RESOLUTION, tile_size=TILE_SIZE, halo=HALO):
+
+    """
+    Distance in cells from every cell of tile (i, j) to the nearest land cell, capped at halo.
+    Returns a (tile_size, tile_size) uint16 array, rows counted northwards, or a single
+    int when the whole tile has the same value (all land, or open water beyond the halo).
+    """
+
+    size = tile_size * resolution
+    margin = halo * resolution
+    x0, y0, x1, y1 = tile_bounds(i, j, size)
+    n = tile_size + 2 * halo
+
+    hits = tree.query(shapely.box(x0 - margin, y0 - margin, x1 + margin, y1 + margin))
+    if len(hits) == 0:
+        return 0
+    wet = rasterize(((geom, 1) for geom in water[hits]), out_shape=(n, n),
+                    transform=from_origin(x0 - margin, y1 + margin, resolution, resolution),
+                    fill=0, dtype='uint8')[::-1]
+    if wet.all():
+        return halo
+    cells = np.minimum(np.floor(distance_transform_edt(wet)), halo).astype(np.uint16)
+    core = cells[halo:halo + tile_size, halo:halo + tile_size]
+    if core.min() == core.max():
+        return int(core[0, 0])
+    return np.ascontiguousarray(core)
+
+
+def build_index(landwater, index_dir, resolution=RESOLUTION, tile_size=TILE_SIZE, halo=HALO,
+                surface_field='surface', water_value='water', log=print):
+
+    """
+    Build or update the distance index of a land/water layer in index_dir.
+
+    landwater: GeoDataFrame of labelled land/water polygons, ideally the regional layer
+        so that county runs share the index
+    An existing index (same CRS, resolution, tile size and halo) is updated: only the tiles
+    whose hash changed are recomputed, tiles outside the layer are kept.
+    Returns the number of tiles (re)computed.
+    """
+
+    crs = landwater.crs.to_wkt() if landwater.crs is not None else None
+    meta = {'crs': crs, 'resolution': resolution, 'tile_size': tile_size, 'halo': halo, 'tiles': {}}
+    index_path = os.path.join(index_dir, INDEX_FILE)
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            old = json.load(f)
+        if all(old[k] == meta[k] for k in ('crs', 'resolution', 'tile_size', 'halo')):
+            meta = old
+        else:
+            log("index parameters changed, rebuilding all tiles")
+    os.makedirs(index_dir, exist_ok=True)
+
+    hashes = tile_hashes(landwater, resolution, tile_size, halo, surface_field, water_value)
+    changed = [key for key, h in hashes.items() if meta['tiles'].get(key, {}).get('hash') != h]
+
+    water = fetch.water_polygons(landwater, surface_field, water_value)
+    tree = shapely.STRtree(water)
+    for n, key in enumerate(changed):
+        i, j = map(int, key.split("_"))
+        cells = tile_distances(water, tree, i, j, resolution, tile_size, halo)
+        path = os.path.join(index_dir, "tile_" + key + ".npy")
+        if isinstance(cells, np.ndarray):
+            np.save(path + ".part.npy", cells)
+            os.replace(path + ".part.npy", path)
+            meta['tiles'][key] = {'hash': hashes[key], 'file': os.path.basename(path)}
+        else:
+            if os.path.exists(path):
+                os.remove(path)
+            meta['tiles'][key] = {'hash': hashes[key], 'value': cells}
+        if (n + 1) % 100 == 0:
+            log(str(n + 1) + " of " + str(len(changed)) + " tiles")
+
+    with open(index_path + ".part", "w") as f:
+        json.dump(meta, f)
+    os.replace(index_path + ".part", index_path)
+    log(str(len(changed)) + " of " + str(len(hashes)) + " tiles rebuilt")
+    return len(changed)
+
+
+class DistanceIndex:
+
+    """
+    Read-only view of an index written by build_index. Tiles are memory-mapped when first used.
+    """
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, INDEX_FILE)) as f:
+            self.meta = json.load(f)
+        self.resolution = self.meta['resolution']
+        self.tile_size = self.meta['tile_size']
+        self.halo = self.meta['halo']
+        self._tiles = {}
+
+    def key(self):
+
+        """
+        Hash of the content of the index, for caching results computed with it.
+        """
+
+        text = json.dumps({k: self.meta['tiles'][k]['hash'] for k in sorted(self.meta['tiles'])})
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def tile(self, key):
+        if key not in self._tiles:
+            entry = self.meta['tiles'].get(key)
+            if entry is None:
+                self._tiles[key] = 0
+            elif 'file' in entry:
+                self._tiles[key] = np.load(os.path.join(self.index_dir, entry['file']), mmap_mode='r')
+            else:
+                self._tiles[key] = entry['value']
+        return self._tiles[key]
+
+    def covers(self, x, y):
+
+        """
+        Whether each point falls in a tile of the index.
+        """
+
+        size = self.resolution * self.tile_size
+        ti = np.floor(np.asarray(x) / size).astype(np.int64)
+        tj = np.floor(np.asarray(y) / size).astype(np.int64)
+        tiles, inverse = np.unique(np.column_stack([ti, tj]), axis=0, return_inverse=True)
+        known = np.array([str(i) + "_" + str(j) in self.meta['tiles'] for i, j in tiles], dtype=bool)
+        return known[inverse.ravel()]
+
+    def check(self, crs, x, y):
+
+        """
+        Raise ValueError if points in `crs` cannot be traced with this index: another CRS, or
+        points outside its tiles (which would count as land and get no fetch).
+        """
+
+        index_crs = self.meta.get('crs')
+        if index_crs is not None and crs is not None and CRS.from_user_input(crs) != CRS.from_wkt(index_crs):
+            raise ValueError("distance index " + self.index_dir + " is in another CRS than the center points")
+        outside = int((~self.covers(x, y)).sum())
+        if outside:
+            raise ValueError(str(outside) + " center points are outside the distance index " + self.index_dir
+                             + "; build it from a land/water layer covering them (BuildDistanceIndex.py)")
+
+    def cells(self, x, y):
+
+        """
+        Distance in cells from the cell of each point to the nearest land cell (0 = land).
+        Points outside the index count as land, as outside the grid in the raster mode.
+        """
+
+        col = np.floor(np.asarray(x) / self.resolution).astype(np.int64)
+        row = np.floor(np.asarray(y) / self.resolution).astype(np.int64)
+        ti, tj = col // self.tile_size, row // self.tile_size
+        out = np.zeros(len(col), dtype=np.float64)
+
+        tiles, inverse = np.unique(np.column_stack([ti, tj]), axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.searchsorted(inverse[order], np.arange(len(tiles) + 1))
+        for t, (i, j) in enumerate(tiles):
+            members = order[bounds[t]:bounds[t + 1]]
+            tile = self.tile(str(i) + "_" + str(j))
+            if isinstance(tile, np.ndarray):
+                out[members] = tile[row[members] - j * self.tile_size, col[members] - i * self.tile_size]
+            else:
+                out[members] = tile
+        return out
+
+
+def open_index(index_dir, resolution=None):
+
+    """
+    Open the shared index in index_dir without changing it, for the county runs.
+    Raises ValueError if there is no index there, or if it was built at another resolution
+    than `resolution` (when given): build or update it from the regional layer with
+    BuildDistanceIndex.py.
+    """
+
+    if not os.path.exists(os.path.join(index_dir, INDEX_FILE)):
+        raise ValueError("no distance index in " + index_dir
+                         + "; build it from the regional land/water layer with BuildDistanceIndex.py")
+    index = DistanceIndex(index_dir)
+    if resolution is not None and float(resolution) != float(index.resolution):
+        raise ValueError("distance index " + index_dir + " was built at " + str(index.resolution) + " m, not "
+                         + str(resolution) + " m; rebuild it with BuildDistanceIndex.py")
+    return index
+
+
+def trace_fetch(index, x, y, bearings=BEARINGS, max_distance=10000.0, chunk_size=8192):
+
+    """
+    Sphere-trace rays from each point along each bearing up to the first land cell.
+
+    index: DistanceIndex
+    x, y: (N,) center point coordinates in the index CRS
+    The rays are sampled at the same half-cell steps as fetch_raster.march_fetch, but every
+    step that the distance field shows to be in open water is skipped.
+    Returns an (N, D) float32 fetch matrix, 0 where the ray meets land straight away and
+    max_distance where it never meets land.
+    """
+
+    res = index.resolution
+    step = res / 2.0
+    first = max(int(np.ceil(res * np.sqrt(2.0) / step)), 1)
+    last = int(np.floor(max_distance / step))
+
+    theta = np.radians(np.asarray(bearings, dtype=np.float64))
+    dx, dy = np.sin(theta), np.cos(theta)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    chunk_size = rays.points_per_batch(chunk_size, len(theta))
+
+    out = np.full((len(x), len(theta)), max_distance, dtype=np.float32)
+    for lo in range(0, len(x), chunk_size):
+        ox = np.repeat(x[lo:lo + chunk_size], len(theta))
+        oy = np.repeat(y[lo:lo + chunk_size], len(theta))
+        rdx = np.tile(dx, len(ox) // len(theta))
+        rdy = np.tile(dy, len(ox) // len(theta))
+        fetched = out[lo:lo + chunk_size].reshape(-1)  # view into out
+
+        k = np.full(len(ox), first, dtype=np.int64)
+        active = np.arange(len(ox))
+        while len(active):
+            d = k[active] * step
+            cells = index.cells(ox[active] + d * rdx[active], oy[active] + d * rdy[active])
+            land = cells == 0
+            hit = active[land]
+            fetched[hit] = np.where(k[hit] == first, 0.0, k[hit] * step)
+
+            # no land cell is closer than (cells - sqrt 2) cells to any point of this cell
+            active, cells = active[~land], cells[~land]
+            k[active] += np.maximum(np.ceil((cells - np.sqrt(2.0)) * res / step).astype(np.int64) - 1, 1)
+            active = active[k[active] <= last]
+
+    return out
+
+
+def distance_water_arcs(center_points, index, max_distance=10000.0, id_field='ID', bearings=fetch.BEARINGS,
+                        directions=fetch.DIRECTIONS, **kwargs):
+
+    """
+    Distance index counterpart of fetch.select_water_arcs.
+
+    index: DistanceIndex, or the folder of one
+    Raises ValueError if the index does not match the center points (DistanceIndex.check).
+    Returns a GeoDataFrame with the ResultingWaterArcs schema (ID, direction, Shape_Length),
+    one straight arc per ID and direction that has water fetch.
+    """
+
+    if not isinstance(index, DistanceIndex):
+        index = DistanceIndex(index)
+    x = center_points.geometry.x.values
+    y = center_points.geometry.y.values
+    index.check(center_points.crs, x, y)
+    matrix = trace_fetch(index, x, y, bearings, max_distance, **kwargs)
+    return fetch.fetch_arcs(center_points[id_field].values, x, y, matrix, center_points.crs, bearings, directions)
@@ -0,0 +1,212 @@
+# Open-source fetch engine for the shoreline inventory.
+#
+# Replaces the per-ID loop of Step3 (Select, Intersect, MultipartToSinglepart,
+# Buffer, SelectLayerByLocation) with a single batched pass over all bearing
+# rays: the water polygons are indexed once in an STRtree and every ray is
+# clipped against the polygons it touches with vectorized shapely 2 calls.
+
+import numpy as np
+import pandas as pd
+import shapely
+import geopandas as gpd
+
+from utils import rays as bearing_rays
+from utils.rays import DIRECTIONS, BEARINGS
+
+# Radius of the buffer Step3 puts around each center point to pick the water arc
+ORIGIN_TOLERANCE = 1.0
+
+
+def water_polygons(landwater, surface_field='surface', water_value='water'):
+
+    """
+    landwater: GeoDataFrame of the {name}_LandWaterPoly_{date} layer from Step2
+    Returns the water polygons as a shapely geometry array.
+    """
+
+    water = landwater[landwater[surface_field] == water_value]
+    return np.asarray(water.geometry.values, dtype=object)
+
+
+def water_arcs(ids, directions, rays, origins, water, tree=None, tolerance=ORIGIN_TOLERANCE):
+
+    """
+    Clip a batch of bearing rays to the water and keep the part leaving each origin.
+
+    ids: (M,) center point ID of each ray
+    directions: (M,) direction label of each ray
+    rays: (M,) LineString array, one ray per row
+    origins: (M,) Point array, the center point each ray starts from
+    water: (P,) water polygon array
+    tree: optional STRtree built on `water`, reused across batches
+    tolerance: distance from the origin a water arc must reach to be kept
+    Returns (ids, directions, arcs) arrays, one row per selected water arc.
+    """
+
+    if tree is None:
+        tree = shapely.STRtree(water)
+
+    rays = np.asarray(rays, dtype=object)
+    origins = np.asarray(origins, dtype=object)
+
+    # candidate (ray, polygon) pairs from the index, then one vectorized intersection
+    ray_idx, poly_idx = tree.query(rays, predicate='intersects')
+    pieces = shapely.intersection(rays[ray_idx], tree.geometries[poly_idx])
+
+    # MultipartToSinglepart
+    parts, part_idx = shapely.get_parts(pieces, return_index=True)
+    ray_idx = ray_idx[part_idx]
+
+    # keep only the linear parts touching the buffer around the origin point
+    keep = (shapely.get_type_id(parts) == 1) & \
+           (shapely.distance(parts, origins[ray_idx]) <= tolerance)
+    ray_idx = ray_idx[keep]
+
+    return np.asarray(ids)[ray_idx], np.asarray(directions)[ray_idx], parts[keep]
+
+
+def stream_water_arcs(batches, landwater, crs, tolerance=ORIGIN_TOLERANCE):
+
+    """
+    Run water_arcs over an iterable of (ids, directions, rays, origins) batches.
+
+    The batches can come straight from rays.iter_rays, so the rays are never all in memory.
+    Returns a GeoDataFrame with the ResultingWaterArcs schema (ID, direction, Shape_Length).
+    """
+
+    water = water_polygons(landwater)
+    tree = shapely.STRtree(water)
+
+    out_ids, out_dirs, out_arcs = [np.empty(0, np.int64)], [np.empty(0, object)], [np.empty(0, object)]
+    for ids, directions, rays, origins in batches:
+        i, d, a = water_arcs(ids, directions, rays, origins, water, tree, tolerance)
+        out_ids.append(i)
+        out_dirs.append(d)
+        out_arcs.append(a)
+
+    return arcs_frame(np.concatenate(out_ids), np.concatenate(out_dirs), np.concatenate(out_arcs), crs)
+
+
+def select_water_arcs(bearing_arcs, center_points, landwater, batch_size=100000,
+                      id_field='ID', direction_field='direction', tolerance=ORIGIN_TOLERANCE):
+
+    """
+    Batched replacement for Step3.
+
+    bearing_arcs: GeoDataFrame of the BearingDistance_arcs layer from Step1 (ID, direction)
+    center_points: GeoDataFrame of the SplitLine_center_point layer from Step1 (ID)
+    landwater: GeoDataFrame of the {name}_LandWaterPoly_{date} layer from Step2 with surface filled in
+    batch_size: number of rays clipped per vectorized call, bounds peak memory
+    Returns a GeoDataFrame with the ResultingWaterArcs schema (ID, direction, Shape_Length).
+    """
+
+    # origin of every ray, looked up by ID
+    centers = center_points.drop_duplicates(id_field).set_index(id_field).geometry
+    origins = np.asarray(centers.reindex(bearing_arcs[id_field]).values, dtype=object)
+
+    ids = bearing_arcs[id_field].values
+    directions = bearing_arcs[direction_field].values
+    rays = np.asarray(bearing_arcs.geometry.values, dtype=object)
+
+    batches = ((ids[lo:lo + batch_size], directions[lo:lo + batch_size],
+                rays[lo:lo + batch_size], origins[lo:lo + batch_size])
+               for lo in range(0, len(bearing_arcs), batch_size))
+    return stream_water_arcs(batches, landwater, bearing_arcs.crs, tolerance)
+
+
+def point_water_arcs(center_points, landwater, distance=10000.0, method='GEODESIC', batch_size=20000,
+                     id_field='ID', tolerance=ORIGIN_TOLERANCE, bearings=BEARINGS, directions=DIRECTIONS):
+
+    """
+    Step1 rays and Step3 in one pass: the bearing rays are generated lazily from the
+    center points and clipped batch by batch, without a BearingDistance_arcs layer.
+
+    distance: ray length in meters (the Distance_Expression of Step1)
+    method: "GEODESIC" or "PLANAR", see rays.ray_vertices
+    bearings, directions: the rays to cast, e.g. from rays.angular_directions
+    """
+
+    batches = bearing_rays.iter_rays(center_points[id_field].values, center_points.geometry.x.values,
+                                     center_points.geometry.y.values, distance, batch_size, bearings, directions,
+                                     method=method, crs=center_points.crs)
+    return stream_water_arcs(batches, landwater, center_points.crs, tolerance)
+
+
+def arcs_frame(ids, directions, arcs, crs):
+
+    """
+    Build a ResultingWaterArcs GeoDataFrame (ID, direction, Shape_Length) from arc arrays.
+    """
+
+    arcs = np.asarray(arcs, dtype=object)
+    return gpd.GeoDataFrame({'ID': np.asarray(ids, dtype=np.int64),
+                             'direction': np.asarray(directions, dtype=object),
+                             'Shape_Length': shapely.length(arcs)},
+                            geometry=gpd.GeoSeries(arcs, crs=crs), crs=crs)
+
+
+def fetch_matrix(water_arcs, ids=None, directions=DIRECTIONS, reduce='sum'):
+
+    """
+    Pivot water arcs into a per-direction fetch matrix, like the Step4 pivot table.
+
+    water_arcs: table with ID, direction and Shape_Length columns
+    ids: optional sorted array of IDs giving the matrix rows, defaults to the IDs present
+    reduce: "sum" adds up the lengths of arcs sharing an ID and direction, "max" keeps the
+        longest of them (the MAX_Shape_Length statistics of Step4)
+    Returns (ids, matrix) where matrix is (N, D) float32; directions without a water arc are 0.
+    Raises ValueError if arcs have directions that are not in `directions` (water arcs cast
+    at another angular step than the analysis).
+    """
+
+    arc_ids = np.asarray(water_arcs['ID'])
+    if ids is None:
+        ids = np.unique(arc_ids)
+    ids = np.asarray(ids)
+
+    arc_directions = np.asarray(water_arcs['direction'])
+    rows = np.searchsorted(ids, arc_ids)
+    cols = pd.Index(directions).get_indexer(arc_directions)
+    if (cols < 0).any():
+        unknown = sorted(set(arc_directions[cols < 0].astype(str)))
+        raise ValueError("water arcs have directions that are not in the analysis (another angle step?): "
+                         + ", ".join(unknown[:10]) + (" ..." if len(unknown) > 10 else ""))
+    valid = (rows < len(ids)) & (cols >= 0)
+    valid[valid] = ids[rows[valid]] == arc_ids[valid]
+
+    matrix = np.zeros((len(ids), len(directions)), dtype=np.float32)
+    accumulate = np.maximum if reduce == 'max' else np.add
+    accumulate.at(matrix, (rows[valid], cols[valid]), np.asarray(water_arcs['Shape_Length'])[valid])
+    return ids, matrix
+
+
+def fetch_table(ids, matrix, directions=DIRECTIONS):
+
+    """
+    Inverse of fetch_matrix: a long ID/direction/Shape_Length table without the empty cells.
+    """
+
+    rows, cols = np.nonzero(matrix > 0)
+    return pd.DataFrame({'ID': np.asarray(ids)[rows],
+                         'direction': np.asarray(directions, dtype=object)[cols],
+                         'Shape_Length': matrix[rows, cols].astype(np.float64)})
+
+
+def fetch_arcs(ids, x, y, matrix, crs, bearings=BEARINGS, directions=DIRECTIONS):
+
+    """
+    Straight water arcs from each center point (x, y) along each bearing, as long as the fetch.
+
+    Used by the fetch modes that only produce lengths so their output can be written
+    with the same ResultingWaterArcs schema as the vector engine.
+    """
+
+    table = fetch_table(ids, matrix, directions)
+    rows, cols = np.nonzero(matrix > 0)
+    theta = np.radians(np.asarray(bearings, dtype=np.float64))[cols]
+    length = table['Shape_Length'].values
+    x0, y0 = np.asarray(x, dtype=np.float64)[rows], np.asarray(y, dtype=np.float64)[rows]
+
+    coords = np.stack([np.stack([x0, y0], axis=-1),
+                       np.stack([x0 + length * np.sin(theta), y0 + length * np.cos(theta)], axis=-1)], axis=1)
+    return arcs_frame(table['ID'].values, table['direction'].values, shapely.linestrings(coords), crs)
@@ -0,0 +1,179 @@
+# Incremental fetch recomputation after shoreline edits.
+#
+# After a small shoreline fix, Steps 1-4 used to be rerun for the whole county.
+# The cache keeps, per center point (splitID + hash of the point geometry), the
+# water arcs and Step4 attributes of the last run, together with the land/water
+# polygons they were computed from. On the next run the boundaries of the two
+# land/water layers are diffed and only the center points that are new, or whose
+# water arcs touch an edited stretch of boundary, are recomputed; everything else
+# is taken from the cache.
+
+import os
+import json
+import hashlib
+
+import numpy as np
+import pandas as pd
+import shapely
+import geopandas as gpd
+
+from utils import fetch
+from utils import quadrant
+
+
+def geometry_hashes(geoms):
+
+    """
+    Hex digest of the normalized WKB of each geometry.
+    """
+
+    wkb = shapely.to_wkb(shapely.normalize(np.asarray(geoms, dtype=object)))
+    return np.array([hashlib.blake2b(b, digest_size=16).hexdigest() for b in wkb], dtype=object)
+
+
+def boundary_keys(landwater, surface_field='surface', precision=0.001):
+
+    """
+    One row per boundary segment of the land/water polygons, keyed by its rounded end points
+    (in a fixed order) and the surface of the polygon it bounds, so a relabelled polygon
+    counts as edited as well as a moved shoreline.
+    Returns (keys, segments) with segments an (S, 4) array of x0, y0, x1, y1.
+    """
+
+    rings, poly = shapely.get_rings(np.asarray(landwater.geometry.values, dtype=object), return_index=True)
+    coords, ring = shapely.get_coordinates(rings, return_index=True)
+    same = ring[1:] == ring[:-1]
+    segments = np.hstack([coords[:-1][same], coords[1:][same]])
+    surface = landwater[surface_field].astype(str).values[poly[ring[:-1][same]]]
+
+    ends = np.round(segments / precision).astype(np.int64)
+    swap = (ends[:, 0] > ends[:, 2]) | ((ends[:, 0] == ends[:, 2]) & (ends[:, 1] > ends[:, 3]))
+    ends[swap] = ends[swap][:, [2, 3, 0, 1]]
+    keys = pd.MultiIndex.from_arrays([ends[:, 0], ends[:, 1], ends[:, 2], ends[:, 3], surface])
+    return keys, segments
+
+
+def changed_segments(old_landwater, new_landwater, surface_field='surface'):
+
+    """
+    Boundary segments that are in only one of the two land/water layers: the edited shoreline.
+    Returns a shapely LineString array.
+    """
+
+    old_keys, old_segments = boundary_keys(old_landwater, surface_field)
+    new_keys, new_segments = boundary_keys(new_landwater, surface_field)
+    edited = np.vstack([old_segments[~old_keys.isin(new_keys)], new_segments[~new_keys.isin(old_keys)]])
+    return shapely.linestrings(edited.reshape(-1, 2, 2))
+
+
+class FetchCache:
+
+    """
+    On-disk cache of one study area's fetch results, a folder of (Geo)Parquet files:
+    points (splitID, ID, geom_hash, x, y), arcs (the water arcs), analysis (the Step4
+    attributes) and landwater (the polygons the results were computed from), and
+    params.json with the ray parameters (distance, method) of the cached run.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.points = None
+        self.arcs = None
+        self.analysis = None
+        self.landwater = None
+        self.params = None
+        if os.path.exists(self.path('points')):
+            self.points = pd.read_parquet(self.path('points'))
+            self.arcs = gpd.read_parquet(self.path('arcs'))
+            self.analysis = pd.read_parquet(self.path('analysis'))
+            self.landwater = gpd.read_parquet(self.path('landwater'))
+            if os.path.exists(os.path.join(cache_dir, 'params.json')):
+                with open(os.path.join(cache_dir, 'params.json')) as f:
+                    self.params = json.load(f)
+
+    def path(self, table):
+        return os.path.join(self.cache_dir, table + '.parquet')
+
+    def save(self, points, arcs, analysis, landwater, params):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        points.to_parquet(self.path('points'))
+        arcs.to_parquet(self.path('arcs'))
+        analysis.to_parquet(self.path('analysis'))
+        landwater.to_parquet(self.path('landwater'))
+        with open(os.path.join(self.cache_dir, 'params.json'), 'w') as f:
+            json.dump(params, f)
+        self.points, self.arcs, self.analysis, self.landwater = points, arcs, analysis, landwater
+        self.params = params
+
+    def stale_ids(self, landwater, tolerance=fetch.ORIGIN_TOLERANCE):
+
+        """
+        Cached IDs whose results may change with the new land/water layer: their center
+        point or one of their water arcs comes within `tolerance` of an edited boundary.
+        An arc that stopped at a moved shoreline touches its old segments, and an arc that
+        a new shoreline would cut crosses its new segments.
+        """
+
+        edited = changed_segments(self.landwater, landwater)
+        if len(edited) == 0:
+            return np.empty(0, dtype=np.int64)
+
+        tree = shapely.STRtree(edited)
+        arcs, _ = tree.query(np.asarray(self.arcs.geometry.values, dtype=object),
+                             predicate='dwithin', distance=tolerance)
+        origins = shapely.points(self.points['x'].values, self.points['y'].values)
+        points, _ = tree.query(origins, predicate='dwithin', distance=tolerance)
+        return np.union1d(self.arcs['ID'].values[arcs], self.points['ID'].values[points])
+
+
+def incremental_fetch(center_points, landwater, cache_dir, distance=10000.0, method='GEODESIC',
+                      id_field='ID', split_field='splitID'):
+
+    """
+    Water arcs and Step4 attributes for all center points, recomputing only what the edits touch.
+
+    center_points: GeoDataFrame of the SplitLine_center_point layer from the rerun of Step1
+    landwater: GeoDataFrame of the edited {name}_LandWaterPoly_{date} layer
+    cache_dir: folder of the FetchCache, created on the first run
+    distance, method: ray length and GEODESIC/PLANAR, as in Step1; a cache written with
+        other values is not used
+    Points are matched to the cache by splitID and geometry, not by ID, since Step1
+    renumbers the IDs after an edit; reused arcs take the point's new ID.
+    Returns (water_arcs, analysis, recomputed_ids).
+    """
+
+    cache = FetchCache(cache_dir)
+    params = {'distance': float(distance), 'method': method.upper()}
+    points = pd.DataFrame({'splitID': center_points[split_field].values,
+                           'ID': center_points[id_field].values,
+                           'geom_hash': geometry_hashes(center_points.geometry.values),
+                           'x': center_points.geometry.x.values,
+                           'y': center_points.geometry.y.values})
+
+    # cached ID of every point found in the cache, -1 for the others
+    cached_id = np.full(len(points), -1, dtype=np.int64)
+    if cache.points is not None and cache.params == params:
+        key = points['splitID'].astype(str) + ':' + points['geom_hash']
+        cached = pd.Series(cache.points['ID'].values,
+                           index=cache.points['splitID'].astype(str) + ':' + cache.points['geom_hash'])
+        cached = cached[~cached.index.duplicated(keep=False)]
+        cached_id = key.map(cached).fillna(-1).values.astype(np.int64)
+        cached_id[np.isin(cached_id, cache.stale_ids(landwater))] = -1
+    hit = cached_id >= 0
+
+    recompute = center_points[~hit]
+    new_arcs = fetch.point_water_arcs(recompute, landwater, distance, method, id_field=id_field)
+    if hit.any():
+        reused = cache.arcs[cache.arcs['ID'].isin(cached_id[hit])].copy()
+        reused['ID'] = reused['ID'].map(pd.Series(points['ID'].values[hit], index=cached_id[hit])).values
+        new_arcs = pd.concat([reused, new_arcs], ignore_index=True)
+
+    water_arcs = gpd.GeoDataFrame(new_arcs.sort_values('ID', kind='stable').reset_index(drop=True),
+                                  geometry='geometry', crs=center_points.crs)
+    # the analysis is a cheap pass over all the arcs, so fields added since the cache was written are filled too
+    ids, matrix = fetch.fetch_matrix(water_arcs, np.unique(center_points[id_field].values))
+    _, longest = fetch.fetch_matrix(water_arcs, ids, reduce='max')
+    analysis = quadrant.fetch_analysis(ids, matrix, longest=longest)
+
+    cache.save(points, water_arcs, analysis, landwater[['surface', 'geometry']], params)
+    return water_arcs, analysis, np.sort(recompute[id_field].values)
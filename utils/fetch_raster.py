@@ -0,0 +1,163 @@
+# Raster ray-marching fetch mode.
+#
+# For statewide runs the vector intersection of Step3 does not scale, so this
+# mode rasterizes the Step2 {name}_LandWaterPoly_{date} layer once into a
+# boolean land grid stored as a memory-mapped .npy file, then marches every
+# bearing from every SplitLine_center_point in vectorized NumPy until it
+# reaches the first land cell. The grid resolution trades accuracy for speed.
+
+import json
+import numpy as np
+import shapely
+import rasterio.windows
+from rasterio.features import rasterize
+from rasterio.transform import from_origin, Affine
+
+from utils import fetch
+from utils import rays
+
+
+def grid_meta_path(grid_path):
+    return grid_path + '.json'
+
+
+def grid_name(landwater_layer, resolution):
+
+    """
+    File name of the land grid of a layer at a resolution, e.g. Lancaster_LandWaterPoly_2_5m_grid.npy;
+    the exact resolution is in the name so grids of close resolutions never share a file.
+    """
+
+    return landwater_layer + "_" + repr(float(resolution)).replace(".", "_") + "m_grid.npy"
+
+
+def rasterize_landwater(landwater, grid_path, resolution=5.0, block_rows=1024,
+                        surface_field='surface', water_value='water'):
+
+    """
+    Burn the land/water polygons into a memory-mapped boolean grid (True = land).
+
+    landwater: GeoDataFrame of the {name}_LandWaterPoly_{date} layer with surface filled in
+    grid_path: output .npy file, the transform and CRS are written next to it as .npy.json
+    resolution: cell size in map units (meters for the UTM layers)
+    block_rows: number of rows rasterized at a time, bounds peak memory
+    Everything that is not a water polygon, including the area outside the layer, is land.
+    """
+
+    water = fetch.water_polygons(landwater, surface_field, water_value)
+    tree = shapely.STRtree(water)
+
+    minx, miny, maxx, maxy = landwater.total_bounds
+    width = int(np.ceil((maxx - minx) / resolution))
+    height = int(np.ceil((maxy - miny) / resolution))
+    transform = from_origin(minx, maxy, resolution, resolution)
+
+    grid = np.lib.format.open_memmap(grid_path, mode='w+', dtype=np.bool_, shape=(height, width))
+    for row in range(0, height, block_rows):
+        window = rasterio.windows.Window(0, row, width, min(block_rows, height - row))
+        hits = tree.query(shapely.box(*rasterio.windows.bounds(window, transform)))
+        if len(hits) == 0:
+            grid[row:row + window.height] = True
+            continue
+        wet = rasterize(((geom, 1) for geom in water[hits]), out_shape=(window.height, width),
+                        transform=rasterio.windows.transform(window, transform), fill=0, dtype='uint8')
+        grid[row:row + window.height] = wet == 0
+    grid.flush()
+    del grid
+
+    with open(grid_meta_path(grid_path), 'w') as f:
+        json.dump({'transform': list(transform)[:6],
+                   'crs': landwater.crs.to_wkt() if landwater.crs is not None else None}, f)
+
+    return grid_path
+
+
+def open_grid(grid_path):
+
+    """
+    Open a grid written by rasterize_landwater read-only. Returns (grid, transform, crs_wkt).
+    """
+
+    grid = np.load(grid_path, mmap_mode='r')
+    with open(grid_meta_path(grid_path)) as f:
+        meta = json.load(f)
+    return grid, Affine(*meta['transform']), meta['crs']
+
+
+def march_fetch(grid, transform, x, y, bearings=fetch.BEARINGS, max_distance=10000.0,
+                step=None, start=None, chunk_size=8192):
+
+    """
+    March rays from each point along each bearing and stop at the first land cell.
+
+    grid, transform: land grid and its north-up affine transform from open_grid
+    x, y: (N,) center point coordinates in the grid CRS
+    bearings: (D,) bearings in degrees clockwise from north, the 16 Step1 directions by default
+    max_distance: ray length, the Distance_Expression of Step1
+    step: sampling interval along the ray, half a cell by default
+    start: distance from the origin before land counts, one cell diagonal by default,
+        since the center points sit on the shoreline and their own cell is often land
+    chunk_size: number of points marched together
+    Returns an (N, D) float32 fetch matrix; 0 where the ray meets land straight away
+    (no water arc, as in the vector mode) and max_distance where it never meets land.
+    """
+
+    res = abs(transform.a)
+    step = res / 2.0 if step is None else step
+    start = res * np.sqrt(2.0) if start is None else start
+    height, width = grid.shape
+
+    theta = np.radians(np.asarray(bearings, dtype=np.float64))
+    dx, dy = np.sin(theta), np.cos(theta)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    first = max(int(np.ceil(start / step)), 1)
+    last = int(np.floor(max_distance / step))
+    chunk_size = rays.points_per_batch(chunk_size, len(theta))
+
+    out = np.full((len(x), len(theta)), max_distance, dtype=np.float32)
+    for lo in range(0, len(x), chunk_size):
+        ox = np.repeat(x[lo:lo + chunk_size], len(theta))
+        oy = np.repeat(y[lo:lo + chunk_size], len(theta))
+        rdx = np.tile(dx, len(ox) // len(theta))
+        rdy = np.tile(dy, len(ox) // len(theta))
+        fetched = out[lo:lo + chunk_size].reshape(-1)  # view into out
+
+        # only rays that have not met land yet are advanced
+        active = np.arange(len(ox))
+        for k in range(first, last + 1):
+            d = k * step
+            col = np.floor((ox[active] + d * rdx[active] - transform.c) / transform.a).astype(np.int64)
+            row = np.floor((oy[active] + d * rdy[active] - transform.f) / transform.e).astype(np.int64)
+            inside = (col >= 0) & (col < width) & (row >= 0) & (row < height)
+            land = ~inside
+            land[inside] = grid[row[inside], col[inside]]
+
+            hit = active[land]
+            fetched[hit] = 0.0 if k == first else d
+            active = active[~land]
+            if len(active) == 0:
+                break
+
+    return out
+
+
+def raster_fetch(center_points, grid_path, max_distance=10000.0, id_field='ID', bearings=fetch.BEARINGS,
+                 directions=fetch.DIRECTIONS, **kwargs):
+
+    """
+    Raster counterpart of fetch.select_water_arcs.
+
+    center_points: GeoDataFrame of the SplitLine_center_point layer from Step1
+    grid_path: grid written by rasterize_landwater
+    bearings, directions: the rays to march, e.g. from rays.angular_directions
+    Returns a GeoDataFrame with the ResultingWaterArcs schema (ID, direction, Shape_Length),
+    one straight arc per ID and direction that has water fetch.
+    """
+
+    grid, transform, _ = open_grid(grid_path)
+    x = center_points.geometry.x.values
+    y = center_points.geometry.y.values
+    matrix = march_fetch(grid, transform, x, y, bearings, max_distance=max_distance, **kwargs)
+    return fetch.fetch_arcs(center_points[id_field].values, x, y, matrix, center_points.crs, bearings, directions)
@@ -0,0 +1,138 @@
+# Early-terminating first-hit fetch.
+#
+# Step3 intersects every full-length ray with the whole land/water polygon and
+# throws away everything past the part touching the center point. Here the
+# water boundaries are broken into straight segments held in an STRtree, and
+# each ray only looks for the nearest shoreline crossing: the ray is tested in
+# growing pieces (250 m, 500 m, 1 km, ...) and stops as soon as it crosses a
+# segment, so the cost depends on how cluttered the nearby shoreline is rather
+# than on the ray length.
+
+import numpy as np
+import shapely
+
+from utils import fetch
+from utils import rays
+from utils.rays import BEARINGS, DIRECTIONS
+
+
+def boundary_segments(polygons):
+
+    """
+    Break the rings of the polygons into straight segments.
+    Returns an (S, 4) array of x0, y0, x1, y1.
+    """
+
+    rings = shapely.get_rings(np.asarray(polygons, dtype=object))
+    coords, ring = shapely.get_coordinates(rings, return_index=True)
+    same = ring[1:] == ring[:-1]
+    return np.hstack([coords[:-1][same], coords[1:][same]])
+
+
+class SegmentIndex:
+
+    """
+    STRtree over the water boundary segments of a land/water layer, plus the water
+    polygons themselves to tell whether a ray leaves its origin over water.
+    """
+
+    def __init__(self, landwater):
+        water = fetch.water_polygons(landwater)
+        self.segments = boundary_segments(water)
+        self.tree = shapely.STRtree(shapely.linestrings(self.segments.reshape(-1, 2, 2)))
+        self.water = shapely.STRtree(water)
+
+    def in_water(self, x, y):
+        inside = np.zeros(len(x), dtype=bool)
+        points, _ = self.water.query(shapely.points(x, y), predicate='intersects')
+        inside[points] = True
+        return inside
+
+    def first_crossing(self, ox, oy, ux, uy, near, far, tolerance):
+
+        """
+        Distance to the nearest segment crossed by each ray between `near` and `far`, or inf.
+        """
+
+        pieces = shapely.linestrings(np.stack([np.stack([ox + near * ux, oy + near * uy], axis=-1),
+                                               np.stack([ox + far * ux, oy + far * uy], axis=-1)], axis=1))
+        ray, seg = self.tree.query(pieces, predicate='intersects')
+
+        # ray o + t u against segment p0 + v s
+        p0x, p0y, p1x, p1y = self.segments[seg].T
+        sx, sy = p1x - p0x, p1y - p0y
+        wx, wy = p0x - ox[ray], p0y - oy[ray]
+        denom = ux[ray] * sy - uy[ray] * sx
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (wx * sy - wy * sx) / denom
+            v = (wx * uy[ray] - wy * ux[ray]) / denom
+        valid = (denom != 0) & (v >= 0) & (v <= 1) & (t > tolerance)
+
+        hits = np.full(len(ox), np.inf)
+        np.minimum.at(hits, ray[valid], t[valid])
+        return hits
+
+
+def first_hit_fetch(index, x, y, bearings=BEARINGS, max_distance=10000.0, first_step=250.0,
+                    tolerance=fetch.ORIGIN_TOLERANCE, chunk_size=20000):
+
+    """
+    Fetch along every bearing from every point, up to the first shoreline crossing.
+
+    index: SegmentIndex of the land/water layer
+    x, y: (N,) center point coordinates
+    max_distance: ray length, the Distance_Expression of Step1
+    first_step: length of the first piece of ray tested; each next piece doubles the reach
+    tolerance: crossings closer than this to the origin are the origin's own shoreline
+    Returns an (N, D) float32 fetch matrix, 0 where the ray leaves its origin over land.
+    """
+
+    theta = np.radians(np.asarray(bearings, dtype=np.float64))
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    out = np.zeros((len(x), len(theta)), dtype=np.float32)
+    chunk_size = rays.points_per_batch(chunk_size, len(theta))
+
+    for lo in range(0, len(x), chunk_size):
+        ox = np.repeat(x[lo:lo + chunk_size], len(theta))
+        oy = np.repeat(y[lo:lo + chunk_size], len(theta))
+        ux = np.tile(np.sin(theta), len(ox) // len(theta))
+        uy = np.tile(np.cos(theta), len(ox) // len(theta))
+
+        fetched = np.full(len(ox), max_distance, dtype=np.float64)
+        active = np.arange(len(ox))
+        near, far = 0.0, min(first_step, max_distance)
+        while len(active):
+            hits = index.first_crossing(ox[active], oy[active], ux[active], uy[active], near, far, tolerance)
+            found = np.isfinite(hits)
+            fetched[active[found]] = np.minimum(hits[found], max_distance)
+            active = active[~found]
+            if far >= max_distance:
+                break
+            near, far = far, min(far * 2.0, max_distance)
+
+        # nothing is crossed between the origin and the hit, so its midpoint tells water from land
+        wet = index.in_water(ox + 0.5 * fetched * ux, oy + 0.5 * fetched * uy)
+        out[lo:lo + chunk_size] = np.where(wet, fetched, 0.0).reshape(-1, len(theta))
+
+    return out
+
+
+def first_hit_water_arcs(center_points, landwater, max_distance=10000.0, id_field='ID', index=None,
+                         bearings=BEARINGS, directions=DIRECTIONS, **kwargs):
+
+    """
+    First-hit counterpart of fetch.select_water_arcs.
+
+    index: a SegmentIndex to reuse, built from `landwater` when not given
+    bearings, directions: the rays to cast, e.g. from rays.angular_directions
+    Returns a GeoDataFrame with the ResultingWaterArcs schema (ID, direction, Shape_Length).
+    """
+
+    if index is None:
+        index = SegmentIndex(landwater)
+    x = center_points.geometry.x.values
+    y = center_points.geometry.y.values
+    matrix = first_hit_fetch(index, x, y, bearings, max_distance=max_distance, **kwargs)
+    return fetch.fetch_arcs(center_points[id_field].values, x, y, matrix, center_points.crs,
+                            bearings, directions)
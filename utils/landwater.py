@@ -0,0 +1,168 @@
+# Automatic land/water labelling of the Step2 polygons.
+#
+# Step2 builds {name}_LandWaterPoly_{date} with FeatureToPolygon from the clipped
+# shoreline and the study area buffer, leaving the surface field for someone to
+# fill in by hand. Every edge two of those polygons share is a piece of
+# shoreline, with land on one side and water on the other, so in the graph of
+# polygons sharing an edge neighbours always have different surfaces: one label
+# decides a whole connected part (a flood fill that flips at every shoreline).
+# Which side is water comes from seeds: each polygon is tested against a
+# reference water mask (a labelled land/water layer, such as the regional one or
+# the last run's, or a distance index) and against points known to be in open
+# water. Each part takes the labelling most of its seeded area agrees with, so a
+# few wrong seeds are outvoted. Polygons where the shoreline does not alternate,
+# or that the reference disagrees with, are flagged in surface_qc for review.
+
+import numpy as np
+import shapely
+import geopandas as gpd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import breadth_first_order, connected_components
+
+from utils import fetch
+
+
+PARITY_CONFLICT = "shares shoreline with a polygon of the same surface"
+NO_SEED = "no reference for this part, label by hand"
+DISAGREES = "reference disagrees"
+
+
+def shared_edges(geoms, precision=0.001):
+
+    """
+    Pairs of polygons sharing at least one boundary segment (end points equal to `precision`).
+    Returns (u, v) arrays of polygon numbers, each pair once with u < v.
+    """
+
+    rings, poly = shapely.get_rings(np.asarray(geoms, dtype=object), return_index=True)
+    coords, ring = shapely.get_coordinates(rings, return_index=True)
+    same = ring[1:] == ring[:-1]
+    ends = np.round(np.hstack([coords[:-1][same], coords[1:][same]]) / precision).astype(np.int64)
+    swap = (ends[:, 0] > ends[:, 2]) | ((ends[:, 0] == ends[:, 2]) & (ends[:, 1] > ends[:, 3]))
+    ends[swap] = ends[swap][:, [2, 3, 0, 1]]
+    owner = poly[ring[:-1][same]]
+
+    o = np.lexsort((owner, ends[:, 3], ends[:, 2], ends[:, 1], ends[:, 0]))
+    ends, owner = ends[o], owner[o]
+    match = (ends[1:] == ends[:-1]).all(axis=1) & (owner[1:] != owner[:-1])
+    pairs = np.unique(np.sort(np.column_stack([owner[:-1][match], owner[1:][match]]), axis=1), axis=0)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def two_colouring(n, u, v):
+
+    """
+    Colour the polygons 0/1 so that neighbours differ, as far as possible.
+    A root joined to one polygon of every connected part gives one breadth-first tree; the
+    colour of a polygon is the parity of its depth, found by pointer jumping.
+    Returns (part, colour, conflict): the connected part and colour of every polygon, and
+    whether it has a neighbour of the same colour (the shoreline does not alternate there).
+    """
+
+    graph = coo_matrix((np.ones(len(u)), (u, v)), shape=(n, n))
+    parts, part = connected_components(graph, directed=False)
+    first = np.unique(part, return_index=True)[1]
+
+    rows = np.concatenate([u, np.full(len(first), n)])
+    cols = np.concatenate([v, first])
+    tree = coo_matrix((np.ones(len(rows)), (rows, cols)), shape=(n + 1, n + 1)).tocsr()
+    _, pred = breadth_first_order(tree, n, directed=False, return_predecessors=True)
+
+    parent = np.where(pred[:n] == n, np.arange(n), pred[:n])
+    colour = (pred[:n] != n).astype(np.int64)
+    while True:
+        up = parent[parent]
+        if np.array_equal(up, parent):
+            break
+        colour = colour ^ colour[parent]
+        parent = up
+
+    clash = colour[u] == colour[v]
+    conflict = np.zeros(n, dtype=bool)
+    conflict[u[clash]] = True
+    conflict[v[clash]] = True
+    return part, colour, conflict
+
+
+def reference_votes(points, reference, surface_field='surface', water_value='water'):
+
+    """
+    Whether each point is in water according to the reference: 1 water, 0 land, NaN unknown.
+
+    reference: a labelled land/water GeoDataFrame (points outside it are unknown), a
+        GeoDataFrame of water polygons without a surface field (points outside are land),
+        or a distance_field.DistanceIndex (points outside its tiles are unknown)
+    """
+
+    votes = np.full(len(points), np.nan)
+    if hasattr(reference, 'cells'):
+        cells = reference.cells(shapely.get_x(points), shapely.get_y(points))
+        known = reference.covers(shapely.get_x(points), shapely.get_y(points))
+        votes[known] = cells[known] > 0
+        return votes
+
+    if surface_field not in reference.columns:
+        votes[:] = 0.0
+        water = np.asarray(reference.geometry.values, dtype=object)
+    else:
+        inside = shapely.STRtree(np.asarray(reference.geometry.values, dtype=object)).query(points, predicate='within')[0]
+        votes[inside] = 0.0
+        water = fetch.water_polygons(reference, surface_field, water_value)
+    votes[shapely.STRtree(water).query(points, predicate='within')[0]] = 1.0
+    return votes
+
+
+def label_surfaces(landwater, reference=None, water_points=None, surface_field='surface',
+                   water_value='water', land_value='land'):
+
+    """
+    Fill in the surface field of the Step2 land/water polygons.
+
+    landwater: GeoDataFrame of the {name}_LandWaterPoly_{date} layer (surface may be empty)
+    reference: water mask to seed the labelling, see reference_votes
+    water_points: shapely points (or a GeoDataFrame) known to be in water; they outweigh the reference
+    Returns a copy with surface filled in and a surface_qc field: None, or why the polygon
+    needs a look (PARITY_CONFLICT, NO_SEED, DISAGREES). Polygons of parts without any
+    seed are left without a surface.
+    """
+
+    if reference is None and water_points is None:
+        raise ValueError("label_surfaces needs a reference layer or index, or water points")
+
+    geoms = np.asarray(landwater.geometry.values, dtype=object)
+    n = len(geoms)
+    u, v = shared_edges(geoms)
+    part, colour, conflict = two_colouring(n, u, v)
+
+    # every seeded polygon votes, weighted by its area, for colour 1 or colour 0 being water
+    area = shapely.area(geoms)
+    votes = np.full(n, np.nan)
+    weight = area.copy()
+    if reference is not None:
+        votes = reference_votes(shapely.point_on_surface(geoms), reference, surface_field, water_value)
+    if water_points is not None:
+        if isinstance(water_points, gpd.GeoDataFrame):
+            water_points = water_points.to_crs(landwater.crs).geometry.values
+        hit = shapely.STRtree(geoms).query(np.asarray(water_points, dtype=object), predicate='within')[1]
+        votes[hit] = 1.0
+        weight[hit] = area.sum()
+
+    seeded = ~np.isnan(votes)
+    agree = np.where(votes[seeded] == colour[seeded], 1.0, -1.0) * weight[seeded]
+    score = np.bincount(part[seeded], weights=agree, minlength=part.max() + 1)
+    has_seed = np.bincount(part[seeded], minlength=part.max() + 1) > 0
+
+    # colour 1 is water in parts whose votes agree with the colouring, colour 0 otherwise
+    wet = np.where(score[part] >= 0, colour == 1, colour == 0)
+    surface = np.where(wet, water_value, land_value).astype(object)
+    surface[~has_seed[part]] = None
+
+    qc = np.full(n, None, dtype=object)
+    qc[seeded & (votes != wet)] = DISAGREES
+    qc[~has_seed[part]] = NO_SEED
+    qc[conflict] = PARITY_CONFLICT
+
+    out = landwater.copy()
+    out[surface_field] = surface
+    out['surface_qc'] = qc
+    return out
@@ -0,0 +1,254 @@
+# Marsh classification from the topobathy DEM and the NAIP/Sentinel marsh prediction.
+#
+# The scripts used to reclassify the whole resampled DEM with three np.where
+# passes, write *_dem_reclassed.tif, read it back, build a second full-size
+# mask from the prediction and multiply. Here one block-wise kernel takes a DEM
+# block and the matching prediction block and writes the final marsh class into
+# an output buffer: 1 = high marsh (above MHW), 2 = low marsh (MLW to MHW),
+# -1 = marsh below MLW or without DEM, 0 = not marsh in the prediction.
+# The outputs are int8 without a nodata value. The scripts wrote the same class
+# values into a raster of the DEM's dtype and nodata (e.g. float32, -9999), a
+# nodata value no class ever took, so only the dtype and metadata differ.
+
+import os
+import time
+import hashlib
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import rasterio
+import geopandas as gpd
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+
+from utils import utils
+from utils import datums
+from utils import telemetry
+
+
+# Tidal datums (m, NAVD88) used for Poquoson
+MLW = -0.432
+MHW = 0.259
+
+HIGH_MARSH = 1
+LOW_MARSH = 2
+BELOW_MLW = -1
+NOT_MARSH = 0
+
+
+def reclassify_block(dem, mlw, mhw, out):
+
+    """
+    Write the DEM class of each pixel into `out` (int8): 1 above mhw, 2 between mlw and mhw,
+    -1 otherwise (below mlw, nodata, NaN). mlw/mhw are scalars or arrays shaped like dem.
+    """
+
+    out.fill(BELOW_MLW)
+    np.putmask(out, dem >= mlw, LOW_MARSH)
+    np.putmask(out, dem > mhw, HIGH_MARSH)
+    return out
+
+
+def classify_block(dem, prediction, mlw, mhw, out, reclass=None):
+
+    """
+    Fused reclassify-and-mask kernel: the marsh class of one block, written into `out`.
+    Pixels the prediction does not mark as marsh (1 or 2) are 0. If `reclass` is given,
+    the unmasked DEM class is copied there for debugging.
+    """
+
+    reclassify_block(dem, mlw, mhw, out)
+    if reclass is not None:
+        reclass[...] = out
+    np.putmask(out, (prediction != 1) & (prediction != 2), NOT_MARSH)
+    return out
+
+
+def classify_marsh(dem_path, prediction_path, out_path, mlw=MLW, mhw=MHW, method=Resampling.bilinear,
+                   reclass_path=None, blocksize=1024, cache_dir=None):
+
+    """
+    dem_path: DEM cropped to the study area (utils.crop_boundary_to_file)
+    prediction_path: NAIP/Sentinel marsh prediction; its grid is the output grid
+    out_path: output marsh class GeoTIFF (int8, no nodata value: every pixel has a class)
+    mlw, mhw: tidal datums, scalars or callables (window, transform) -> arrays for the block
+    method: resampling of the DEM onto the prediction grid
+    reclass_path: if given, also write the unmasked DEM classes (the old *_dem_reclassed.tif)
+    cache_dir: if given, the DEM resampled onto the prediction grid is kept there
+        (utils.cached_warp_to_grid) and reused by later runs against the same grid
+    The DEM is warped onto the prediction grid block by block, so neither raster is
+    ever read whole and no intermediate raster is written unless asked for.
+    """
+
+    aligned = cache_dir is not None
+    if aligned:
+        dem_path = utils.cached_warp_to_grid(dem_path, prediction_path, cache_dir, method)
+
+    # written under temporary names, so a failed run leaves neither a partial output nor open handles
+    parts = [(path + ".part.tif", path) for path in (out_path, reclass_path) if path]
+    try:
+        with contextlib.ExitStack() as stack:
+            pred = stack.enter_context(rasterio.open(prediction_path))
+            dem = stack.enter_context(rasterio.open(dem_path))
+            if not aligned:
+                dem = stack.enter_context(WarpedVRT(dem, crs=pred.crs, transform=pred.transform,
+                                                    width=pred.width, height=pred.height, resampling=method,
+                                                    **utils.warp_scale(dem, pred)))
+
+            meta = pred.meta.copy()
+            meta.update({"driver": "GTiff", "count": 1, "dtype": "int8", "nodata": None,
+                         "tiled": True, "blockxsize": 256, "blockysize": 256, "compress": "deflate"})
+
+            dest = stack.enter_context(rasterio.open(parts[0][0], "w", **meta))
+            debug = stack.enter_context(rasterio.open(parts[1][0], "w", **meta)) if reclass_path else None
+
+            out = np.empty((blocksize, blocksize), dtype=np.int8)
+            reclass = np.empty((blocksize, blocksize), dtype=np.int8) if debug else None
+            for window in utils.block_windows(pred.width, pred.height, blocksize):
+                h, w = window.height, window.width
+                dem_block = dem.read(1, window=window)
+                pred_block = pred.read(1, window=window)
+                transform = pred.window_transform(window)
+                low = mlw(window, transform) if callable(mlw) else mlw
+                high = mhw(window, transform) if callable(mhw) else mhw
+
+                classify_block(dem_block, pred_block, low, high, out[:h, :w],
+                               reclass[:h, :w] if debug else None)
+                dest.write(out[:h, :w], 1, window=window)
+                if debug:
+                    debug.write(reclass[:h, :w], 1, window=window)
+    except BaseException:
+        for part, _ in parts:
+            if os.path.exists(part):
+                os.remove(part)
+        raise
+    for part, path in parts:
+        os.replace(part, path)
+
+    return meta
+
+
+def overview_level(dem_path, resolution):
+
+    """
+    Index of the coarsest DEM overview that is still at least as fine as `resolution`,
+    or None for the full resolution DEM.
+    """
+
+    with rasterio.open(dem_path) as src:
+        factors = src.overviews(1)
+        base = src.res[0]
+    usable = [i for i, f in enumerate(factors) if base * f <= resolution]
+    return usable[-1] if usable else None
+
+
+# Per-worker DEM handles by overview level, opened once and reused for every study area
+_dem = {}
+
+
+def _init_worker(dem_path):
+    _dem.clear()
+    _dem['path'] = dem_path
+
+
+def _dem_handle(level):
+    if level not in _dem:
+        _dem[level] = rasterio.open(_dem['path'], overview_level=level) if level is not None \
+            else rasterio.open(_dem['path'])
+    return _dem[level]
+
+
+def _crop_area(dem, boundary, area_dem):
+
+    """
+    Crop the open DEM to the study area boundary, unless area_dem already holds that crop.
+    The inputs of the crop (DEM file and grid, boundary) are kept in area_dem + ".key";
+    returns whether the crop was written.
+    """
+
+    stat = os.stat(dem.name)
+    shapes = hashlib.sha1(b"".join(g.wkb for g in boundary)).hexdigest()
+    key = repr((os.path.abspath(dem.name), stat.st_size, stat.st_mtime_ns, tuple(dem.transform), dem.shape, shapes))
+    if os.path.exists(area_dem) and os.path.exists(area_dem + ".key"):
+        with open(area_dem + ".key") as f:
+            if f.read() == key:
+                return False
+        # an interrupted crop must not look finished to the next run
+        os.remove(area_dem + ".key")
+
+    utils.crop_boundary_to_file(dem, boundary, area_dem)
+    with open(area_dem + ".key", "w") as f:
+        f.write(key)
+    return True
+
+
+def _classify_area(area, out_dir, mlw, mhw, cache_dir, stations=None):
+
+    """
+    Worker body: crop the shared DEM to one study area and classify it against its prediction.
+    """
+
+    start = time.time()
+    with rasterio.open(area['prediction']) as pred:
+        pixels = pred.width * pred.height
+        resolution = pred.res[0]
+
+    dem = _dem_handle(overview_level(_dem['path'], resolution))
+    boundary = gpd.read_file(area['boundary']).to_crs(dem.crs)
+
+    area_dem = os.path.join(out_dir, area['name'] + '_dem.tif')
+    area_out = os.path.join(out_dir, area['name'] + '_combined.tif')
+    # an unchanged crop is kept, so the resampled DEM of the last run is found in the cache
+    with telemetry.Stage("marsh.crop", area=area['name']) as stage:
+        stage.fields['cropped'] = _crop_area(dem, list(boundary.geometry), area_dem)
+    if stations is not None:
+        with telemetry.Stage("marsh.datums", items=pixels, unit='pixels', area=area['name']):
+            mlw, mhw = datums.datum_surfaces(stations, area['prediction'], cache_dir=cache_dir)
+    with telemetry.Stage("marsh.classify", items=pixels, unit='pixels', area=area['name']):
+        classify_marsh(area_dem, area['prediction'], area_out, mlw, mhw,
+                       cache_dir=os.path.join(cache_dir, area['name']) if cache_dir else None)
+
+    return {'name': area['name'], 'output': area_out, 'pixels': pixels, 'seconds': time.time() - start}
+
+
+def classify_areas(areas, dem_path, out_dir, workers=None, mlw=MLW, mhw=MHW, cache_dir=None, stations=None):
+
+    """
+    Batch marsh classification of many study areas in a process pool.
+
+    areas: list of dicts with name, boundary (vector file) and prediction (NAIP/Sentinel raster)
+    dem_path: the regional DEM, e.g. the 1 m Chesapeake Bay Topobathy DEM
+    out_dir: receives {name}_dem.tif and {name}_combined.tif for every area
+    workers: number of processes, all cores by default
+    stations: if given, the tide station table (data/stations.csv); each area is then classified
+        against MLW/MHW surfaces interpolated from it (datums.datum_surfaces) instead of mlw/mhw
+    Every worker opens the DEM once, at the overview level that matches each prediction's
+    resolution, and reuses the handles for all the areas it processes. Progress and
+    throughput are printed as areas finish. Returns the per-area summaries.
+    """
+
+    os.makedirs(out_dir, exist_ok=True)
+    workers = workers or os.cpu_count()
+    start = time.time()
+    results = []
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(dem_path,)) as pool:
+        futures = {pool.submit(_classify_area, area, out_dir, mlw, mhw, cache_dir, stations): area['name'] for area in areas}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'name': futures[future], 'error': repr(e)}
+                print("[" + str(len(results) + 1) + "/" + str(len(areas)) + "] " + result['name'] + " failed: " + result['error'])
+            else:
+                print("[" + str(len(results) + 1) + "/" + str(len(areas)) + "] " + result['name'] + ": "
+                      + "%.1f Mpx in %.1f s (%.2f Mpx/s)" % (result['pixels'] / 1e6, result['seconds'],
+                                                             result['pixels'] / 1e6 / max(result['seconds'], 1e-9)))
+            results.append(result)
+
+    done = [r for r in results if 'error' not in r]
+    elapsed = time.time() - start
+    print("%d of %d areas classified in %.1f s (%.2f Mpx/s overall)"
+          % (len(done), len(areas), elapsed, sum(r['pixels'] for r in done) / 1e6 / max(elapsed, 1e-9)))
+    return results
@@ -0,0 +1,333 @@
+# Content-addressed orchestrator for fetch Steps 1-5.
+#
+# The steps are tasks of a graph. Each task's key is a hash of its own
+# parameters (spacing, ray length, thresholds, ...) and of the keys of the
+# tasks it reads from; the inputs (shoreline, land/water polygons) are keyed
+# by a hash of their content. Outputs go to a cache store (utils/store.py)
+# under the task's key, followed by a marker written once the task is
+# complete, so a task whose key already has a marker is skipped and its outputs
+# reused. Tasks whose inputs are ready run in parallel in a process pool, and
+# Step3 is split into chunks of center points that are tasks of their own, so
+# a run that crashed partway through Step3 resumes with the missing chunks.
+
+import os
+import json
+import time
+import hashlib
+import datetime
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from utils import fetch
+from utils import distance_field
+from utils import fetch_raster
+from utils import first_hit
+from utils import quadrant
+from utils import rays
+from utils import shoreline
+from utils import store
+from utils import telemetry
+from utils import topology
+from utils.fetch_cache import geometry_hashes
+
+
+class Task:
+
+    """
+    A node of the pipeline graph: func(ctx) reads its inputs and writes its outputs through
+    a TaskContext. key is given for source tasks (content hash) and derived for the others.
+    version: bump when func changes in a way that changes its outputs; the keys of the tasks
+        reading from it change with it, the other cached tasks stay valid
+    """
+
+    def __init__(self, name, func, inputs=(), params=None, key=None, version=1):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.params = dict(params or {})
+        self.key = key
+        self.version = version
+
+
+class TaskContext:
+
+    """
+    What a running task sees: its parameters, and the cache layers of its own outputs
+    and of the outputs of the tasks it depends on.
+    """
+
+    def __init__(self, cache_dir, prefix, inputs, params):
+        self.cache_dir = cache_dir
+        self.prefix = prefix
+        self.inputs = inputs
+        self.params = params
+
+    def layer(self, output):
+        return self.prefix + "_" + output
+
+    def path(self, filename, task=None):
+        return os.path.join(self.cache_dir, (self.inputs[task] if task else self.prefix) + "_" + filename)
+
+    def read(self, task, output, **kwargs):
+        return store.read_layer(self.cache_dir, self.inputs[task] + "_" + output, **kwargs)
+
+    def write(self, output, frame):
+        store.write_layer(frame, self.cache_dir, self.layer(output))
+
+
+def layer_hash(frame):
+
+    """
+    Hash of the content of a layer: attributes, normalized geometries and CRS.
+    """
+
+    h = hashlib.sha1()
+    attributes = frame.drop(columns=frame.geometry.name)
+    if len(attributes.columns):
+        h.update(pd.util.hash_pandas_object(attributes, index=False).values.tobytes())
+    h.update("".join(geometry_hashes(frame.geometry.values)).encode("utf-8"))
+    h.update(str(frame.crs.to_wkt() if frame.crs else None).encode("utf-8"))
+    return h.hexdigest()
+
+
+def task_key(task, input_keys):
+    text = json.dumps({'task': task.func.__name__, 'version': task.version, 'params': task.params,
+                       'inputs': input_keys}, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def marker_path(cache_dir, prefix):
+    return os.path.join(cache_dir, prefix + ".done.json")
+
+
+def _execute(func, ctx):
+    start = time.perf_counter()
+    with telemetry.Stage("pipeline." + ctx.prefix.rsplit("_", 1)[0], key=ctx.prefix.rsplit("_", 1)[1]):
+        func(ctx)
+    seconds = round(time.perf_counter() - start, 4)
+    with open(marker_path(ctx.cache_dir, ctx.prefix) + ".part", "w") as f:
+        json.dump({'task': func.__name__, 'params': ctx.params, 'seconds': seconds}, f, default=str)
+    os.replace(marker_path(ctx.cache_dir, ctx.prefix) + ".part", marker_path(ctx.cache_dir, ctx.prefix))
+    return seconds
+
+
+def run_graph(tasks, cache_dir, workers=None, log=print):
+
+    """
+    Run the tasks (listed after the tasks they depend on), skipping those whose outputs are cached.
+    Returns {task name: cache layer prefix of its outputs}.
+    """
+
+    keys = {}
+    for task in tasks:
+        keys[task.name] = task.key or task_key(task, [keys[name] for name in task.inputs])
+    prefixes = {name: name + "_" + key[:16] for name, key in keys.items()}
+
+    os.makedirs(cache_dir, exist_ok=True)
+    done = set()
+    for task in tasks:
+        if os.path.exists(marker_path(cache_dir, prefixes[task.name])):
+            done.add(task.name)
+            log(task.name + ": cached")
+    pending = [task for task in tasks if task.name not in done]
+
+    running = {}
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        while pending or running:
+            for task in [task for task in pending if all(name in done for name in task.inputs)]:
+                ctx = TaskContext(cache_dir, prefixes[task.name], {name: prefixes[name] for name in task.inputs},
+                                  task.params)
+                running[pool.submit(_execute, task.func, ctx)] = task.name
+                pending.remove(task)
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                seconds = future.result()
+                done.add(name)
+                log(name + ": done in %.1f s" % seconds)
+
+    return prefixes
+
+
+# Tasks of the fetch pipeline
+
+def _source(ctx):
+    ctx.write('layer', store.read_layer(ctx.params['workspace'], ctx.params['layer']))
+
+
+def _step1(ctx):
+    shore = ctx.read('shoreline', 'layer', columns=[])
+    ids, segments, midpoints, bearings = shoreline.split_shoreline(shore.geometry.values, ctx.params['spacing'])
+    telemetry.count(len(ids))
+    ctx.write('split', gpd.GeoDataFrame({'splitID': ids, 'ID': ids, 'bearing': bearings},
+                                        geometry=segments, crs=shore.crs))
+    centers = gpd.GeoDataFrame({'splitID': ids, 'ID': ids}, geometry=midpoints, crs=shore.crs)
+    centers['POINT_X'] = centers.geometry.x
+    centers['POINT_Y'] = centers.geometry.y
+    ctx.write('centers', centers)
+
+
+def _grid(ctx):
+    landwater = ctx.read('landwater', 'layer', columns=['surface'])
+    fetch_raster.rasterize_landwater(landwater, ctx.path('grid.npy'), ctx.params['resolution'])
+
+
+def _distance_index(ctx):
+    landwater = ctx.read('landwater', 'layer', columns=['surface'])
+    distance_field.build_index(landwater, ctx.path('distance_index'), ctx.params['resolution'], log=lambda m: None)
+
+
+def _step3_chunk(ctx):
+    ids = np.sort(ctx.read('step1', 'centers', columns=['ID'], ignore_geometry=True)['ID'].values)
+    part = np.array_split(ids, ctx.params['chunks'])[ctx.params['chunk']]
+    landwater = ctx.read('landwater', 'layer', columns=['surface'])
+    if len(part) == 0:
+        ctx.write('arcs', gpd.GeoDataFrame({'ID': np.array([], dtype=np.int64), 'direction': np.array([], dtype=object),
+                                            'Shape_Length': np.array([])}, geometry=[], crs=landwater.crs))
+        return
+
+    centers = ctx.read('step1', 'centers', columns=['ID'], id_range=(part[0], part[-1]))
+    telemetry.count(len(centers))
+    mode, distance = ctx.params['mode'], ctx.params['distance']
+    directions, bearings = rays.angular_directions(ctx.params['angle_step'])
+    if mode == 'raster':
+        arcs = fetch_raster.raster_fetch(centers, ctx.path('grid.npy', 'grid'), distance, bearings=bearings,
+                                         directions=directions)
+    elif mode == 'distance':
+        index = ctx.params.get('index_dir') or ctx.path('distance_index', 'index')
+        arcs = distance_field.distance_water_arcs(centers, index, distance, bearings=bearings, directions=directions)
+    elif mode == 'firsthit':
+        arcs = first_hit.first_hit_water_arcs(centers, landwater, distance, bearings=bearings, directions=directions)
+    else:
+        arcs = fetch.point_water_arcs(centers, landwater, distance, bearings=bearings, directions=directions)
+    ctx.write('arcs', arcs)
+
+
+def _step3(ctx):
+    frames = [ctx.read(name, 'arcs') for name in sorted(ctx.inputs) if name.startswith('step3_')]
+    merged = pd.concat(frames, ignore_index=True).sort_values('ID', kind='stable').reset_index(drop=True)
+    ctx.write('arcs', gpd.GeoDataFrame(merged, geometry='geometry', crs=frames[0].crs))
+
+
+def _matrix(ctx):
+    water_arcs = ctx.read('step3', 'arcs', columns=['ID', 'direction', 'Shape_Length'], ignore_geometry=True)
+    centers = ctx.read('step1', 'centers', columns=['ID'], ignore_geometry=True)
+    directions, _ = rays.angular_directions(ctx.params['angle_step'])
+    ids, matrix = fetch.fetch_matrix(water_arcs, np.unique(centers['ID'].values), directions)
+    _, longest = fetch.fetch_matrix(water_arcs, ids, directions, reduce='max')
+    telemetry.count(len(water_arcs))
+    store.write_matrix(ctx.cache_dir, ctx.layer('matrix'), ids, matrix, directions)
+    store.write_matrix(ctx.cache_dir, ctx.layer('longest'), ids, longest, directions)
+
+
+def _step4(ctx):
+    # the analysis starts from the stored fetch matrix, so new thresholds or fields do not pivot the arcs again
+    ids, matrix, directions = store.read_matrix(ctx.cache_dir, ctx.inputs['matrix'] + '_matrix')
+    _, longest, _ = store.read_matrix(ctx.cache_dir, ctx.inputs['matrix'] + '_longest')
+    centers = ctx.read('step1', 'centers')
+    split = ctx.read('step1', 'split')
+    telemetry.count(len(ids))
+
+    analysis = quadrant.fetch_analysis(ids, matrix, directions, thresholds=tuple(ctx.params['thresholds']),
+                                       longest=longest)
+    ctx.write('points', centers.merge(analysis, on='ID', how='left'))
+    ctx.write('arcs', split.merge(analysis, on='ID', how='left'))
+
+
+def _step5(ctx):
+    arcs = ctx.read('step4', 'arcs')
+    telemetry.count(len(arcs))
+    ctx.write('checked', topology.check_small_segments(arcs, max_length=ctx.params['small_length']))
+
+
+def _step5_smooth(ctx):
+    arcs = ctx.read('step4', 'arcs')
+    telemetry.count(len(arcs))
+    ctx.write('smoothed', topology.smooth_codes(arcs, min_length=ctx.params['smooth_length']))
+
+
+def fetch_tasks(workspace, shoreline_layer, landwater_layer, spacing=25.0, distance=10000.0, mode='vector',
+                resolution=5.0, chunks=16, thresholds=(quadrant.LOW_FETCH, quadrant.HIGH_FETCH),
+                small_length=topology.SMALL_LENGTH, smooth_length=None, angle_step=rays.COMPASS_STEP,
+                index_dir=None):
+
+    """
+    The graph of Steps 1-5: shoreline and landwater sources, step1 (split and center points),
+    grid (raster mode only) or index (distance mode without index_dir), step3_0..step3_<chunks-1> and their merge step3,
+    matrix (the fetch matrices of Step4), step4, step5
+    and, when smooth_length is given, step5_smooth next to step5.
+    angle_step: degrees between the fetch rays (rays.angular_directions)
+    index_dir: distance index shared between runs for the "distance" mode (distance_field);
+        without it an index task builds one from the land/water layer in the cache. ValueError
+        if there is no index in index_dir (build it with BuildDistanceIndex.py)
+    """
+
+    sources = {}
+    for name, layer in (('shoreline', shoreline_layer), ('landwater', landwater_layer)):
+        sources[name] = Task(name, _source, params={'workspace': workspace, 'layer': layer},
+                             key=layer_hash(store.read_layer(workspace, layer)))
+
+    tasks = [sources['shoreline'], sources['landwater'],
+             Task('step1', _step1, ['shoreline'], {'spacing': spacing})]
+    chunk_inputs = ['step1', 'landwater']
+    if mode == 'raster':
+        tasks.append(Task('grid', _grid, ['landwater'], {'resolution': resolution}))
+        chunk_inputs.append('grid')
+    chunk_params = {'mode': mode, 'distance': distance, 'angle_step': angle_step}
+    if mode == 'distance' and index_dir is None:
+        tasks.append(Task('index', _distance_index, ['landwater'], {'resolution': resolution}))
+        chunk_inputs.append('index')
+    elif mode == 'distance':
+        # checked here rather than failing on a missing file in every Step3 worker
+        index = distance_field.open_index(index_dir)
+        chunk_params.update(index_dir=index_dir, index_key=index.key())
+
+    chunk_names = ['step3_' + str(i) for i in range(chunks)]
+    for i, name in enumerate(chunk_names):
+        tasks.append(Task(name, _step3_chunk, chunk_inputs, dict(chunk_params, chunk=i, chunks=chunks)))
+    tasks.append(Task('step3', _step3, chunk_names))
+    tasks.append(Task('matrix', _matrix, ['step3', 'step1'], {'angle_step': angle_step}))
+    # version 2: effective fetch fields; 3: MAX_Shape_Length of the longest single arc
+    tasks.append(Task('step4', _step4, ['matrix', 'step1'], {'thresholds': list(thresholds)}, version=3))
+    tasks.append(Task('step5', _step5, ['step4'], {'small_length': small_length}))
+    if smooth_length is not None:
+        tasks.append(Task('step5_smooth', _step5_smooth, ['step4'], {'smooth_length': smooth_length}))
+    return tasks
+
+
+def run_fetch_pipeline(workspace, shoreline_layer, landwater_layer, name, cache_dir, out_workspace=None,
+                       workers=None, log=print, **kwargs):
+
+    """
+    Run Steps 1-5 through the cache and export the results.
+
+    workspace: FileGDB, GeoPackage or store holding the shoreline and the labelled land/water polygons
+    cache_dir: folder of the cache; outputs live in its fetch.store
+    out_workspace: if given, the outputs are written there under the usual dated Step names
+    kwargs: spacing, distance, mode, resolution, chunks, thresholds, small_length, smooth_length, angle_step,
+        index_dir
+    Returns {task name: cache layer prefix}.
+    """
+
+    cache = os.path.join(cache_dir, "fetch" + store.STORE_SUFFIX)
+    with telemetry.Stage("pipeline", study_area=name):
+        prefixes = run_graph(fetch_tasks(workspace, shoreline_layer, landwater_layer, **kwargs), cache, workers, log)
+
+    if out_workspace is not None:
+        date = datetime.date.today().strftime("%m_%d_%Y")
+        outputs = {'SplitLineAtPoint_' + name: ('step1', 'split'),
+                   'SplitLine_center_point_' + name + '_' + date: ('step1', 'centers'),
+                   name + '_water_arcs_all_' + datetime.date.today().strftime("%m%d%Y"): ('step3', 'arcs'),
+                   name + '_fetch_withQuadAnalysis_points_' + date + '_Final': ('step4', 'points'),
+                   name + '_fetch_withQuadAnalysis_arcs_' + date + '_Final': ('step4', 'arcs'),
+                   name + '_fetch_smallArcsToCheck' + date: ('step5', 'checked')}
+        if 'step5_smooth' in prefixes:
+            outputs[name + '_fetch_smoothed' + date] = ('step5_smooth', 'smoothed')
+        for layer, (task, output) in outputs.items():
+            store.write_layer(store.read_layer(cache, prefixes[task] + '_' + output), out_workspace, layer)
+            log("wrote " + layer)
+
+    return prefixes
@@ -0,0 +1,234 @@
+# Columnar quadrant analysis for Step4.
+#
+# The quadrant section of Step4 makes about 60 passes over the exposure points
+# (AddField, SelectLayerByAttribute, CalculateField and a per-row maxnum code
+# block). Here the same fields are computed from an (N, 16) float32 fetch matrix
+# with a handful of vectorized NumPy operations. The order in which Step4 applies
+# its selections is kept, so ties resolve the same way and the results match the
+# fields of {name}_fetch_withQuadAnalysis_points_{date}_Final.
+#
+# The quadrants are sectors of bearings: NE takes every direction from 0 to 90
+# degrees inclusive, and so on (sector_quadrants). With the 16 Step1 directions
+# that is exactly Step4's five directions per quadrant; with rays every 10 or 5
+# degrees the same sectors take 10 or 19 directions, and the counts and sums of
+# all sectors stay one (N, D) x (D, S) product, linear in D.
+#
+# The effective fetch of the SPM/CERC method (Saville) is added for wave-energy
+# work: for a principal direction, the fetch of every ray within 45 degrees of
+# it weighted by cos^2 of the angle between them, divided by the sum of the
+# cosines. It is one more (N, D) x (D, P) product over the same matrix.
+
+import numpy as np
+import pandas as pd
+
+from utils.rays import DIRECTIONS, direction_bearings
+
+
+# Directions in each quadrant, as in the Step4 NE/SE/SW/NW_Count expressions
+QUADRANTS = {'NE': ['n', 'nne', 'ne', 'ene', 'e'],
+             'SE': ['e', 'ese', 'se', 'sse', 's'],
+             'SW': ['s', 'ssw', 'sw', 'wsw', 'w'],
+             'NW': ['n', 'w', 'wnw', 'nw', 'nnw']}
+
+# Exposure thresholds in meters (0.5 and 2 miles)
+LOW_FETCH = 804.67
+HIGH_FETCH = 3218.69
+
+# Center bearing of each quadrant sector; the sectors are SECTOR_WIDTH degrees wide
+SECTORS = {'NE': 45.0, 'SE': 135.0, 'SW': 225.0, 'NW': 315.0}
+SECTOR_WIDTH = 90.0
+
+SECOND_HIGHEST = "Use second highest quad fetch"
+
+# Rays within this many degrees of a principal direction count in its effective fetch
+EFFECTIVE_HALF_ANGLE = 45.0
+
+
+def sector_quadrants(directions, sectors=SECTORS, width=SECTOR_WIDTH):
+
+    """
+    Directions in each sector: those whose bearing is within width / 2 of the sector
+    center, ends included. For the 16 compass directions this gives QUADRANTS.
+
+    directions: direction names (rays.angular_directions)
+    sectors: {name: center bearing in degrees}
+    Returns {name: [direction, ...]} in the layout of QUADRANTS.
+    """
+
+    bearings = direction_bearings(directions)
+    out = {}
+    for name, center in sectors.items():
+        offset = np.abs((bearings - center + 180.0) % 360.0 - 180.0)
+        out[name] = [d for d, o in zip(directions, offset) if o <= width / 2.0 + 1e-9]
+    return out
+
+
+def _ordered(names, preferred):
+
+    """
+    Sector names in Step4's order of assignment, then any other sectors in their own order.
+    """
+
+    return [q for q in preferred if q in names] + [q for q in names if q not in preferred]
+
+
+def exposure_class(max_length, thresholds=(LOW_FETCH, HIGH_FETCH)):
+
+    """
+    Single-arc exposure of Step4's update cursor on MAX_Shape_Length (NaN = no water arc).
+    """
+
+    low, high = thresholds
+    return np.select([np.isnan(max_length), max_length <= low, max_length <= high],
+                     ["point misplacement", "low", "moderate"], "high").astype(object)
+
+
+def quad_exposure_code(fetch, thresholds=(LOW_FETCH, HIGH_FETCH)):
+
+    """
+    MxQExpCode classes of MaxQFetch: low below 804.67, high from 3218.69, moderate between.
+    """
+
+    low, high = thresholds
+    return np.select([fetch < low, fetch < high], ["low", "moderate"], "high").astype(object)
+
+
+def max_quad_dir(means, max_fetch, names):
+
+    """
+    MaxQuadDir: the quadrant whose mean equals MaxQFetch to 4 decimals. Step4 assigns NE, SW,
+    SE then NW, each overwriting the last, so on ties the later quadrant wins.
+    """
+
+    out = np.full(len(max_fetch), None, dtype=object)
+    rounded = np.round(max_fetch, 4)
+    for q in _ordered(names, ['NE', 'SW', 'SE', 'NW']):
+        out[np.round(means[:, names.index(q)], 4) == rounded] = q
+    return out
+
+
+def quadrant_analysis(matrix, directions=DIRECTIONS, quadrants=None, thresholds=(LOW_FETCH, HIGH_FETCH)):
+
+    """
+    Step4 quadrant fields from a per-direction fetch matrix.
+
+    matrix: (N, D) fetch lengths (fetch.fetch_matrix), 0 where a direction has no water arc
+    directions: the D direction names of the matrix columns, at any angular step
+    quadrants: {name: [direction, ...]}, by default the SECTORS of the directions' bearings
+    thresholds: low and high exposure limits in meters
+    Returns a dict of (N,) arrays keyed by the Step4 field names: NE/NW/SE/SW_Count,
+    NE/NW/SE/SW_Mean, MaxQFetch, MxQExpCode, MaxQuadDir, QuadCnt1, OneIsMax,
+    MxQFetchOld, MxQExpCodeO and MaxQDirO.
+    """
+
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if quadrants is None:
+        quadrants = QUADRANTS if list(directions) == DIRECTIONS else sector_quadrants(directions)
+    names = list(quadrants)
+    members = np.zeros((len(directions), len(names)), dtype=np.float64)
+    for j, q in enumerate(names):
+        members[[directions.index(d) for d in quadrants[q]], j] = 1.0
+
+    # counts and sums of all quadrants in two matrix products
+    counts = (matrix > 0).astype(np.float64) @ members
+    sums = matrix.astype(np.float64) @ members
+    means = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+
+    max_fetch = means.max(axis=1)
+    direction = max_quad_dir(means, max_fetch, names)
+    code = quad_exposure_code(max_fetch, thresholds)
+    original = (max_fetch.copy(), code.copy(), direction.copy())
+
+    # a quadrant with a single water arc cannot hold the maximum: fall back to the
+    # second highest quadrant mean, checked in the same order as Step4
+    second = np.sort(means, axis=1)[:, -2]
+    quad_cnt1 = np.full(len(matrix), None, dtype=object)
+    one_is_max = np.full(len(matrix), None, dtype=object)
+    for q in _ordered(names, ['SE', 'SW', 'NE', 'NW']):
+        j = names.index(q)
+        single = counts[:, j] == 1
+        quad_cnt1[single] = q
+        hit = single & (np.round(means[:, j], 4) == np.round(max_fetch, 4))
+        one_is_max[hit] = SECOND_HIGHEST
+        max_fetch = np.where(hit, second, max_fetch)
+
+    fields = {}
+    for j, q in enumerate(names):
+        fields[q + '_Count'] = counts[:, j].astype(np.int32)
+    for j, q in enumerate(names):
+        fields[q + '_Mean'] = means[:, j]
+    fields.update({'MaxQFetch': max_fetch,
+                   'MxQExpCode': quad_exposure_code(max_fetch, thresholds),
+                   'MaxQuadDir': max_quad_dir(means, max_fetch, names),
+                   'QuadCnt1': quad_cnt1,
+                   'OneIsMax': one_is_max,
+                   'MxQFetchOld': original[0],
+                   'MxQExpCodeO': original[1],
+                   'MaxQDirO': original[2]})
+    return fields
+
+
+def effective_weights(directions, principal=DIRECTIONS, half_angle=EFFECTIVE_HALF_ANGLE):
+
+    """
+    (D, P) cosine of the angle between each ray direction and each principal direction,
+    0 beyond half_angle.
+    """
+
+    offset = direction_bearings(directions)[:, None] - direction_bearings(principal)[None, :]
+    offset = np.radians((offset + 180.0) % 360.0 - 180.0)
+    return np.where(np.abs(offset) <= np.radians(half_angle) + 1e-9, np.cos(offset), 0.0)
+
+
+def effective_fetch(matrix, directions=DIRECTIONS, principal=DIRECTIONS, half_angle=EFFECTIVE_HALF_ANGLE):
+
+    """
+    SPM/CERC effective fetch: sum(F_i cos^2 a_i) / sum(cos a_i) over the rays within
+    half_angle of each principal direction, rays without water counting as 0.
+
+    matrix: (N, D) fetch lengths (fetch.fetch_matrix)
+    directions: the D direction names of the matrix columns
+    principal: names of the principal directions, the 16 compass directions by default
+    Returns an (N, P) array.
+    """
+
+    weights = effective_weights(directions, principal, half_angle)
+    return np.asarray(matrix, dtype=np.float32) @ (weights ** 2 / weights.sum(axis=0)).astype(np.float32)
+
+
+def fetch_analysis(ids, matrix, directions=DIRECTIONS, thresholds=(LOW_FETCH, HIGH_FETCH), quadrants=None,
+                   principal=DIRECTIONS, longest=None):
+
+    """
+    All Step4 attributes for each ID: the direction fields, MAX_Shape_Length, maxDir,
+    exposure and the quadrant fields, as one DataFrame ready to join on ID.
+    longest: (N, D) length of the longest single arc per ID and direction (fetch_matrix with
+        reduce="max"); Step4 takes MAX_Shape_Length and maxDir from the individual arcs, which
+        differs from the summed matrix where an ID has several arcs in one direction.
+        Defaults to matrix.
+    The effective fetch along each principal direction (EF_<direction>) follows, with its
+    maximum and direction (MaxEffFetch, MaxEffDir) next to MaxQFetch; principal=None leaves them out.
+    """
+
+    matrix = np.asarray(matrix, dtype=np.float32)
+    has_arcs = (matrix > 0).any(axis=1)
+
+    table = pd.DataFrame(np.where(has_arcs[:, None], matrix, np.nan), columns=directions)
+    table.insert(0, 'ID', np.asarray(ids))
+    longest = matrix if longest is None else np.asarray(longest, dtype=np.float32)
+    table['MAX_Shape_Length'] = np.where(has_arcs, longest.max(axis=1), np.nan)
+    table['maxDir'] = np.where(has_arcs, np.asarray(directions, dtype=object)[longest.argmax(axis=1)], None)
+    table['exposure'] = exposure_class(table['MAX_Shape_Length'].values, thresholds)
+
+    for field, values in quadrant_analysis(matrix, directions, quadrants, thresholds).items():
+        table[field] = values
+
+    if principal is not None:
+        effective = effective_fetch(matrix, directions, principal)
+        at = table.columns.get_loc('MaxQFetch') + 1
+        table.insert(at, 'MaxEffFetch', effective.max(axis=1).astype(np.float64))
+        table.insert(at + 1, 'MaxEffDir', np.where(has_arcs, np.asarray(principal, dtype=object)[effective.argmax(axis=1)],
+                                                   None))
+        for j, d in enumerate(principal):
+            table['EF_' + d] = effective[:, j].astype(np.float64)
+    return table
@@ -0,0 +1,167 @@
+# Analytic bearing-ray generator.
+#
+# Step1 builds the 16 directions by copying the center points 15 times,
+# calculating degrees/direction on every copy, appending them and running
+# BearingDistanceToLine. Here the N x D ray endpoints are computed in one array
+# operation (pyproj batch geodesic forward for GEODESIC mode) and the rays can be
+# handed to the fetch engine in batches, so the full BearingDistance feature
+# class never has to be materialized.
+#
+# Any angular step that divides 360 can be used instead of the 16 directions
+# (angular_directions): the directions are then named after their bearing
+# (d000, d010, ... or d002_5 for 2.5 degrees), which keeps them valid field
+# names, and the batches hold fewer points so the rays per batch stay the same.
+
+import numpy as np
+import shapely
+import geopandas as gpd
+from pyproj import CRS, Geod, Transformer
+
+
+# The 16 compass directions used by Step1, in bearing order (0, 22.5, ... 337.5)
+DIRECTIONS = ['n', 'nne', 'ne', 'ene', 'e', 'ese', 'se', 'sse',
+              's', 'ssw', 'sw', 'wsw', 'w', 'wnw', 'nw', 'nnw']
+BEARINGS = np.arange(len(DIRECTIONS)) * 22.5
+COMPASS_STEP = 22.5
+
+
+def direction_name(bearing):
+    whole, fraction = ("%.6f" % bearing).split('.')
+    fraction = fraction.rstrip('0')
+    return 'd' + whole.zfill(3) + ('_' + fraction if fraction else '')
+
+
+def angular_directions(step=COMPASS_STEP):
+
+    """
+    Direction names and bearings every `step` degrees from north.
+    The Step1 compass names for 22.5; d000, d010, ... (d002_5, d001_25 for fractional bearings) otherwise.
+    Raises ValueError for steps that do not divide 360 or whose bearings the names cannot hold
+    exactly (more than 6 decimals, e.g. 360 / 7).
+    Returns (directions, bearings).
+    """
+
+    step = float(step)
+    count = 360.0 / step if step > 0 else 0.0
+    if step <= 0 or abs(count - round(count)) > 1e-9:
+        raise ValueError("angular step must divide 360 degrees: " + str(step))
+    if step == COMPASS_STEP:
+        return list(DIRECTIONS), BEARINGS.copy()
+    bearings = np.arange(int(round(count))) * step
+    directions = [direction_name(b) for b in bearings]
+    if np.abs(direction_bearings(directions) - bearings).max() > 1e-9:
+        raise ValueError("angular step has more decimals than the direction names can hold: " + str(step))
+    return directions, bearings
+
+
+def direction_bearings(directions):
+
+    """
+    Bearings in degrees of direction names from angular_directions (compass or dNNN names).
+    """
+
+    compass = dict(zip(DIRECTIONS, BEARINGS))
+    return np.array([compass[d] if d in compass else float(d[1:].replace('_', '.')) for d in directions])
+
+
+def ray_vertices(x, y, distance, bearings=BEARINGS, method='GEODESIC', crs=None, densify=2):
+
+    """
+    Vertices of the rays leaving every point along every bearing.
+
+    x, y: (N,) center point coordinates (POINT_X, POINT_Y) in `crs`
+    distance: ray length in meters, scalar or (N,) like the Step1 distance field
+    bearings: (D,) degrees clockwise from north
+    method: "GEODESIC" (as in Step1's BearingDistanceToLine) or "PLANAR"
+    crs: CRS of x, y, required for GEODESIC
+    densify: number of vertices per ray; more than 2 follows the geodesic curve
+    Returns an (N, D, densify, 2) array of coordinates in `crs`.
+    """
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    distance = np.broadcast_to(np.asarray(distance, dtype=np.float64), x.shape)
+    bearings = np.asarray(bearings, dtype=np.float64)
+    fractions = np.linspace(0.0, 1.0, densify)
+
+    # (N, D, V) distance of every vertex from its origin
+    d = np.broadcast_to(distance[:, None, None] * fractions[None, None, :], (len(x), len(bearings), densify))
+    azimuth = np.broadcast_to(bearings[None, :, None], d.shape)
+
+    if method.upper() == 'PLANAR':
+        theta = np.radians(azimuth)
+        vx = x[:, None, None] + d * np.sin(theta)
+        vy = y[:, None, None] + d * np.cos(theta)
+        return np.stack([vx, vy], axis=-1)
+
+    crs = CRS.from_user_input(crs)
+    geographic = crs.geodetic_crs
+    to_geographic = Transformer.from_crs(crs, geographic, always_xy=True)
+    from_geographic = Transformer.from_crs(geographic, crs, always_xy=True)
+
+    lon, lat = to_geographic.transform(x, y)
+    lon = np.broadcast_to(lon[:, None, None], d.shape)
+    lat = np.broadcast_to(lat[:, None, None], d.shape)
+
+    geod = Geod(ellps='GRS80')
+    vlon, vlat, _ = geod.fwd(lon.ravel(), lat.ravel(), azimuth.ravel(), d.ravel())
+    vx, vy = from_geographic.transform(vlon, vlat)
+    return np.stack([vx, vy], axis=-1).reshape(d.shape + (2,))
+
+
+def points_per_batch(batch_size, n_dir):
+
+    """
+    Center points per batch for n_dir directions, batch_size being the count for the 16
+    Step1 directions, so that the number of rays (and memory) per batch does not grow with D.
+    """
+
+    return max(1, batch_size * len(DIRECTIONS) // n_dir)
+
+
+def iter_rays(ids, x, y, distance, batch_size=20000, bearings=BEARINGS, directions=DIRECTIONS,
+              method='GEODESIC', crs=None, densify=2):
+
+    """
+    Lazily generate the Step1 bearing rays, about `batch_size` center points at a time
+    (fewer with more than 16 directions, see points_per_batch).
+
+    Yields (ids, directions, rays, origins) batches in the layout fetch.water_arcs takes,
+    with the D rays of each point in consecutive rows.
+    """
+
+    ids = np.asarray(ids)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    distance = np.broadcast_to(np.asarray(distance, dtype=np.float64), x.shape)
+    n_dir = len(bearings)
+    batch_size = points_per_batch(batch_size, n_dir)
+
+    for lo in range(0, len(ids), batch_size):
+        window = slice(lo, lo + batch_size)
+        vertices = ray_vertices(x[window], y[window], distance[window], bearings, method, crs, densify)
+        rays = shapely.linestrings(vertices.reshape(-1, densify, 2))
+        origins = np.repeat(shapely.points(x[window], y[window]), n_dir)
+        yield (np.repeat(ids[window], n_dir), np.tile(np.asarray(directions, dtype=object), len(ids[window])),
+               rays, origins)
+
+
+def bearing_frame(center_points, distance, id_field='ID', method='GEODESIC', densify=2,
+                  bearings=BEARINGS, directions=DIRECTIONS):
+
+    """
+    Materialize the BearingDistance_arcs layer of Step1 (ID, distance, degrees, direction)
+    for the cases that still need it as a feature class, e.g. the Step2 water arcs template.
+    """
+
+    x = center_points.geometry.x.values
+    y = center_points.geometry.y.values
+    vertices = ray_vertices(x, y, distance, bearings, method, center_points.crs, densify)
+    n_dir = len(bearings)
+
+    return gpd.GeoDataFrame({id_field: np.repeat(center_points[id_field].values, n_dir),
+                             'distance': np.repeat(np.broadcast_to(distance, x.shape), n_dir),
+                             'degrees': np.tile(np.asarray(bearings, dtype=np.float64), len(x)),
+                             'direction': np.tile(np.asarray(directions, dtype=object), len(x))},
+                            geometry=shapely.linestrings(vertices.reshape(-1, densify, 2)),
+                            crs=center_points.crs)
@@ -0,0 +1,193 @@
+# Multi-core sharding of the Step3 ID range.
+#
+# Replaces launching several ArcPro sessions with hand-picked FromValue/ToValue
+# ranges: the ID range is split into contiguous shards of roughly equal cost,
+# each shard runs in its own process and writes to its own scratch GeoPackage,
+# and the shards are merged into one water arcs dataset at the end.
+
+import os
+import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import shapely
+import geopandas as gpd
+
+from utils import fetch
+from utils import fetch_raster
+from utils import distance_field
+from utils import first_hit
+from utils import rays
+from utils import store
+from utils import telemetry
+
+
+def complexity_weights(x, y, landwater, radius=1000.0):
+
+    """
+    Estimate the Step3 cost of each center point from the shoreline around it.
+
+    x, y: (N,) center point coordinates
+    landwater: GeoDataFrame of the {name}_LandWaterPoly_{date} layer
+    radius: size of the neighbourhood, in map units
+    The land/water polygon vertices are binned on a grid of `radius` cells and each
+    point is weighted by the vertex count of its cell and the 8 around it, plus one
+    so that points in open water still cost something.
+    """
+
+    vertices = shapely.get_coordinates(shapely.boundary(np.asarray(landwater.geometry.values, dtype=object)))
+    minx, miny, maxx, maxy = landwater.total_bounds
+    nx = max(int(np.ceil((maxx - minx) / radius)), 1)
+    ny = max(int(np.ceil((maxy - miny) / radius)), 1)
+
+    counts, _, _ = np.histogram2d(vertices[:, 0], vertices[:, 1], bins=(nx, ny),
+                                  range=((minx, minx + nx * radius), (miny, miny + ny * radius)))
+
+    # 3x3 neighbourhood sum
+    padded = np.pad(counts, 1)
+    neighbourhood = sum(padded[i:i + nx, j:j + ny] for i in range(3) for j in range(3))
+
+    ix = np.clip(((np.asarray(x) - minx) // radius).astype(np.int64), 0, nx - 1)
+    iy = np.clip(((np.asarray(y) - miny) // radius).astype(np.int64), 0, ny - 1)
+    return neighbourhood[ix, iy] + 1.0
+
+
+def balanced_shards(ids, weights, n_shards):
+
+    """
+    Split the ID range into contiguous (FromValue, ToValue) shards of equal total weight.
+
+    Shards stay contiguous in ID, like the hand-made ranges, so neighbouring
+    center points (and the polygons their rays touch) end up in the same worker.
+    """
+
+    order = np.argsort(ids)
+    ids = np.asarray(ids)[order]
+    cumulative = np.cumsum(np.asarray(weights, dtype=np.float64)[order])
+
+    n_shards = max(min(n_shards, len(ids)), 1)
+    targets = cumulative[-1] * np.arange(1, n_shards) / n_shards
+    cuts = np.unique(np.searchsorted(cumulative, targets, side='right'))
+    cuts = cuts[(cuts > 0) & (cuts < len(ids))]
+
+    bounds = np.concatenate([[0], cuts, [len(ids)]])
+    return [(int(ids[lo]), int(ids[hi - 1])) for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+
+def shard_path(scratch_dir, name, from_value, to_value, date):
+    return os.path.join(scratch_dir, name + "_water_arcs_" + str(from_value) + "_" + str(to_value) + "_" + date + ".parquet")
+
+
+# Per-worker inputs, loaded once by the pool initializer
+_worker = {}
+
+
+def _init_worker(workspace, landwater_layer, bearing_layer, center_layer, mode, grid_path, distance, angle_step):
+    directions, bearings = rays.angular_directions(angle_step)
+    _worker.update(workspace=workspace, bearing_layer=bearing_layer, center_layer=center_layer,
+                   mode=mode, grid_path=grid_path, distance=distance, bearings=bearings, directions=directions)
+    if mode == 'firsthit':
+        _worker['index'] = first_hit.SegmentIndex(store.read_layer(workspace, landwater_layer, columns=['surface']))
+    elif mode not in ('raster', 'distance'):
+        _worker['landwater'] = store.read_layer(workspace, landwater_layer, columns=['surface'])
+
+
+def _run_shard(from_value, to_value, out_path):
+
+    """
+    Worker body: the Step3 loop for one FromValue..ToValue range, written to its own scratch store.
+    """
+
+    id_range = (from_value, to_value)
+    with telemetry.Stage("step3.shard", mode=_worker['mode'], from_value=from_value, to_value=to_value) as stage:
+        center_points = store.read_layer(_worker['workspace'], _worker['center_layer'], columns=['ID'], id_range=id_range)
+        stage.items = len(center_points)
+
+        if _worker['mode'] == 'raster':
+            arcs = fetch_raster.raster_fetch(center_points, _worker['grid_path'], _worker['distance'],
+                                             bearings=_worker['bearings'], directions=_worker['directions'])
+        elif _worker['mode'] == 'distance':
+            arcs = distance_field.distance_water_arcs(center_points, _worker['grid_path'], _worker['distance'],
+                                                      bearings=_worker['bearings'], directions=_worker['directions'])
+        elif _worker['mode'] == 'firsthit':
+            arcs = first_hit.first_hit_water_arcs(center_points, None, _worker['distance'], index=_worker['index'],
+                                                  bearings=_worker['bearings'], directions=_worker['directions'])
+        else:
+            bearing_arcs = store.read_layer(_worker['workspace'], _worker['bearing_layer'], columns=['ID', 'direction'],
+                                            id_range=id_range)
+            arcs = fetch.select_water_arcs(bearing_arcs, center_points, _worker['landwater'])
+
+        arcs.to_parquet(out_path)
+    return out_path
+
+
+def merge_shards(paths):
+
+    """
+    Merge the scratch water arc stores of all shards into one GeoDataFrame ordered by ID.
+    """
+
+    frames = [gpd.read_parquet(path) for path in paths]
+    merged = pd.concat(frames, ignore_index=True)
+    merged = merged.sort_values('ID', kind='stable').reset_index(drop=True)
+    return gpd.GeoDataFrame(merged, geometry='geometry', crs=frames[0].crs)
+
+
+def sharded_water_arcs(workspace, landwater_layer, bearing_layer, center_layer, name, scratch_dir,
+                       workers=None, shards_per_worker=4, mode='vector', resolution=5.0, distance=10000.0,
+                       angle_step=rays.COMPASS_STEP, index_dir=None):
+
+    """
+    Run Step3 over the whole ID range in a process pool and merge the results.
+
+    workspace: FileGDB, GeoPackage or store (utils/store.py) holding the Step1 and Step2 layers
+    scratch_dir: folder for the per-shard stores (and the raster grid in raster mode)
+    workers: number of processes, all cores by default
+    shards_per_worker: more shards than workers lets fast workers pick up the slack
+    mode: "vector" (fetch.select_water_arcs), "raster" (fetch_raster.raster_fetch)
+        or "firsthit" (first_hit.first_hit_fetch) or "distance" (distance_field.trace_fetch)
+    angle_step: degrees between the rays of the raster, distance and firsthit modes (the
+        vector mode uses the rays of the bearing layer)
+    index_dir: shared distance index of the "distance" mode (BuildDistanceIndex.py), only read;
+        without it a private index of the land/water layer is built in the scratch folder
+    Returns the merged water arcs GeoDataFrame (ID, direction, Shape_Length).
+    """
+
+    workers = workers or os.cpu_count()
+    date = datetime.date.today().strftime("%m%d%Y")
+    os.makedirs(scratch_dir, exist_ok=True)
+
+    center_points = store.read_layer(workspace, center_layer, columns=['ID'])
+    landwater = store.read_layer(workspace, landwater_layer, columns=['surface'])
+
+    grid_path = None
+    if mode == 'raster':
+        # rasterize once, every worker maps the same grid file
+        grid_path = os.path.join(scratch_dir, fetch_raster.grid_name(landwater_layer, resolution))
+        fetch_raster.rasterize_landwater(landwater, grid_path, resolution)
+    elif mode == 'distance':
+        # the shared index is never written here, other study areas trace through the same tiles
+        grid_path = index_dir
+        if grid_path is None:
+            grid_path = os.path.join(scratch_dir, "distance_index")
+            distance_field.build_index(landwater, grid_path, resolution)
+        distance_field.open_index(grid_path, resolution).check(center_points.crs, center_points.geometry.x.values,
+                                                               center_points.geometry.y.values)
+
+    weights = complexity_weights(center_points.geometry.x.values, center_points.geometry.y.values, landwater)
+    shards = balanced_shards(center_points['ID'].values, weights, workers * shards_per_worker)
+    del center_points, landwater
+
+    paths = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(workspace, landwater_layer, bearing_layer, center_layer,
+                                       mode, grid_path, distance, angle_step)) as pool:
+        futures = {pool.submit(_run_shard, lo, hi, shard_path(scratch_dir, name, lo, hi, date)): (lo, hi)
+                   for lo, hi in shards}
+        for future in as_completed(futures):
+            lo, hi = futures[future]
+            paths.append(future.result())
+            print("shard " + str(lo) + "-" + str(hi) + " completed (" + str(len(paths)) + "/" + str(len(shards)) + ")")
+
+    return merge_shards(sorted(paths))
@@ -0,0 +1,87 @@
+# Shoreline splitting for Step1 without the intermediate feature classes.
+#
+# Step1 dissolves the shoreline, generates points every Distance along it,
+# splits the line at the points, copies OBJECTID into splitID and ID and takes
+# the center point of every piece, persisting each stage as a feature class.
+# split_shoreline does all of it in one vectorized pass over the vertices of
+# the dissolved lines and returns plain arrays.
+
+import numpy as np
+import shapely
+
+
+def parse_distance(distance):
+
+    """
+    Step1 Distance parameter ("25 Meters", "25", 25) in meters.
+    """
+
+    if isinstance(distance, str):
+        value, _, unit = distance.strip().partition(' ')
+        feet = unit.lower().startswith(('foot', 'feet'))
+        return float(value) * (0.3048 if feet else 1.0)
+    return float(distance)
+
+
+def dissolve_shoreline(lines):
+
+    """
+    Dissolve shoreline arcs into continuous lines (Dissolve DISSOLVE_LINES, one line per part).
+    """
+
+    merged = shapely.line_merge(shapely.union_all(np.asarray(lines, dtype=object)))
+    return shapely.get_parts(merged)
+
+
+def split_shoreline(lines, spacing, start_id=1, dissolve=True):
+
+    """
+    Split the shoreline every `spacing` meters along its length.
+
+    lines: shoreline LineStrings (the Step1 Shoreline layer geometries)
+    spacing: piece length, the Step1 Distance parameter in meters; the last piece of
+        every line is the remainder
+    start_id: first ID, as OBJECTID numbering starts at 1
+    dissolve: dissolve the lines first, as Step1 does; otherwise each line is split on its own
+    Returns (ids, segments, midpoints, bearings): (N,) arrays of the piece IDs (splitID and ID),
+    piece LineStrings, their midpoints along the line and the bearing of each piece from its
+    start to its end in degrees clockwise from north.
+    """
+
+    parts = dissolve_shoreline(lines) if dissolve else np.asarray(lines, dtype=object)
+    lengths = shapely.length(parts)
+    pieces = np.maximum(np.ceil(lengths / spacing).astype(np.int64), 1)
+
+    # piece table: its line, and the measures where it starts and ends
+    line = np.repeat(np.arange(len(parts)), pieces)
+    first_piece = np.cumsum(pieces) - pieces
+    k = np.arange(len(line)) - first_piece[line]
+    lo = k * spacing
+    hi = np.minimum(lo + spacing, lengths[line])
+
+    # line vertices with their measure along the line
+    coords, vertex_line = shapely.get_coordinates(parts, return_index=True)
+    step = np.r_[0.0, np.hypot(*np.diff(coords, axis=0).T)]
+    line_start = np.r_[True, vertex_line[1:] != vertex_line[:-1]]
+    line_end = np.r_[line_start[1:], True]
+    step[line_start] = 0.0
+    measure = np.cumsum(step)
+    measure -= measure[np.searchsorted(vertex_line, vertex_line)]
+
+    # interior vertices go to the piece covering them; cut points start and end pieces
+    vertex_piece = first_piece[vertex_line] + np.minimum((measure // spacing).astype(np.int64),
+                                                         pieces[vertex_line] - 1)
+    interior = (measure > lo[vertex_piece]) & (measure < hi[vertex_piece]) & ~line_start & ~line_end
+    starts = shapely.get_coordinates(shapely.line_interpolate_point(parts[line], lo))
+    ends = shapely.get_coordinates(shapely.line_interpolate_point(parts[line], hi))
+
+    piece = np.concatenate([np.arange(len(line)), vertex_piece[interior], np.arange(len(line))])
+    position = np.concatenate([lo, measure[interior], hi])
+    xy = np.vstack([starts, coords[interior], ends])
+    order = np.lexsort((position, piece))
+    segments = shapely.linestrings(xy[order], indices=piece[order])
+
+    midpoints = shapely.line_interpolate_point(parts[line], (lo + hi) / 2)
+    bearings = np.degrees(np.arctan2(ends[:, 0] - starts[:, 0], ends[:, 1] - starts[:, 1])) % 360.0
+    ids = np.arange(start_id, start_id + len(line))
+    return ids, segments, midpoints, bearings
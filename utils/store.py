@@ -0,0 +1,122 @@
+# Columnar intermediate store for the fetch pipeline.
+#
+# A workspace whose path ends in ".store" is a folder of one file per layer
+# instead of a FileGDB/GeoPackage: feature layers (center points, rays, water
+# arcs, ...) are GeoParquet, read memory-mapped and only for the columns a step
+# asks for, and the per-direction fetch matrix is an uncompressed Arrow IPC file
+# that maps straight into an (N, D) array without copying. read_layer and
+# write_layer take either kind of workspace, so the scripts run unchanged on
+# a FileGDB and skip its writes on large runs by pointing at a store.
+
+import os
+import json
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import geopandas as gpd
+
+from utils.rays import DIRECTIONS
+
+
+STORE_SUFFIX = ".store"
+
+
+def is_store(workspace):
+    return str(workspace).rstrip("/\\").lower().endswith(STORE_SUFFIX)
+
+
+def driver(workspace):
+
+    """
+    OGR driver of a FileGDB/GeoPackage workspace.
+    """
+
+    return "OpenFileGDB" if str(workspace).lower().endswith(".gdb") else "GPKG"
+
+
+def layer_path(workspace, layer, extension=".parquet"):
+    return os.path.join(workspace, layer + extension)
+
+
+def read_layer(workspace, layer, columns=None, ignore_geometry=False, id_range=None, id_field='ID'):
+
+    """
+    Read a layer from a store or a FileGDB/GeoPackage.
+
+    columns: attribute columns to read (all when None); geometry comes with them unless ignore_geometry
+    id_range: (from, to) to read only the rows with from <= ID <= to
+    """
+
+    if not is_store(workspace):
+        where = None
+        if id_range is not None:
+            where = id_field + " >= " + str(id_range[0]) + " AND " + id_field + " <= " + str(id_range[1])
+        return gpd.read_file(workspace, layer=layer, columns=columns, ignore_geometry=ignore_geometry, where=where)
+
+    path = layer_path(workspace, layer)
+    filters = None
+    if id_range is not None:
+        filters = [(id_field, '>=', id_range[0]), (id_field, '<=', id_range[1])]
+    if ignore_geometry:
+        return pd.read_parquet(path, columns=columns, filters=filters, memory_map=True)
+    if columns is not None:
+        columns = list(columns) + ['geometry']
+    return gpd.read_parquet(path, columns=columns, filters=filters, memory_map=True)
+
+
+def write_layer(frame, workspace, layer):
+
+    """
+    Write a (Geo)DataFrame as a layer of a store (GeoParquet) or of a FileGDB/GeoPackage.
+    """
+
+    if not is_store(workspace):
+        frame.to_file(workspace, layer=layer, driver=driver(workspace))
+        return
+
+    os.makedirs(workspace, exist_ok=True)
+    path = layer_path(workspace, layer)
+    frame.to_parquet(path + '.part', index=False)
+    os.replace(path + '.part', path)
+
+
+def write_matrix(workspace, name, ids, matrix, directions=DIRECTIONS):
+
+    """
+    Store a fetch matrix as an uncompressed Arrow IPC file: an ID column and a fixed size
+    list column of the D fetch lengths per ID, with the direction names in the metadata.
+    """
+
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    fetch = pa.FixedSizeListArray.from_arrays(pa.array(matrix.ravel()), matrix.shape[1])
+    table = pa.table({'ID': pa.array(np.asarray(ids, dtype=np.int64)), 'fetch': fetch})
+    table = table.replace_schema_metadata({'directions': json.dumps(list(directions))})
+
+    os.makedirs(workspace, exist_ok=True)
+    path = layer_path(workspace, name, '.arrow')
+    with pa.OSFile(path + '.part', 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(path + '.part', path)
+
+
+def read_matrix(workspace, name, directions=None):
+
+    """
+    Memory-map a fetch matrix written by write_matrix.
+
+    directions: names of the directions to return, all when None
+    Returns (ids, matrix, directions); ids and matrix are read-only views of the file.
+    """
+
+    reader = pa.ipc.open_file(pa.memory_map(layer_path(workspace, name, '.arrow')))
+    table = reader.read_all()
+    stored = json.loads(table.schema.metadata[b'directions'])
+
+    ids = table.column('ID').combine_chunks().to_numpy(zero_copy_only=True)
+    fetch = table.column('fetch').combine_chunks()
+    matrix = fetch.values.to_numpy(zero_copy_only=True).reshape(len(fetch), len(stored))
+
+    if directions is None:
+        return ids, matrix, stored
+    return ids, matrix[:, [stored.index(d) for d in directions]], list(directions)
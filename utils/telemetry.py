@@ -0,0 +1,283 @@
+# Per-stage telemetry for the fetch and raster scripts.
+#
+# A stage is a block of work wrapped in `with telemetry.Stage("step3.water_arcs"):`
+# (or a function decorated with @telemetry.timed). On exit it records its wall
+# time, CPU time (its own and that of the worker processes it waited for), peak
+# resident memory sampled every 10 ms, bytes read and written by the process,
+# and the number of features or pixels it processed, and appends them as one
+# JSON line to the file named by TMI_TELEMETRY ("-" for stderr). When neither
+# TMI_TELEMETRY nor a matching TMI_PROFILE is set, a stage only keeps its place
+# in the stage stack: no sampler, no counters, no record. Worker processes
+# inherit the setting and the run ID, so the records of a parallel run end up
+# in the same file.
+#
+# Profiling one stage: TMI_PROFILE is a pattern of stage names (fnmatch, e.g.
+# "step3*"); matching stages are run under cProfile (<stage>_<pid>.prof, for
+# pstats or snakeviz) or, with TMI_PROFILER=sample, under a sampling profiler
+# that writes folded stacks (<stage>_<pid>.folded, for flamegraph.pl or
+# speedscope), in TMI_PROFILE_DIR (the working directory by default). Stages
+# nested in a profiled stage are part of its profile and are not profiled again.
+
+import os
+import sys
+import json
+import time
+import uuid
+import fnmatch
+import functools
+import cProfile
+import datetime
+import threading
+import collections
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+# Interval of the memory (and stack) sampler in seconds
+SAMPLE_INTERVAL = 0.01
+
+_local = threading.local()
+
+
+def configure(path=None, profile=None, profiler=None, profile_dir=None):
+
+    """
+    Set the telemetry output and profiling from code instead of the environment.
+    Exported to os.environ so worker processes started afterwards use the same settings.
+
+    path: JSON lines file ("-" for stderr)
+    profile: pattern of the stage names to profile
+    profiler: "cprofile" (default) or "sample"
+    profile_dir: folder of the profiles
+    """
+
+    for var, value in (('TMI_TELEMETRY', path), ('TMI_PROFILE', profile), ('TMI_PROFILER', profiler),
+                       ('TMI_PROFILE_DIR', profile_dir)):
+        if value is not None:
+            os.environ[var] = str(value)
+    run_id()
+
+
+def run_id():
+
+    """
+    ID shared by all the records of a run, including those of its worker processes.
+    """
+
+    if 'TMI_RUN_ID' not in os.environ:
+        os.environ['TMI_RUN_ID'] = uuid.uuid4().hex[:12]
+    return os.environ['TMI_RUN_ID']
+
+
+def rss():
+
+    """
+    Resident set size of this process in bytes (0 where it cannot be read).
+    """
+
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+def io_bytes():
+
+    """
+    (read, written) bytes of this process so far, cache hits included; (0, 0) where unknown.
+    """
+
+    if psutil is not None:
+        try:
+            io = psutil.Process().io_counters()
+            return getattr(io, 'read_chars', io.read_bytes), getattr(io, 'write_chars', io.write_bytes)
+        except (AttributeError, psutil.Error):
+            return 0, 0
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(':') for line in f.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+def cpu_seconds():
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def emit(record):
+
+    """
+    Append a record to the TMI_TELEMETRY file, if set.
+    """
+
+    path = os.environ.get('TMI_TELEMETRY')
+    if not path:
+        return
+    line = json.dumps(record, default=str) + "\n"
+    if path == '-':
+        sys.stderr.write(line)
+    else:
+        with open(path, 'a') as f:
+            f.write(line)
+
+
+def current():
+
+    """
+    The innermost stage running in this thread, or None.
+    """
+
+    stack = getattr(_local, 'stack', None)
+    return stack[-1] if stack else None
+
+
+def count(n):
+
+    """
+    Add n features (or pixels) to the innermost running stage, if any.
+    """
+
+    stage = current()
+    if stage is not None:
+        stage.items = (stage.items or 0) + int(n)
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return os.path.basename(code.co_filename) + ":" + code.co_name
+
+
+class Stage:
+
+    """
+    Context manager measuring one stage. After exit its record is in .record, or None
+    when telemetry and profiling are both off.
+
+    name: stage name, e.g. "step1.split" or "marsh.classify"
+    items: number of features or pixels processed, if known up front; otherwise set
+        .items inside the block or call telemetry.count()
+    unit: what items counts ("features", "pixels", ...)
+    always: measure even when telemetry is off, for callers that read .record themselves
+    fields: extra values copied into the record (study area, parameters, ...)
+    """
+
+    def __init__(self, name, items=None, unit='features', always=False, **fields):
+        self.name = name
+        self.items = items
+        self.unit = unit
+        self.always = always
+        self.fields = fields
+        self.record = None
+
+    def _sample(self):
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            self._peak = max(self._peak, rss())
+            if self._stacks is not None:
+                frame = sys._current_frames().get(self._thread)
+                names = []
+                while frame is not None:
+                    names.append(_frame_name(frame))
+                    frame = frame.f_back
+                self._stacks[";".join(reversed(names))] += 1
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+
+        # only one profiler can be active: a stage inside a profiled stage shows up in its profile
+        pattern = os.environ.get('TMI_PROFILE')
+        profiling = any(s._profile is not None or s._stacks is not None for s in stack)
+        profiler = os.environ.get('TMI_PROFILER', 'cprofile') \
+            if pattern and fnmatch.fnmatch(self.name, pattern) and not profiling else None
+        self._profile = cProfile.Profile() if profiler == 'cprofile' else None
+        self._stacks = collections.Counter() if profiler == 'sample' else None
+
+        self._parent = stack[-1].name if stack else None
+        stack.append(self)
+
+        self._active = self.always or bool(os.environ.get('TMI_TELEMETRY')) or profiler is not None
+        if not self._active:
+            return self
+
+        self._run = run_id()
+        self._thread = threading.get_ident()
+        self._start_rss = self._peak = rss()
+        self._start_io = io_bytes()
+        self._started = datetime.datetime.now().isoformat(timespec='seconds')
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+        self._start_cpu = cpu_seconds()
+        self._start = time.perf_counter()
+        if self._profile is not None:
+            self._profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self._active:
+            _local.stack.remove(self)
+            return False
+        if self._profile is not None:
+            self._profile.disable()
+        wall = time.perf_counter() - self._start
+        cpu = cpu_seconds() - self._start_cpu
+        self._stop.set()
+        self._sampler.join()
+        read, written = io_bytes()
+        _local.stack.remove(self)
+
+        record = {'run': self._run, 'script': os.path.basename(sys.argv[0]) if sys.argv else None,
+                  'pid': os.getpid(), 'stage': self.name, 'parent': self._parent, 'start': self._started,
+                  'wall_s': round(wall, 4), 'cpu_s': round(cpu, 4),
+                  'peak_rss_mb': round(max(self._peak, rss()) / 2 ** 20, 1),
+                  'rss_growth_mb': round((max(self._peak, rss()) - self._start_rss) / 2 ** 20, 1),
+                  'bytes_read': read - self._start_io[0], 'bytes_written': written - self._start_io[1],
+                  'items': self.items, 'unit': self.unit,
+                  'items_per_s': round(self.items / wall, 1) if self.items and wall > 0 else None}
+        record.update(self.fields)
+        if exc_type is not None:
+            record['error'] = repr(exc)
+
+        if self._profile is not None or self._stacks is not None:
+            base = os.path.join(os.environ.get('TMI_PROFILE_DIR', '.'), self.name + "_" + str(os.getpid()))
+            os.makedirs(os.path.dirname(base) or '.', exist_ok=True)
+            if self._profile is not None:
+                record['profile'] = base + ".prof"
+                self._profile.dump_stats(record['profile'])
+            else:
+                record['profile'] = base + ".folded"
+                with open(record['profile'], 'w') as f:
+                    for stack, n in self._stacks.most_common():
+                        f.write(stack + " " + str(n) + "\n")
+
+        self.record = record
+        emit(record)
+        return False
+
+
+def timed(name=None, unit='features', items=None):
+
+    """
+    Decorator running a function as a stage (named after the function by default).
+    items: optional function of the result giving the number of features or pixels, e.g. len
+    """
+
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Stage(name or func.__module__ + "." + func.__name__, unit=unit) as stage:
+                result = func(*args, **kwargs)
+                if items is not None:
+                    stage.items = items(result)
+            return result
+        return wrapper
+    return decorate
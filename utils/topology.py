@@ -0,0 +1,235 @@
+# Line topology for the Step5 small-segment check.
+#
+# Step5 dissolves the final fetch arcs on MxQExpCode, buffers the parts of
+# 25.1 m or less by 0.25 m, intersects the buffers with the end points of all
+# parts and reduces the result with two Frequency tables and a PivotTable to
+# count, per short part, the touching parts of each code. Here the arc end
+# points within 0.25 m of each other are snapped to the nodes of an adjacency
+# graph instead: a dissolved part is a connected component of arcs with the same
+# code, and the parts touching a short part are the parts sharing one of its
+# nodes, all found without buffers or intermediate tables.
+#
+# The same graph orders the arcs along each shoreline path, so the codes can be
+# read as a run-length encoded sequence and short runs embedded in another code
+# replaced automatically (smooth_codes) instead of being checked by hand.
+
+import numpy as np
+import pandas as pd
+import shapely
+import geopandas as gpd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components, depth_first_order
+
+
+CODES = ["low", "moderate", "high"]
+
+# Longest dissolved part checked (m), and the snapping distance of end points (m)
+SMALL_LENGTH = 25.1
+TOLERANCE = 0.25
+
+
+def endpoint_nodes(lines, tolerance=TOLERANCE):
+
+    """
+    Snap the end points of the lines into graph nodes: end points within tolerance of
+    each other (directly or through a chain of such end points) are the same node.
+    Returns (start, end) node numbers, two (N,) int arrays.
+    """
+
+    lines = np.asarray(lines, dtype=object)
+    ends = np.concatenate([shapely.get_point(lines, 0), shapely.get_point(lines, -1)])
+    a, b = shapely.STRtree(ends).query(ends, predicate='dwithin', distance=tolerance)
+    graph = coo_matrix((np.ones(len(a), dtype=np.int8), (a, b)), shape=(len(ends), len(ends)))
+    _, nodes = connected_components(graph, directed=False)
+    return nodes[:len(lines)], nodes[len(lines):]
+
+
+def dissolve_groups(start, end, codes):
+
+    """
+    Dissolved part of every arc: arcs are in the same part when they are linked by
+    shared nodes through arcs of their own code (Dissolve SINGLE_PART on the code).
+    Returns an (N,) array of part numbers 0..P-1.
+    """
+
+    n = len(codes)
+    _, code = np.unique(np.asarray(codes, dtype=str), return_inverse=True)
+    # bipartite graph of arcs and (node, code) pairs; its components are the parts
+    k = code.max() + 1 if n else 1
+    _, vertex = np.unique(np.concatenate([start * k + code, end * k + code]),
+                          return_inverse=True)
+    vertex = vertex.ravel()
+    arcs = np.tile(np.arange(n), 2)
+    size = n + vertex.max() + 1
+    graph = coo_matrix((np.ones(2 * n, dtype=np.int8), (arcs, n + vertex)), shape=(size, size))
+    _, labels = connected_components(graph, directed=False)
+    _, groups = np.unique(labels[:n], return_inverse=True)
+    return groups.ravel()
+
+
+def part_neighbours(groups, start, end, small):
+
+    """
+    (part, touching part) pairs for the parts flagged in `small`, a part counting as touching itself
+    as in Step5, where a short part's own end points fall in its buffer.
+    """
+
+    incidence = pd.DataFrame({'part': np.concatenate([groups, groups]),
+                              'node': np.concatenate([start, end])}).drop_duplicates()
+    pairs = incidence[small[incidence['part'].values]].merge(incidence, on='node', suffixes=('', '_1'))
+    return pairs[['part', 'part_1']].drop_duplicates()
+
+
+def check_small_segments(arcs, code_field='MxQExpCode', max_length=SMALL_LENGTH, tolerance=TOLERANCE):
+
+    """
+    Step5 check: short stretches of shoreline whose fetch code differs from their neighbours.
+
+    arcs: GeoDataFrame of the {name}_fetch_withQuadAnalysis_arcs_{date}_Final layer
+    max_length: dissolved parts up to this length are checked
+    tolerance: end points within this distance of each other are connected
+    Returns the arcs dissolved on code_field (one feature per part, aDisID from 1) with the Step5
+    fields: low, moderate and high count the touching parts of each code (including the part
+    itself), comment is "change to <code>" when two touching parts share a code and
+    "marsh island?" when nothing was flagged, doThis is "qc" when one touching part has a
+    different code, and originalMaxQuadFetch keeps the part's code. They are empty for parts
+    longer than max_length.
+    """
+
+    codes = arcs[code_field].astype(str).values
+    lines = np.asarray(arcs.geometry.values, dtype=object)
+    start, end = endpoint_nodes(lines, tolerance)
+    groups = dissolve_groups(start, end, codes)
+    n_parts = groups.max() + 1 if len(groups) else 0
+
+    first = np.zeros(n_parts, dtype=np.int64)
+    first[groups[::-1]] = np.arange(len(groups))[::-1]
+    part_codes = codes[first]
+    length = np.bincount(groups, weights=shapely.length(lines), minlength=n_parts)
+    order = np.argsort(groups, kind='stable')
+    geometry = shapely.line_merge(shapely.multilinestrings(lines[order], indices=groups[order]))
+    small = length <= max_length
+
+    dissolved = gpd.GeoDataFrame({'aDisID': np.arange(1, n_parts + 1), code_field: part_codes,
+                                  'Shape_Length': length}, geometry=geometry, crs=arcs.crs)
+
+    pairs = part_neighbours(groups, start, end, small)
+    counts = pd.crosstab(pairs['part'], part_codes[pairs['part_1'].values]) \
+        .reindex(index=np.flatnonzero(small), columns=CODES, fill_value=0)
+
+    comment = np.full(n_parts, None, dtype=object)
+    do_this = np.full(n_parts, None, dtype=object)
+    for code in CODES:
+        count = np.zeros(n_parts)
+        count[counts.index.values] = counts[code].values
+        comment[count == 2] = "change to " + code
+        do_this[(count == 1) & (part_codes != code)] = "qc"
+    comment[small & pd.isna(comment) & pd.isna(do_this)] = "marsh island?"
+
+    for code in CODES:
+        dissolved[code] = pd.array([None] * n_parts, dtype="Int64")
+        dissolved.loc[small, code] = counts[code].values
+    dissolved['comment'] = comment
+    dissolved['doThis'] = do_this
+    dissolved['originalMaxQuadFetch'] = np.where(small, part_codes, None)
+    return dissolved
+
+
+def shoreline_order(start, end):
+
+    """
+    Order the arcs along the shoreline paths of the end point graph.
+    Paths start at a loose end (or anywhere on a closed shoreline) and are broken at
+    branches. Returns (order, path, closed): the arc numbers in path order, the path
+    number of each ordered arc, and per path whether it is a closed ring.
+    """
+
+    n = len(start)
+    ends = np.concatenate([start, end])
+    arc = np.tile(np.arange(n), 2)
+    s = np.lexsort((arc, ends))
+    same = (ends[s][1:] == ends[s][:-1]) & (arc[s][1:] != arc[s][:-1])
+    a, b = arc[s][:-1][same], arc[s][1:][same]
+    degree = np.bincount(a, minlength=n) + np.bincount(b, minlength=n)
+
+    # one walk per connected shoreline, from a loose end when it has one
+    _, component = connected_components(coo_matrix((np.ones(len(a)), (a, b)), shape=(n, n)), directed=False)
+    o = np.lexsort((np.arange(n), degree > 1, component))
+    first = o[np.r_[True, component[o][1:] != component[o][:-1]]]
+
+    # a root vertex joined to the first arc of every shoreline walks them all in one depth-first pass
+    rows = np.concatenate([a, np.full(len(first), n)])
+    cols = np.concatenate([b, first])
+    graph = coo_matrix((np.ones(len(rows)), (rows, cols)), shape=(n + 1, n + 1)).tocsr()
+    order = depth_first_order(graph, n, directed=False, return_predecessors=False)[1:]
+
+    def touching(i, j):
+        return (start[i] == start[j]) | (start[i] == end[j]) | (end[i] == start[j]) | (end[i] == end[j])
+
+    new_path = np.r_[True, ~touching(order[:-1], order[1:])]
+    path = np.cumsum(new_path) - 1
+    heads = np.flatnonzero(new_path)
+    tails = np.r_[heads[1:], len(order)] - 1
+    closed = (tails - heads >= 2) & touching(order[heads], order[tails])
+    return order, path, closed
+
+
+def smooth_codes(arcs, code_field='MxQExpCode', min_length=SMALL_LENGTH, tolerance=TOLERANCE):
+
+    """
+    Automatic Step5 correction: runs of one code shorter than min_length (m) with the same
+    other code on both sides along the shoreline take that code, all in one sweep.
+
+    arcs: GeoDataFrame of the {name}_fetch_withQuadAnalysis_arcs_{date}_Final layer
+    Returns a copy of the arcs with code_field corrected; the changed arcs keep their old
+    code in originalMaxQuadFetch and have comment "change to <code>".
+    """
+
+    codes = arcs[code_field].astype(str).values
+    lines = np.asarray(arcs.geometry.values, dtype=object)
+    start, end = endpoint_nodes(lines, tolerance)
+    order, path, closed = shoreline_order(start, end)
+    code = codes[order]
+    length = shapely.length(lines[order])
+
+    # a closed shoreline is rotated to begin at a change of code, so no run wraps around its start
+    head = np.r_[True, path[1:] != path[:-1]]
+    change = np.r_[False, code[1:] != code[:-1]] & ~head
+    position = np.arange(len(order)) - np.flatnonzero(head)[path]
+    shift = np.zeros(len(closed), dtype=np.int64)
+    shift[path[change][::-1]] = position[change][::-1]
+    shift[~closed] = 0
+    size = np.bincount(path)
+    rotated = np.lexsort(((position - shift[path]) % size[path], path))
+    order, code, length = order[rotated], code[rotated], length[rotated]
+
+    # run-length encoding of the codes along every path
+    run_start = np.r_[True, (code[1:] != code[:-1]) | (path[1:] != path[:-1])]
+    run = np.cumsum(run_start) - 1
+    run_code = code[run_start]
+    run_path = path[run_start]
+    run_length = np.bincount(run, weights=length)
+    first_run = np.flatnonzero(np.r_[True, run_path[1:] != run_path[:-1]])
+    last_run = np.r_[first_run[1:], len(run_code)] - 1
+
+    runs = np.arange(len(run_code))
+    before, after = runs - 1, runs + 1
+    at_head, at_tail = runs == first_run[run_path], runs == last_run[run_path]
+    before[at_head] = np.where(closed[run_path[at_head]], last_run[run_path[at_head]], -1)
+    after[at_tail] = np.where(closed[run_path[at_tail]], first_run[run_path[at_tail]], -1)
+    embedded = (before >= 0) & (after >= 0) & (before != runs) & (run_length <= min_length)
+    replace = np.flatnonzero(embedded)
+    replace = replace[(run_code[before[replace]] == run_code[after[replace]])
+                      & (run_code[before[replace]] != run_code[replace])]
+
+    new_run_code = run_code.copy()
+    new_run_code[replace] = run_code[before[replace]]
+    smoothed = np.empty(len(codes), dtype=object)
+    smoothed[order] = new_run_code[run]
+    changed = smoothed != codes
+
+    result = arcs.copy()
+    result[code_field] = smoothed
+    result['originalMaxQuadFetch'] = np.where(changed, codes, None)
+    result['comment'] = np.where(changed, "change to " + smoothed.astype(str), None)
+    return result
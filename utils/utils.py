@@ -2,9 +2,17 @@
 
 import rasterio
 import os
+import hashlib
+import contextlib
 from rasterio.enums import Resampling
 import rasterio
+import rasterio.mask
 import numpy as np
+import shapely
+from rasterio import windows
+from rasterio.features import geometry_mask, geometry_window
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import calculate_default_transform
 
 
 def crop_boundary(intif, inbound):
@@ -20,32 +28,185 @@ def crop_boundary(intif, inbound):
 
     return out_meta, out_image
 
-def upsample(source_path, target_path, method=Resampling.bilinear):
+
+def crop_boundary_to_file(intif, inbound, outtif, blocksize=512, compress='deflate'):
 
     """
-    img_lres_path: low resolution cropped band path
-    img_hres_path: high resolution cropped band path
-    img_size: the size to resample
-    outf: output resampled Bands
+    Block-streaming version of crop_boundary for DEMs too large to crop in memory.
+    intif: input raster path, e.g. the 1 m Chesapeake Bay Topobathy DEM, or an open dataset
+    inbound: list of boundary geometries in the raster CRS
+    outtif: output GeoTIFF, tiled with blocksize x blocksize blocks
+    The DEM's internal blocks inside the boundary window are read, masked and written one
+    at a time, so peak memory is bounded by the block size rather than the county size.
+    Blocks entirely outside the boundary are not read. Returns the output meta.
     """
 
-    dataset_source = rasterio.open(target_path)
-    # target_res_w, target_res_h = dataset_source.res
+    boundary = shapely.union_all(inbound)
+    shapely.prepare(boundary)
+
+    # an open dataset is left open for the caller to reuse
+    opened = contextlib.nullcontext(intif) if isinstance(intif, rasterio.io.DatasetReader) else rasterio.open(intif)
+    with opened as src:
+        crop = geometry_window(src, inbound)
+        block_h, block_w = src.block_shapes[0]
+        nodata = src.nodata if src.nodata is not None else 0
+
+        out_meta = src.meta.copy()
+        out_meta.update({"driver": "GTiff",
+                         "height": crop.height,
+                         "width": crop.width,
+                         "transform": src.window_transform(crop),
+                         "nodata": nodata,
+                         "tiled": True,
+                         "blockxsize": blocksize,
+                         "blockysize": blocksize,
+                         "compress": compress})
+
+        with rasterio.open(outtif, "w", **out_meta) as dest:
+            # only the internal blocks of the DEM that overlap the boundary window
+            for row in range(crop.row_off // block_h * block_h, crop.row_off + crop.height, block_h):
+                for col in range(crop.col_off // block_w * block_w, crop.col_off + crop.width, block_w):
+                    block = windows.Window(col, row, block_w, block_h)
+                    part = block.intersection(crop)
+                    target = windows.Window(part.col_off - crop.col_off, part.row_off - crop.row_off,
+                                            part.width, part.height)
+                    transform = src.window_transform(part)
+
+                    if not shapely.intersects(boundary, shapely.box(*windows.bounds(part, src.transform))):
+                        dest.write(np.full((src.count, part.height, part.width), nodata, dtype=src.dtypes[0]),
+                                   window=target)
+                        continue
+
+                    data = src.read(window=part)
+                    outside = geometry_mask(inbound, out_shape=(part.height, part.width), transform=transform)
+                    data[:, outside] = nodata
+                    dest.write(data, window=target)
 
-    dataset = rasterio.open(source_path)
+    return out_meta
 
-    # resample data to target shape
-    data = dataset.read(
-        out_shape=(
-            dataset.count,
-            int(dataset_source.width),
-            int(dataset_source.height)
-        ),
-        resampling=method
-    )
 
-    meta = dataset_source.meta
-    meta['count'] = dataset.count
+def block_windows(width, height, size=1024):
+
+    """
+    size x size windows covering a width x height grid.
+    """
+
+    for row in range(0, height, size):
+        for col in range(0, width, size):
+            yield windows.Window(col, row, min(size, width - col), min(size, height - row))
+
+
+def warp_scale(src, target):
+
+    """
+    GDAL warp options fixing the resampling ratio (target pixels per source pixel) from the
+    resolutions of the two rasters. Without them GDAL derives the ratio from each requested
+    window, so a downsampling WarpedVRT read window by window differs from one read whole.
+    """
+
+    transform, _, _ = calculate_default_transform(src.crs, target.crs, src.width, src.height, *src.bounds)
+    return {'XSCALE': abs(transform.a / target.transform.a), 'YSCALE': abs(transform.e / target.transform.e)}
+
+
+def upsample(source_path, target_path, method=Resampling.bilinear):
+
+    """
+    source_path: raster to resample, e.g. the cropped DEM
+    target_path: raster whose grid (CRS, transform, width, height) the output follows
+    method: resampling method
+    Returns the target meta (with the source band count) and the resampled array,
+    shaped (count, height, width) and aligned with the target grid.
+    """
+
+    with rasterio.open(target_path) as dataset_source, rasterio.open(source_path) as dataset:
+        with WarpedVRT(dataset, crs=dataset_source.crs, transform=dataset_source.transform,
+                       width=dataset_source.width, height=dataset_source.height, resampling=method,
+                       **warp_scale(dataset, dataset_source)) as vrt:
+            data = vrt.read()
+
+        meta = dataset_source.meta.copy()
+        meta['count'] = dataset.count
+        meta['dtype'] = dataset.dtypes[0]
+        meta['nodata'] = dataset.nodata
 
     return meta, data
 
+
+def file_hash(path, chunk=1 << 20):
+
+    """
+    SHA-1 of the bytes of a file, read chunk by chunk.
+    """
+
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def grid_key(source_path, target_path, method=Resampling.bilinear):
+
+    """
+    Cache key of a resampling, "<grid>_<content>": the target grid (CRS, transform, width,
+    height) and resampling method, then the bytes of the source file. The content part is
+    the same however often the source is rewritten (e.g. the cropped DEM of every run), as
+    long as it holds the same data.
+    """
+
+    with rasterio.open(target_path) as target:
+        grid = (target.crs.to_wkt() if target.crs else '', tuple(target.transform), target.width, target.height)
+
+    # "scale": outputs of the fixed resampling ratio of warp_scale
+    grid = hashlib.sha1(repr((grid, Resampling(method).name, 'scale')).encode('utf-8')).hexdigest()[:12]
+    return grid + "_" + file_hash(source_path)[:12]
+
+
+def warp_to_grid(source_path, target_path, out_path, method=Resampling.bilinear, blocksize=1024):
+
+    """
+    Warp the source raster onto the exact grid of the target raster, window by window,
+    into a tiled GeoTIFF. Peak memory is one window.
+    """
+
+    with rasterio.open(target_path) as target, rasterio.open(source_path) as src:
+        meta = target.meta.copy()
+        meta.update({"driver": "GTiff", "count": src.count, "dtype": src.dtypes[0], "nodata": src.nodata,
+                     "tiled": True, "blockxsize": 256, "blockysize": 256, "compress": "deflate"})
+
+        with WarpedVRT(src, crs=target.crs, transform=target.transform, width=target.width,
+                       height=target.height, resampling=method, **warp_scale(src, target)) as vrt, \
+                rasterio.open(out_path, "w", **meta) as dest:
+            for window in block_windows(target.width, target.height, blocksize):
+                dest.write(vrt.read(window=window), window=window)
+
+    return meta
+
+
+def cached_warp_to_grid(source_path, target_path, cache_dir, method=Resampling.bilinear):
+
+    """
+    warp_to_grid with an on-disk cache: repeated runs against the same source, target grid
+    and method reuse the earlier output instead of resampling again.
+    Returns the path of the resampled raster.
+    """
+
+    os.makedirs(cache_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(source_path))[0]
+    key = grid_key(source_path, target_path, method)
+    out_path = os.path.join(cache_dir, name + "_" + key + ".tif")
+
+    if not os.path.exists(out_path):
+        # write under a temporary name so an interrupted run never leaves a partial cache entry
+        tmp_path = out_path + ".part.tif"
+        warp_to_grid(source_path, target_path, tmp_path, method)
+        os.replace(tmp_path, out_path)
+
+        # drop the entries of earlier versions of the source on the same grid
+        superseded = name + "_" + key.split("_")[0] + "_"
+        for entry in os.listdir(cache_dir):
+            if entry.startswith(superseded) and entry.endswith(".tif") and not entry.endswith(".part.tif") \
+                    and entry != os.path.basename(out_path):
+                os.remove(os.path.join(cache_dir, entry))
+
+    return out_path